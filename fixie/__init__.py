@@ -26,8 +26,20 @@ __version__ = '0.0.4'
 
 import fixie.jsonutils as json
 from fixie.logger import LOGGER
+from fixie.metrics import METRICS
+from fixie.jobidset import JobidSet
 from fixie.environ import ENV, ENVVARS
 from fixie.request_handler import RequestHandler
-from fixie.tools import (fetch, verify_user, flock, next_jobid, detached_call,
-    waitpid, register_job_alias, jobids_from_alias, jobids_with_name,
-    default_path)
+from fixie.response_cache import RESPONSE_CACHE, cached
+from fixie.tools import (fetch, verify_user, flock, next_jobid, next_jobids,
+    detached_call, waitpid, register_job_alias, register_job_aliases,
+    remove_job_aliases, jobids_from_alias, jobids_of_user, jobids_with_name,
+    default_path, next_jobids_async, register_job_aliases_async,
+    remove_job_aliases_async)
+from fixie.reaper import Reaper, register_expiry, register_expiries
+from fixie.results import RESULT_CACHE, input_hash
+from fixie.layout import shard_path, storage_path
+from fixie.jobstatus import JOB_EVENTS, JobStatusHandler
+from fixie.batch import submit_batch
+from fixie.download import DownloadHandler
+from fixie.registry import REGISTRY
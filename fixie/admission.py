@@ -0,0 +1,110 @@
+"""Admission control for fixie servers.
+
+Requests are checked against the limits on in-flight requests
+($FIXIE_MAX_INFLIGHT), request body size ($FIXIE_MAX_BODY_SIZE), and per-user
+request rate ($FIXIE_RATE_LIMIT and $FIXIE_RATE_BURST) before their bodies are
+parsed or validated, so that an overloaded server sheds load cheaply instead
+of slowing down for everyone.
+"""
+import time
+
+from fixie.environ import ENV
+from fixie.metrics import METRICS
+
+
+class TokenBucket:
+    """A token bucket that refills at rate tokens per second, up to burst tokens."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self, now=None):
+        """Takes a token from the bucket. Returns zero if a token was available,
+        and otherwise the number of seconds until one will be.
+        """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def full(self, now=None):
+        """Returns whether the bucket has refilled completely."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted."""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class Admission:
+    """Tracks the requests in flight and the per-user rates of this process."""
+
+    # number of buckets above which idle buckets are dropped
+    max_buckets = 10000
+
+    def __init__(self):
+        self.inflight = 0
+        self.buckets = {}
+
+    def admit(self, key, length=0):
+        """Admits a request from key (a user name or an address) with a body of
+        length bytes, or raises Rejected. Each admitted request must be released.
+        """
+        max_body_size = ENV.get('FIXIE_MAX_BODY_SIZE', 0)
+        if max_body_size > 0 and length > max_body_size:
+            self._reject('body', 413, 'Request body is larger than {0} bytes.'.format(
+                         max_body_size))
+        max_inflight = ENV.get('FIXIE_MAX_INFLIGHT', 0)
+        if max_inflight > 0 and self.inflight >= max_inflight:
+            self._reject('inflight', 503, 'Server is overloaded.', 1)
+        rate = ENV.get('FIXIE_RATE_LIMIT', 0.0)
+        if rate > 0.0:
+            wait = self._bucket(key, rate).take()
+            if wait > 0.0:
+                self._reject('rate', 429, 'Too many requests.', max(1, int(wait + 0.999)))
+        self.inflight += 1
+
+    def release(self):
+        """Releases an admitted request."""
+        self.inflight -= 1
+
+    def _bucket(self, key, rate):
+        burst = max(1, ENV.get('FIXIE_RATE_BURST', 1))
+        bucket = self.buckets.get(key, None)
+        if bucket is None:
+            if len(self.buckets) >= self.max_buckets:
+                self.prune()
+            bucket = self.buckets[key] = TokenBucket(rate, burst)
+        else:
+            bucket.rate, bucket.burst = rate, burst
+        return bucket
+
+    def prune(self):
+        """Drops the buckets of users that have been idle long enough to refill."""
+        now = time.monotonic()
+        for key in [k for k, b in self.buckets.items() if b.full(now)]:
+            del self.buckets[key]
+
+    def _reject(self, reason, status, message, retry_after=None):
+        METRICS.inc('fixie_rejected_total', reason=reason)
+        raise Rejected(status, message, retry_after)
+
+
+ADMISSION = Admission()
@@ -0,0 +1,110 @@
+"""Batch job submission, for parameter sweeps that launch many jobs at once.
+
+Submitting a batch takes one locked operation to allocate all of the jobids
+and one write to register all of the aliases, rather than one of each per job.
+The processes are then launched in parallel, by at most $FIXIE_NJOBS threads.
+These only send the jobs to the shared supervisor server (see
+``fixie.supervisor``), which forks their supervisors, so no thread forks the
+server, and no launch starts a new interpreter.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fixie.environ import ENV
+from fixie.logger import LOGGER
+from fixie.tools import (next_jobids, register_job_aliases, remove_job_aliases,
+    detached_call, JOB_EVENTS)
+from fixie.registry import REGISTRY
+from fixie.layout import storage_path
+from fixie.reaper import register_expiries
+
+
+def _launch(jobid, job):
+    kwargs = {k: job[k] for k in ('stdout', 'stderr', 'stdin', 'env') if k in job}
+    try:
+        pid = detached_call(job['args'], jobid=jobid, watch=False, **kwargs)
+    except Exception as e:
+        return 0, str(e)
+    if pid == 0:
+        return 0, 'process could not be started'
+    return pid, ''
+
+
+def submit_batch(jobs, max_workers=None, watch=True, timeout=None, sleepfor=0.1,
+                 raise_errors=True):
+    """Submits a batch of jobs.
+
+    Parameters
+    ----------
+    jobs : list of dicts
+        The jobs to submit. Each job has an 'args' list, which is passed to
+        ``detached_call()``, and an optional 'user', 'name', and 'project' to
+        alias the job by, and 'path' of its output. The jobs are recorded in the
+        job registry, and the outputs of launched jobs in the expiry index. The 'stdout', 'stderr', 'stdin', and 'env' keys are
+        also passed through to ``detached_call()``, if present.
+    max_workers : int or None, optional
+        Maximum number of processes launched at once, if None, defaults to
+        $FIXIE_NJOBS.
+    watch : bool, optional
+        Whether to publish the status events of the launched jobs to
+        ``JOB_EVENTS``. This must be called on the IOLoop thread if True.
+    timeout, sleepfor, raise_errors : optional
+        Passed to the locking functions.
+
+    Returns
+    -------
+    results : list of dicts or None
+        One result per job, in order, with 'jobid', 'pid', 'status' (whether the
+        job was launched), and 'message' keys. None if the jobids, aliases, or
+        registry records could not be obtained in time.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    jobids = next_jobids(len(jobs), timeout=timeout, sleepfor=sleepfor,
+                         raise_errors=raise_errors)
+    if jobids is None:
+        return None
+    aliases = [(jobid, job['user'], job.get('name', ''), job.get('project', ''))
+               for jobid, job in zip(jobids, jobs) if 'user' in job]
+    if aliases and not register_job_aliases(aliases, timeout=timeout, sleepfor=sleepfor,
+                                            raise_errors=raise_errors):
+        return None
+    records = [{'jobid': jobid, 'user': job.get('user', ''), 'name': job.get('name', ''),
+                'project': job.get('project', ''), 'path': job.get('path', '')}
+               for jobid, job in zip(jobids, jobs)]
+    if not REGISTRY.add_many(records, timeout=timeout, sleepfor=sleepfor,
+                             raise_errors=raise_errors):
+        return None
+    max_workers = ENV['FIXIE_NJOBS'] if max_workers is None else max_workers
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        launched = list(pool.map(_launch, jobids, jobs))
+    results = []
+    failed = []
+    expiries = []
+    for jobid, job, (pid, message) in zip(jobids, jobs, launched):
+        status = pid != 0
+        results.append({'jobid': jobid, 'pid': pid, 'status': status,
+                        'message': message})
+        if not status:
+            failed.append(jobid)
+            continue
+        if job.get('path'):
+            expiries.append((storage_path(job['path']), jobid))
+        if watch:
+            JOB_EVENTS.watch(jobid, pid)
+        else:
+            REGISTRY.transition(jobid, 'running', expected={'submitted'}, pid=pid,
+                                started=time.time(), raise_errors=False)
+    if expiries:
+        register_expiries(expiries, timeout=timeout, sleepfor=sleepfor,
+                          raise_errors=raise_errors)
+    if failed:
+        for jobid in failed:
+            REGISTRY.transition(jobid, 'failed', finished=time.time(), raise_errors=False)
+        remove_job_aliases(failed, timeout=timeout, sleepfor=sleepfor,
+                           raise_errors=raise_errors)
+    LOGGER.log('submitted batch of {0} jobs, {1} failed', category='batch',
+               data={'jobids': [jobids.start, jobids.stop], 'failed': failed},
+               args=(len(jobs), len(failed)))
+    return results
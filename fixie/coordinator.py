@@ -0,0 +1,337 @@
+"""A coordinator for fixie nodes that share $FIXIE_DATA_DIR.
+
+Lock files on a network filesystem are slow and unreliable, and every jobid
+allocation or alias change through them takes several filesystem round trips.
+Instead, one fixie instance may run with $FIXIE_COORDINATOR enabled, so that
+it serves jobid allocation, job aliases, and lock leases over HTTP with the
+handlers in this module. The other nodes set $FIXIE_COORDINATOR_URL to its
+base URL, and then ``next_jobids()``, the alias functions, and ``flock()`` in
+``fixie.tools`` each take a single request to the coordinator.
+
+Lock leases are backed by the coordinator's own lock files, so that they also
+exclude the coordinator's local locks. A lease that has not been released
+after $FIXIE_LEASE_TIME seconds expires, so that a node that crashed while
+holding a lock does not hold it forever. Locks are named by their filenames,
+so $FIXIE_DATA_DIR must have the same path on every node, and only the locks
+of files in $FIXIE_DATA_DIR are leased.
+
+The coordinator takes its own locks on executor threads, rather than on its
+IOLoop, so that while it waits for a lock that a node holds, it can still
+serve the release of that lease.
+
+Every request to the coordinator carries the secret in
+$FIXIE_COORDINATOR_SECRET_FILE, and requests without it are rejected.
+"""
+import os
+import hmac
+import functools
+import time
+import secrets
+import threading
+
+import tornado.ioloop
+
+from fixie.environ import ENV, ensure_parent_dir
+from fixie.logger import LOGGER, WARNING
+from fixie.request_handler import RequestHandler
+from fixie.tools import (fetch_sync, next_jobids, register_job_aliases,
+    remove_job_aliases, jobids_from_alias, jobids_of_user, jobids_with_name,
+    in_data_dir, coordinator_secret)
+
+
+class Leases:
+    """The lock leases that the coordinator has granted."""
+
+    def __init__(self):
+        self.leases = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, name, owner='', ttl=None):
+        """Tries to obtain the lock of a file in $FIXIE_DATA_DIR, without
+        waiting. Returns the (nonzero) token of the lease, or zero if the lock
+        is held. The lease lasts for ttl seconds, at most $FIXIE_LEASE_TIME.
+        """
+        if not in_data_dir(name):
+            raise ValueError('only files in $FIXIE_DATA_DIR may be leased, '
+                             'got ' + repr(name))
+        max_ttl = ENV.get('FIXIE_LEASE_TIME', 30.0)
+        ttl = max_ttl if ttl is None else min(ttl, max_ttl)
+        lockfile = ensure_parent_dir(name + '.lock')
+        with self._lock:
+            self._expire()
+            try:
+                fd = os.open(lockfile, os.O_CREAT|os.O_EXCL|os.O_RDWR)
+            except FileExistsError:
+                return 0
+            token = secrets.randbits(62) + 1
+            self.leases[token] = (name, owner, time.time() + ttl, fd, lockfile)
+        return token
+
+    def release(self, token):
+        """Releases a lease. Returns whether the lease was still held."""
+        with self._lock:
+            lease = self.leases.pop(token, None)
+            if lease is None:
+                return False
+            self._unlock(lease)
+        return True
+
+    def _unlock(self, lease):
+        name, owner, expires, fd, lockfile = lease
+        os.close(fd)
+        os.unlink(lockfile)
+
+    def _expire(self):
+        now = time.time()
+        for token, lease in list(self.leases.items()):
+            if lease[2] <= now:
+                del self.leases[token]
+                self._unlock(lease)
+                LOGGER.log('lease of {0} by {1!r} expired', category='coordinator',
+                           level=WARNING, args=lease[:2])
+
+    def expire(self):
+        """Releases the leases that have expired."""
+        with self._lock:
+            self._expire()
+
+    def clear(self):
+        """Releases all leases."""
+        with self._lock:
+            for lease in self.leases.values():
+                self._unlock(lease)
+            self.leases.clear()
+
+
+LEASES = Leases()
+
+
+#
+# handlers
+#
+
+SECRET = {'type': 'string', 'required': True}
+
+
+class CoordinatorHandler(RequestHandler):
+    """A request handler that only serves the nodes, i.e. the requests that
+    carry the coordinator secret.
+    """
+
+    def prepare(self):
+        super().prepare()
+        if self._finished:
+            return
+        secret = self.request.arguments.pop('secret', '')
+        if not isinstance(secret, str) or \
+                not hmac.compare_digest(secret.encode(), coordinator_secret().encode()):
+            self.send_error(403, message='Invalid coordinator secret.')
+
+    def run_locked(self, func, *args, **kwargs):
+        """Runs a function that takes local locks on an executor thread, and
+        returns a future of its result.
+        """
+        loop = tornado.ioloop.IOLoop.current()
+        return loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+class JobidsHandler(CoordinatorHandler):
+    """Allocates a range of jobids."""
+
+    schema = {'secret': SECRET, 'n': {'type': 'integer', 'min': 1, 'required': True}}
+
+    async def post(self):
+        jobids = await self.run_locked(next_jobids, self.request.arguments['n'])
+        self.write({'status': True, 'start': jobids.start, 'stop': jobids.stop})
+
+
+class RegisterAliasesHandler(CoordinatorHandler):
+    """Registers a list of [jobid, user, name, project] aliases."""
+
+    schema = {'secret': SECRET, 'aliases': {'type': 'list', 'required': True, 'schema': {
+                'type': 'list', 'items': [{'type': 'integer'}, {'type': 'string'},
+                                          {'type': 'string'}, {'type': 'string'}]}}}
+
+    async def post(self):
+        status = await self.run_locked(register_job_aliases,
+                                       self.request.arguments['aliases'])
+        self.write({'status': status})
+
+
+class RemoveAliasesHandler(CoordinatorHandler):
+    """Removes the aliases of a list of jobids."""
+
+    schema = {'secret': SECRET, 'jobids': {'type': 'list', 'required': True,
+                         'schema': {'type': 'integer'}}}
+
+    async def post(self):
+        status = await self.run_locked(remove_job_aliases, self.request.arguments['jobids'])
+        self.write({'status': status})
+
+
+class LookupAliasHandler(CoordinatorHandler):
+    """Looks up the jobids of an alias, or of a name across all users and
+    projects if no user is given.
+    """
+
+    schema = {
+        'secret': SECRET,
+        'user': {'type': 'string'},
+        'name': {'type': 'string'},
+        'project': {'type': 'string'},
+        }
+
+    async def post(self):
+        args = self.request.arguments
+        if 'user' in args:
+            jobids = await self.run_locked(jobids_from_alias, args['user'],
+                                           name=args.get('name', ''),
+                                           project=args.get('project', ''))
+        else:
+            jobids = await self.run_locked(jobids_with_name, args.get('name', ''))
+        self.write({'status': True, 'jobids': jobids})
+
+
+class UserJobidsHandler(CoordinatorHandler):
+    """Looks up the jobids of all of the aliases of a user."""
+
+    schema = {'secret': SECRET, 'user': {'type': 'string', 'required': True}}
+
+    async def post(self):
+        jobids = await self.run_locked(jobids_of_user, self.request.arguments['user'])
+        self.write({'status': True, 'jobids': jobids})
+
+
+class AcquireLeaseHandler(CoordinatorHandler):
+    """Tries to grant a lease on a lock, without waiting."""
+
+    schema = {
+        'secret': SECRET,
+        'name': {'type': 'string', 'required': True},
+        'owner': {'type': 'string'},
+        'ttl': {'type': 'number', 'min': 0},
+        }
+
+    def post(self):
+        args = self.request.arguments
+        try:
+            token = LEASES.acquire(args['name'], owner=args.get('owner', ''),
+                                   ttl=args.get('ttl', None))
+        except ValueError as e:
+            self.send_error(403, message=str(e))
+            return
+        self.write({'status': True, 'token': token})
+
+
+class ReleaseLeaseHandler(CoordinatorHandler):
+    """Releases a lease on a lock."""
+
+    schema = {'secret': SECRET, 'token': {'type': 'integer', 'required': True}}
+
+    def post(self):
+        released = LEASES.release(self.request.arguments['token'])
+        self.write({'status': True, 'released': released})
+
+
+HANDLERS = [
+    (r'/coordinator/jobids', JobidsHandler),
+    (r'/coordinator/aliases/register', RegisterAliasesHandler),
+    (r'/coordinator/aliases/remove', RemoveAliasesHandler),
+    (r'/coordinator/aliases/lookup', LookupAliasHandler),
+    (r'/coordinator/aliases/user', UserJobidsHandler),
+    (r'/coordinator/lease/acquire', AcquireLeaseHandler),
+    (r'/coordinator/lease/release', ReleaseLeaseHandler),
+]
+
+
+#
+# client
+#
+
+class Coordinator:
+    """A client of the coordinator at $FIXIE_COORDINATOR_URL. Every method
+    takes a single request, and raises an exception if it fails or does not
+    complete within timeout seconds.
+    """
+
+    def __init__(self, url=None):
+        """
+        Parameters
+        ----------
+        url : str or None, optional
+            Base URL of the coordinator, if None, defaults to
+            $FIXIE_COORDINATOR_URL.
+        """
+        self._url = url
+
+    @property
+    def url(self):
+        value = self._url
+        if value is None:
+            value = ENV['FIXIE_COORDINATOR_URL']
+        return value
+
+    @url.setter
+    def url(self, value):
+        self._url = value
+
+    @property
+    def owner(self):
+        """The name of this process, which is recorded with its leases."""
+        return '{0}:{1}'.format(os.uname().nodename, os.getpid())
+
+    def call(self, endpoint, obj, timeout=None):
+        """Sends an object to an endpoint of the coordinator, returning the
+        response object.
+        """
+        obj = dict(obj, secret=coordinator_secret())
+        rtn = fetch_sync(self.url + '/coordinator/' + endpoint, obj, timeout=timeout)
+        if not rtn.get('status', False):
+            raise RuntimeError('coordinator request to {0} failed: {1}'.format(
+                               endpoint, rtn.get('message', 'unknown error')))
+        return rtn
+
+    def next_jobids(self, n, timeout=None):
+        """Allocates n jobids, returning them as a range."""
+        rtn = self.call('jobids', {'n': n}, timeout=timeout)
+        return range(rtn['start'], rtn['stop'])
+
+    def register_job_aliases(self, aliases, timeout=None):
+        """Registers many (jobid, user, name, project) aliases."""
+        self.call('aliases/register', {'aliases': [list(a) for a in aliases]},
+                  timeout=timeout)
+        return True
+
+    def remove_job_aliases(self, jobids, timeout=None):
+        """Removes the aliases of many jobids."""
+        self.call('aliases/remove', {'jobids': sorted(jobids)}, timeout=timeout)
+        return True
+
+    def jobids_from_alias(self, user, name='', project='', timeout=None):
+        """Returns the set of jobids with an alias."""
+        obj = {'user': user, 'name': name, 'project': project}
+        return self.call('aliases/lookup', obj, timeout=timeout)['jobids']
+
+    def jobids_of_user(self, user, timeout=None):
+        """Returns the set of jobids with any alias of a user."""
+        return self.call('aliases/user', {'user': user}, timeout=timeout)['jobids']
+
+    def jobids_with_name(self, name, timeout=None):
+        """Returns the set of jobids with a name, across all users and projects."""
+        return self.call('aliases/lookup', {'name': name}, timeout=timeout)['jobids']
+
+    def acquire(self, name, timeout=None):
+        """Tries to obtain a lease on the lock of a file, without waiting.
+        Returns the token of the lease, or zero if the lock is held.
+        """
+        obj = {'name': name, 'owner': self.owner}
+        return self.call('lease/acquire', obj, timeout=timeout)['token']
+
+    def release(self, token, timeout=None):
+        """Releases a lease. Returns whether the lease was still held, i.e.
+        it had not expired.
+        """
+        return self.call('lease/release', {'token': token}, timeout=timeout)['released']
+
+
+COORDINATOR = Coordinator()
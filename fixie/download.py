@@ -0,0 +1,78 @@
+"""A request handler for downloading simulation databases from $FIXIE_SIMS_DIR.
+
+Files are streamed in fixed size chunks, with a flush after each, so a
+download only holds one chunk in memory no matter how large the file is.
+Range requests (e.g. resuming an interrupted transfer) and conditional GETs
+(If-None-Match and If-Modified-Since) are supported.
+"""
+import os
+
+import tornado.web
+
+from fixie.environ import ENV
+from fixie.layout import storage_path
+from fixie.metrics import METRICS
+from fixie.sessions import SESSIONS
+
+
+class DownloadHandler(tornado.web.StaticFileHandler):
+    """Serves the files in $FIXIE_SIMS_DIR (or another root given as the 'path'
+    keyword argument in the application's handlers), by their logical paths,
+    such as those from ``fixie.tools.default_path()``. For example::
+
+        (r'/download/(.*)', DownloadHandler)
+
+    The path is resolved through the storage layout, so that sharded files are
+    found too. This class is meant to be subclassed, e.g. to check that the
+    current user has access to the file in ``get()``.
+    """
+
+    # number of bytes read and sent at a time
+    chunk_size = 256 * 1024
+
+    def initialize(self, path=None, default_filename=None):
+        path = ENV['FIXIE_SIMS_DIR'] if path is None else path
+        super().initialize(path, default_filename=default_filename)
+
+    def get_current_user(self):
+        return SESSIONS.user(self)
+
+    @classmethod
+    def get_absolute_path(cls, root, path):
+        return os.path.abspath(storage_path('/' + path, root=root))
+
+    @classmethod
+    def get_content(cls, abspath, start=None, end=None):
+        with open(abspath, 'rb', buffering=0) as f:
+            if start is not None:
+                f.seek(start)
+            remaining = None if end is None else end - (start or 0)
+            while remaining is None or remaining > 0:
+                n = cls.chunk_size if remaining is None else min(remaining, cls.chunk_size)
+                chunk = f.read(n)
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def compute_etag(self):
+        # databases are large and may be rewritten in place, so the tag is
+        # built from the file's metadata rather than from hashing its contents
+        st = self._stat()
+        return '"{0:x}-{1:x}-{2:x}"'.format(st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get_content_type(self):
+        if self.absolute_path.endswith('.h5'):
+            return 'application/x-hdf5'
+        return super().get_content_type()
+
+    def on_finish(self):
+        name = self.__class__.__name__
+        status = self.get_status()
+        METRICS.inc('fixie_requests_total', handler=name, code=status)
+        METRICS.observe('fixie_request_duration_seconds', self.request.request_time(),
+                        handler=name, code=status)
+        if status in (200, 206) and self.request.method == 'GET':
+            size = int(self._headers.get('Content-Length', 0))
+            METRICS.inc('fixie_download_bytes_total', size, handler=name)
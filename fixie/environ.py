@@ -6,6 +6,7 @@ from contextlib import contextmanager
 from collections import OrderedDict
 from collections.abc import MutableMapping
 
+from xonsh.events import events
 from xonsh.environ import Ensurer, VarDocs
 from xonsh.tools import (is_string, ensure_string, always_false, always_true, is_bool,
                          is_string_set, csv_to_set, set_to_csv, is_nonstring_seq_of_strings,
@@ -39,6 +40,88 @@ def is_dict_str_str_or_none(x):
     return True
 
 
+def csv_to_dict(x):
+    """Converts a comma-separated string of key:value pairs to a dict of str."""
+    rtn = {}
+    for item in x.split(','):
+        key, sep, value = item.partition(':')
+        if sep:
+            rtn[key.strip()] = value.strip()
+    return rtn
+
+
+def dict_to_csv(x):
+    """Converts a dict to a comma-separated string of key:value pairs."""
+    return ','.join(key + ':' + str(value) for key, value in x.items())
+
+
+def is_dict_str_float(x):
+    """Checks if x is a mapping from strings to floats."""
+    if not isinstance(x, MutableMapping):
+        return False
+    return all(isinstance(key, str) and isinstance(value, float)
+               for key, value in x.items())
+
+
+def csv_to_float_dict(x):
+    """Converts a comma-separated string of key:value pairs, or a mapping, to a
+    dict from str to float.
+    """
+    if isinstance(x, str):
+        x = csv_to_dict(x)
+    return {key: float(value) for key, value in x.items()}
+
+
+def to_str_dict(x):
+    """Converts a comma-separated string of key:value pairs, or a mapping, to a
+    dict from str to str.
+    """
+    if isinstance(x, str):
+        return csv_to_dict(x)
+    return {str(key): str(value) for key, value in x.items()}
+
+
+LOG_LEVELS = ('debug', 'info', 'warning', 'error', 'critical')
+
+
+def is_log_level(x):
+    """Checks if x is the (lower case) name of a log level."""
+    return isinstance(x, str) and x in LOG_LEVELS
+
+
+def to_log_level(x):
+    """Converts x to the (lower case) name of a log level, raising a ValueError
+    if it is not one.
+    """
+    level = str(x).strip().lower()
+    if level not in LOG_LEVELS:
+        msg = 'unknown log level {0!r}, must be one of: {1}'
+        raise ValueError(msg.format(x, ', '.join(LOG_LEVELS)))
+    return level
+
+
+def is_log_level_dict(x):
+    """Checks if x is a mapping from strings to log level names."""
+    if not isinstance(x, MutableMapping):
+        return False
+    return all(isinstance(key, str) and is_log_level(value)
+               for key, value in x.items())
+
+
+def to_log_level_dict(x):
+    """Converts a comma-separated string of key:level pairs, or a mapping, to a
+    dict from str to log level names, raising a ValueError for unknown levels.
+    """
+    return {key: to_log_level(value) for key, value in to_str_dict(x).items()}
+
+
+def expand_file(x):
+    """Expands a variable that represents a file, without touching the
+    filesystem.
+    """
+    return os.path.abspath(expand_path(x))
+
+
 def expand_file_and_mkdirs(x):
     """Expands a variable that represents a file, and ensures that the
     directory it lives in actually exists.
@@ -58,70 +141,154 @@ def expand_and_make_dir(x):
     return x
 
 
+# directories that are known to exist in this process
+_ENSURED_DIRS = set()
+
+
+def ensure_dir(d):
+    """Ensures that a directory exists, creating it if needed. Directories
+    that have already been ensured by this process are not checked again.
+    Returns the directory.
+    """
+    if d and d not in _ENSURED_DIRS:
+        os.makedirs(d, exist_ok=True)
+        _ENSURED_DIRS.add(d)
+    return d
+
+
+def ensure_parent_dir(filename):
+    """Ensures that the directory a file lives in exists, prior to writing it.
+    Returns the filename.
+    """
+    ensure_dir(os.path.dirname(filename))
+    return filename
+
+
+class LazyDefault:
+    """A default value for an environment variable that is computed the first
+    time it is read, and is memoized after that.
+    """
+
+    # tells xonsh to call this object when the default is looked up
+    _xonsh_callable_default = True
+
+    def __init__(self, func):
+        self.func = func
+        self.computed = False
+        self.value = None
+
+    def __call__(self, env=None):
+        if not self.computed:
+            self.value = self.func()
+            self.computed = True
+        return self.value
+
+    def __repr__(self):
+        return '<lazy default ' + self.func.__name__ + '>'
+
+
+# The default functions below only compute paths. Directories are created
+# by the code that writes to them, via ensure_dir() or ensure_parent_dir(),
+# except that the server creates the jobs, sims, and paths directories when it
+# starts, since external services write into them.
+
 def fixie_config_dir():
-    """Ensures and returns the $FIXIE_CONFIG_DIR"""
-    fcd = os.path.expanduser(os.path.join(ENV.get('XDG_CONFIG_HOME'), 'fixie'))
-    os.makedirs(fcd, exist_ok=True)
-    return fcd
+    """Returns the $FIXIE_CONFIG_DIR"""
+    return os.path.expanduser(os.path.join(ENV.get('XDG_CONFIG_HOME'), 'fixie'))
 
 
 def fixie_data_dir():
-    """Ensures and returns the $FIXIE_DATA_DIR"""
-    fdd = os.path.expanduser(os.path.join(ENV.get('XDG_DATA_HOME'), 'fixie'))
-    os.makedirs(fdd, exist_ok=True)
-    return fdd
+    """Returns the $FIXIE_DATA_DIR"""
+    return os.path.expanduser(os.path.join(ENV.get('XDG_DATA_HOME'), 'fixie'))
 
 
 def fixie_logfile():
-    """Ensures and returns the $FIXIE_LOGFILE"""
-    flf = os.path.join(ENV.get('FIXIE_DATA_DIR'), 'log.json')
-    flf = expand_file_and_mkdirs(flf)
-    return flf
+    """Returns the $FIXIE_LOGFILE"""
+    return expand_file(os.path.join(ENV.get('FIXIE_DATA_DIR'), 'log.json'))
 
 
 def fixie_jobs_dir():
-    """Ensures and returns the $FIXIE_JOBS_DIR"""
-    fjd = os.path.join(ENV.get('FIXIE_DATA_DIR'), 'jobs')
-    os.makedirs(fjd, exist_ok=True)
-    return fjd
+    """Returns the $FIXIE_JOBS_DIR"""
+    return os.path.join(ENV.get('FIXIE_DATA_DIR'), 'jobs')
 
 
 def fixie_jobid_file():
-    """Ensures and returns the $FIXIE_JOBID_FILE"""
-    fjf = os.path.join(ENV.get('FIXIE_JOBS_DIR'), 'id')
-    fjf = expand_file_and_mkdirs(fjf)
-    return fjf
+    """Returns the $FIXIE_JOBID_FILE"""
+    return expand_file(os.path.join(ENV.get('FIXIE_JOBS_DIR'), 'id'))
 
 
 def fixie_job_aliases_file():
-    """Ensures and returns the $FIXIE_JOB_ALIASES_FILE"""
-    fjf = os.path.join(ENV.get('FIXIE_JOBS_DIR'), 'aliases.json')
-    fjf = expand_file_and_mkdirs(fjf)
-    return fjf
+    """Returns the $FIXIE_JOB_ALIASES_FILE"""
+    return expand_file(os.path.join(ENV.get('FIXIE_JOBS_DIR'), 'aliases.json'))
+
+
+def fixie_registry_file():
+    """Returns the $FIXIE_REGISTRY_FILE"""
+    return expand_file(os.path.join(ENV.get('FIXIE_JOBS_DIR'), 'registry.json'))
+
+
+def fixie_journal_file():
+    """Returns the $FIXIE_JOURNAL_FILE"""
+    return expand_file(os.path.join(ENV.get('FIXIE_JOBS_DIR'), 'journal.json'))
 
 
 def fixie_sims_dir():
-    """Ensures and returns the $FIXIE_SIMS_DIR"""
-    fsd = os.path.join(ENV.get('FIXIE_DATA_DIR'), 'sims')
-    os.makedirs(fsd, exist_ok=True)
-    return fsd
+    """Returns the $FIXIE_SIMS_DIR"""
+    return os.path.join(ENV.get('FIXIE_DATA_DIR'), 'sims')
 
 
 def fixie_paths_dir():
-    """Ensures and returns the $FIXIE_PATHS_DIR"""
-    fsd = os.path.join(ENV.get('FIXIE_DATA_DIR'), 'paths')
-    os.makedirs(fsd, exist_ok=True)
-    return fsd
+    """Returns the $FIXIE_PATHS_DIR"""
+    return os.path.join(ENV.get('FIXIE_DATA_DIR'), 'paths')
 
 
 def fixie_cookie_secret_file():
-    """Ensures and returns the $FIXIE_COOKIE_SECRET_FILE"""
-    f = os.path.join(ENV.get('FIXIE_CONFIG_DIR'), 'cookie')
-    f = expand_file_and_mkdirs(f)
-    return f
+    """Returns the $FIXIE_COOKIE_SECRET_FILE"""
+    return expand_file(os.path.join(ENV.get('FIXIE_CONFIG_DIR'), 'cookie'))
+
+
+def fixie_coordinator_secret_file():
+    """Returns the $FIXIE_COORDINATOR_SECRET_FILE"""
+    return expand_file(os.path.join(ENV.get('FIXIE_DATA_DIR'), 'coordinator-secret'))
+
+
+def fixie_expiry_file():
+    """Returns the $FIXIE_EXPIRY_FILE"""
+    return expand_file(os.path.join(ENV.get('FIXIE_JOBS_DIR'), 'expiry.json'))
+
+
+def fixie_results_dir():
+    """Returns the $FIXIE_RESULTS_DIR"""
+    return os.path.join(ENV.get('FIXIE_DATA_DIR'), 'results')
+
+
+def fixie_result_cache_time():
+    """Returns the default $FIXIE_RESULT_CACHE_TIME, which is $FIXIE_HOLDING_TIME"""
+    return ENV.get('FIXIE_HOLDING_TIME')
+
+
+def fixie_metrics_dir():
+    """Returns the $FIXIE_METRICS_DIR"""
+    return os.path.join(ENV.get('FIXIE_DATA_DIR'), 'metrics')
+
+
+def fixie_profile_dir():
+    """Returns the $FIXIE_PROFILE_DIR"""
+    return os.path.join(ENV.get('FIXIE_DATA_DIR'), 'profiles')
+
+
+def fixie_trace_file():
+    """Returns the $FIXIE_TRACE_FILE"""
+    return expand_file(os.path.join(ENV.get('FIXIE_DATA_DIR'), 'trace.json'))
+
+
+def fixie_njobs():
+    """Returns the default $FIXIE_NJOBS, the number of CPUs."""
+    return multiprocessing.cpu_count()
 
 # key = name
 # value = (default, validate, convert, detype, docstr)
+# callable defaults are wrapped in LazyDefault, and so are only computed when read.
 # this needs to be ordered so that the default are applied in the correct order
 ENVVARS = OrderedDict([
     ('FIXIE_CONFIG_DIR', (fixie_config_dir, is_string, str, ensure_string,
@@ -130,25 +297,167 @@ ENVVARS = OrderedDict([
                        'Path to fixie data directory')),
     ('FIXIE_JOBS_DIR', (fixie_jobs_dir, is_string, str, ensure_string,
                         'Path to fixie jobs directory')),
-    ('FIXIE_JOBID_FILE', (fixie_jobid_file, always_false, expand_file_and_mkdirs, ensure_string,
+    ('FIXIE_JOBID_FILE', (fixie_jobid_file, always_false, expand_file, ensure_string,
                           'Path to the fixie job file, which contains the next jobid.')),
     ('FIXIE_JOB_ALIASES_FILE', (fixie_job_aliases_file, always_false,
-                                expand_file_and_mkdirs, ensure_string,
+                                expand_file, ensure_string,
                                 'Path to the fixie job names file, which contains '
                                 'aliases associated with users, projects, and jobids.')),
+    ('FIXIE_REGISTRY_FILE', (fixie_registry_file, always_false, expand_file,
+                             ensure_string,
+                             'Path to the fixie job registry file, which records '
+                             'the state of every job.')),
+    ('FIXIE_JOURNAL', (False, is_bool, to_bool, bool_to_str,
+                       'Whether jobid allocations and alias changes are group '
+                       'committed to $FIXIE_JOURNAL_FILE, rather than rewriting '
+                       '$FIXIE_JOBID_FILE and $FIXIE_JOB_ALIASES_FILE each time. '
+                       'All processes must agree on this setting, and the journal '
+                       'should be compacted before it is disabled.')),
+    ('FIXIE_JOURNAL_FILE', (fixie_journal_file, always_false, expand_file,
+                            ensure_string,
+                            'Path to the write-ahead journal of jobid and alias '
+                            'changes.')),
+    ('FIXIE_JOURNAL_COMPACT_SIZE', (10000, is_int, int, ensure_string,
+                                    'Number of records in the journal at which '
+                                    'it is compacted into $FIXIE_JOBID_FILE and '
+                                    '$FIXIE_JOB_ALIASES_FILE.')),
+    ('FIXIE_COORDINATOR', (False, is_bool, to_bool, bool_to_str,
+                           'Whether this instance is the coordinator, which '
+                           'serves jobid allocation, job aliases, and lock '
+                           'leases to the other fixie nodes that share '
+                           '$FIXIE_DATA_DIR.')),
+    ('FIXIE_COORDINATOR_URL', ('', is_string, str, ensure_string,
+                               'Base URL of the coordinator, default is an empty '
+                               'string indicating that jobids, aliases, and locks '
+                               'are managed through the filesystem.')),
+    ('FIXIE_SELF_URLS', (frozenset(), is_string_set, csv_to_set, set_to_csv,
+                         'Comma-separated base URLs that reach this server, e.g. '
+                         'through a proxy. Fetches to these URLs, for example '
+                         'through a $FIXIE_*_URL, are served in process.')),
+    ('FIXIE_LEASE_TIME', (30.0, is_float, float, ensure_string,
+                          'Number of seconds after which a lock lease from the '
+                          'coordinator expires, if it has not been released. '
+                          'This is also the longest lease that a node may ask for.')),
+    ('FIXIE_COORDINATOR_SECRET_FILE', (fixie_coordinator_secret_file, always_false,
+                                       expand_file, ensure_string,
+                                       'Path to the secret that nodes must send with '
+                                       'their requests to the coordinator. It is '
+                                       'generated if it does not exist, so the '
+                                       'default in $FIXIE_DATA_DIR is shared by the '
+                                       'nodes without further setup.')),
     ('FIXIE_HOLDING_TIME', (float('inf'), is_float, float, ensure_string,
                             'Length of time to store databases on the server.')),
-    ('FIXIE_NJOBS', (multiprocessing.cpu_count(), is_int, int, ensure_string,
+    ('FIXIE_NJOBS', (fixie_njobs, is_int, int, ensure_string,
                      'Number of jobs allowed in parallel on this server.')),
-    ('FIXIE_LOGFILE', (fixie_logfile, always_false, expand_file_and_mkdirs, ensure_string,
+    ('FIXIE_CGROUP_DIR', ('', is_string, str, ensure_string,
+                          'Path to a cgroup v2 directory that fixie may create '
+                          'child cgroups in, so that each job runs in its own '
+                          'cgroup and its CPU, memory, and I/O usage is '
+                          'recorded. Default is an empty string, indicating '
+                          'that only the resource usage from wait4() is '
+                          'recorded.')),
+    ('FIXIE_LOGFILE', (fixie_logfile, always_false, expand_file, ensure_string,
                        'Path to the fixie logfile.')),
+    ('FIXIE_LOG_LEVEL', ('info', is_log_level, to_log_level, ensure_string,
+                         'Minimum level of the messages that are logged, one of '
+                         '"debug", "info", "warning", "error", or "critical".')),
+    ('FIXIE_LOG_CATEGORY_LEVELS', ({}, is_log_level_dict, to_log_level_dict,
+                                   dict_to_csv,
+                                   'Minimum levels of the messages that are '
+                                   'logged for particular categories, which '
+                                   'override $FIXIE_LOG_LEVEL, as comma-separated '
+                                   'category:level pairs, e.g. "stall:warning".')),
+    ('FIXIE_LOG_SAMPLING', ({}, is_dict_str_float, csv_to_float_dict, dict_to_csv,
+                            'Fractions of the messages that are logged for '
+                            'high-volume categories, as comma-separated '
+                            'category:fraction pairs, e.g. "profile:0.01". '
+                            'Messages in other categories are all logged.')),
     ('FIXIE_SIMS_DIR', (fixie_sims_dir, is_string, str, ensure_string,
                         'Path to fixie simulations directory, where simulation '
                         'objects are stored.')),
     ('FIXIE_PATHS_DIR', (fixie_paths_dir, is_string, str, ensure_string,
                         'Path to fixie paths directory, where database path metadata '
                         'is stored.')),
-    ('FIXIE_COOKIE_SECRET_FILE', (fixie_cookie_secret_file, is_string, str, ensure_string, 'Path to cookie secret file'))
+    ('FIXIE_COOKIE_SECRET_FILE', (fixie_cookie_secret_file, is_string, str, ensure_string, 'Path to cookie secret file')),
+    ('FIXIE_COOKIE_MAX_AGE_DAYS', (31.0, is_float, float, ensure_string,
+                                   'Number of days that a signed session cookie '
+                                   'is valid for.')),
+    ('FIXIE_SESSION_CACHE_SIZE', (10000, is_int, int, ensure_string,
+                                  'Maximum number of verified session cookies '
+                                  'cached by each server process.')),
+    ('FIXIE_EXPIRY_FILE', (fixie_expiry_file, always_false, expand_file, ensure_string,
+                           'Path to the fixie expiry index, which records when '
+                           'databases were created so that they may be removed '
+                           'after $FIXIE_HOLDING_TIME.')),
+    ('FIXIE_REAPER_INTERVAL', (60.0, is_float, float, ensure_string,
+                               'Number of seconds between checks for expired databases.')),
+    ('FIXIE_REAPER_BATCH_SIZE', (100, is_int, int, ensure_string,
+                                 'Maximum number of expired databases removed per check.')),
+    ('FIXIE_RESULTS_DIR', (fixie_results_dir, is_string, str, ensure_string,
+                           'Path to fixie results directory, where the cache of '
+                           'databases for identical inputs is stored.')),
+    ('FIXIE_RESULT_CACHE_TIME', (fixie_result_cache_time, is_float, float, ensure_string,
+                                 'Length of time that a database may be reused for '
+                                 'identical inputs, defaults to $FIXIE_HOLDING_TIME.')),
+    ('FIXIE_SHARD_LAYOUT', ('flat', is_string, str, ensure_string,
+                            'Layout of per-job files in storage directories, may be '
+                            '"flat", "hash", or "range".')),
+    ('FIXIE_SHARD_SIZE', (1000, is_int, int, ensure_string,
+                          'Number of jobids per directory in the "range" shard layout.')),
+    ('FIXIE_METRICS_DIR', (fixie_metrics_dir, is_string, str, ensure_string,
+                           'Path to fixie metrics directory, where each process '
+                           'periodically writes its metrics.')),
+    ('FIXIE_METRICS_INTERVAL', (15.0, is_float, float, ensure_string,
+                                'Number of seconds between writes of the metrics '
+                                'of a process to $FIXIE_METRICS_DIR.')),
+    ('FIXIE_ADMINS', (frozenset(), is_string_set, csv_to_set, set_to_csv,
+                      'Comma-separated names of the users that may perform '
+                      'administrative actions, such as profiling requests.')),
+    ('FIXIE_PROFILE_EVERY', (0, is_int, int, ensure_string,
+                             'Profile one in every N requests, zero disables '
+                             'sampled request profiling.')),
+    ('FIXIE_PROFILE_THRESHOLD', (0.0, is_float, float, ensure_string,
+                                 'Profile all requests and keep the profiles of '
+                                 'those that take longer than this many seconds, '
+                                 'zero disables this. Note that this adds profiling '
+                                 'overhead to every request.')),
+    ('FIXIE_PROFILE_DIR', (fixie_profile_dir, is_string, str, ensure_string,
+                           'Path to fixie profiles directory, where request '
+                           'profiles are written as pstats files.')),
+    ('FIXIE_TRACE', (False, is_bool, to_bool, bool_to_str,
+                     'Whether to record request tracing spans.')),
+    ('FIXIE_TRACE_FILE', (fixie_trace_file, always_false, expand_file, ensure_string,
+                          'Path to the fixie trace file, where tracing spans are '
+                          'written.')),
+    ('FIXIE_STALL_THRESHOLD', (0.1, is_float, float, ensure_string,
+                               'Number of seconds that the IOLoop may be blocked '
+                               'before the stall and the blocking stack are '
+                               'logged, zero disables the watchdog.')),
+    ('FIXIE_MAX_INFLIGHT', (0, is_int, int, ensure_string,
+                            'Maximum number of requests that a server process '
+                            'handles at once, further requests are rejected with '
+                            'a 503 status. Zero means no limit.')),
+    ('FIXIE_MAX_BODY_SIZE', (100*1024*1024, is_int, int, ensure_string,
+                             'Maximum size of a request body, in bytes. Larger '
+                             'requests are rejected with a 413 status.')),
+    ('FIXIE_RATE_LIMIT', (0.0, is_float, float, ensure_string,
+                          'Number of requests per second that each user (or '
+                          'address, for anonymous requests) may make, further '
+                          'requests are rejected with a 429 status. Zero means '
+                          'no limit.')),
+    ('FIXIE_RATE_BURST', (10, is_int, int, ensure_string,
+                          'Number of requests that a user may make in a burst '
+                          'above $FIXIE_RATE_LIMIT.')),
+    ('FIXIE_RESPONSE_CACHE_TIME', (10.0, is_float, float, ensure_string,
+                                   'Default number of seconds that cached '
+                                   'responses are kept for.')),
+    ('FIXIE_RESPONSE_CACHE_SIZE', (1024, is_int, int, ensure_string,
+                                   'Maximum number of responses cached by '
+                                   'each server process.')),
+    ('FIXIE_LONGPOLL_TIMEOUT', (30.0, is_float, float, ensure_string,
+                                'Number of seconds that a job status request waits '
+                                'for an event before responding, or between '
+                                'keepalives of an event stream.')),
     ])
 for service in SERVICES:
     key = 'FIXIE_' + service.upper() + '_URL'
@@ -168,10 +477,11 @@ def setup():
     for key, (default, validate, convert, detype, docstr) in ENVVARS.items():
         if key in ENV:
             del ENV[key]
-        ENV._defaults[key] = default() if callable(default) else default
+        ENV._defaults[key] = LazyDefault(default) if callable(default) else default
         ENV._ensurers[key] = Ensurer(validate=validate, convert=convert,
                                      detype=detype)
         ENV._docs[key] = VarDocs(docstr=docstr)
+    invalidate_detyped_env()
     _ENV_SETUP = True
 
 
@@ -185,6 +495,7 @@ def teardown():
         ENV._docs.pop(key)
         if key in ENV:
             del ENV[key]
+    invalidate_detyped_env()
     _ENV_SETUP = False
 
 
@@ -209,10 +520,62 @@ def fixie_envvar_names():
     return names
 
 
+# Cache of detyped environment snapshots. The 'len' entry records the number
+# of variables in ENV when the snapshots were taken, so that deletions (which
+# xonsh does not fire events for) also invalidate the cache.
+_DETYPED_CACHE = {}
+
+
+def invalidate_detyped_env(*args, **kwargs):
+    """Clears the cached detyped environment snapshots. This is called
+    automatically whenever a variable in ENV is added or changed, and may be
+    called manually after mutating a container value in place.
+    """
+    _DETYPED_CACHE.clear()
+
+
+events.on_envvar_new(invalidate_detyped_env)
+events.on_envvar_change(invalidate_detyped_env)
+
+
+def _detyped_cache_get(key):
+    """Returns a cached snapshot, or None if it is missing or out of date."""
+    n = len(ENV)
+    if _DETYPED_CACHE.get('len', n) != n:
+        _DETYPED_CACHE.clear()
+    _DETYPED_CACHE['len'] = n
+    return _DETYPED_CACHE.get(key, None)
+
+
+def detyped_env():
+    """Returns a detyped version of the full environment, suitable for passing
+    to subprocesses. The result is cached until ENV is mutated, and so must
+    not be modified by the caller.
+    """
+    denv = _detyped_cache_get('all')
+    if denv is None:
+        denv = _DETYPED_CACHE['all'] = ENV.detype()
+    return denv
+
+
 def fixie_detype_env():
     """Returns a detyped version of the environment containing only the fixie
-    environment variables.
+    environment variables. The result is cached until ENV is mutated, and so
+    must not be modified by the caller.
     """
-    keep = fixie_envvar_names()
-    denv = {k: v for k, v in ENV.detype().items() if k in keep}
+    denv = _detyped_cache_get('fixie')
+    if denv is not None:
+        return denv
+    denv = {}
+    for key in ENVVARS:
+        if key not in ENV._d:
+            # only variables that have been explicitly set are detyped
+            continue
+        ensurer = ENV.get_ensurer(key)
+        if ensurer.detype is None:
+            continue
+        val = ensurer.detype(ENV._d[key])
+        if val is not None:
+            denv[key] = val
+    _DETYPED_CACHE['fixie'] = denv
     return denv
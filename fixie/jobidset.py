@@ -0,0 +1,251 @@
+"""A compact set of jobids, stored as sorted ranges.
+
+Jobids are allocated consecutively, so the jobids of an alias are mostly
+runs of consecutive integers. A ``JobidSet`` stores each run as a half-open
+[start, stop) range, in two arrays of 64-bit integers. Memory use and the
+size of its JSON encoding grow with the number of runs rather than with the
+number of jobids, membership takes a binary search, and unions and
+differences with other jobid sets take a single merge of the ranges.
+"""
+import heapq
+from array import array
+from bisect import bisect_right
+from collections.abc import MutableSet, Set
+
+
+def _merged(ranges):
+    """Returns the start and stop arrays of (start, stop) ranges, sorted by
+    start, with overlapping and adjacent ranges merged.
+    """
+    starts = array('q')
+    stops = array('q')
+    for start, stop in ranges:
+        if stops and start <= stops[-1]:
+            if stop > stops[-1]:
+                stops[-1] = stop
+        elif start < stop:
+            starts.append(start)
+            stops.append(stop)
+    return starts, stops
+
+
+class JobidSet(MutableSet):
+    """A mutable set of integer jobids, stored as sorted ranges."""
+
+    __slots__ = ('_starts', '_stops', '_len')
+
+    def __init__(self, iterable=()):
+        if isinstance(iterable, JobidSet):
+            self._set(array('q', iterable._starts), array('q', iterable._stops))
+        elif isinstance(iterable, range) and iterable.step == 1:
+            self._set(*_merged([(iterable.start, iterable.stop)]))
+        else:
+            self._set(*_merged((x, x + 1) for x in sorted(set(iterable))))
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Returns the set of the jobids in [start, stop) ranges, which may
+        overlap and be in any order.
+        """
+        self = cls.__new__(cls)
+        self._set(*_merged(sorted(map(tuple, ranges))))
+        return self
+
+    def _set(self, starts, stops):
+        self._starts = starts
+        self._stops = stops
+        self._len = sum(stops) - sum(starts)
+
+    def ranges(self):
+        """Returns the list of sorted, disjoint [start, stop) ranges."""
+        return list(zip(self._starts, self._stops))
+
+    def copy(self):
+        return JobidSet(self)
+
+    def __reduce__(self):
+        return (JobidSet.from_ranges, (self.ranges(),))
+
+    def __repr__(self):
+        return 'JobidSet.from_ranges({0!r})'.format(self.ranges())
+
+    #
+    # the set interface
+    #
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for start, stop in zip(self._starts, self._stops):
+            yield from range(start, stop)
+
+    def __contains__(self, jobid):
+        if not isinstance(jobid, int):
+            return False
+        i = bisect_right(self._starts, jobid) - 1
+        return i >= 0 and jobid < self._stops[i]
+
+    def add(self, jobid):
+        starts, stops = self._starts, self._stops
+        i = bisect_right(starts, jobid)
+        if i > 0 and jobid < stops[i - 1]:
+            return
+        extends_left = i > 0 and stops[i - 1] == jobid
+        extends_right = i < len(starts) and starts[i] == jobid + 1
+        if extends_left and extends_right:
+            stops[i - 1] = stops[i]
+            del starts[i], stops[i]
+        elif extends_left:
+            stops[i - 1] = jobid + 1
+        elif extends_right:
+            starts[i] = jobid
+        else:
+            starts.insert(i, jobid)
+            stops.insert(i, jobid + 1)
+        self._len += 1
+
+    def discard(self, jobid):
+        starts, stops = self._starts, self._stops
+        i = bisect_right(starts, jobid) - 1
+        if i < 0 or jobid >= stops[i]:
+            return
+        start, stop = starts[i], stops[i]
+        if start == jobid and stop == jobid + 1:
+            del starts[i], stops[i]
+        elif start == jobid:
+            starts[i] = jobid + 1
+        elif stop == jobid + 1:
+            stops[i] = jobid
+        else:
+            stops[i] = jobid
+            starts.insert(i + 1, jobid + 1)
+            stops.insert(i + 1, stop)
+        self._len -= 1
+
+    def clear(self):
+        self._set(array('q'), array('q'))
+
+    #
+    # range-wise operations
+    #
+
+    def _union(self, other):
+        return _merged(heapq.merge(zip(self._starts, self._stops),
+                                   zip(other._starts, other._stops)))
+
+    def _difference(self, other):
+        ranges = []
+        ostarts, ostops = other._starts, other._stops
+        n = len(ostarts)
+        j = 0
+        for start, stop in zip(self._starts, self._stops):
+            while j < n and ostops[j] <= start:
+                j += 1
+            k = j
+            while k < n and ostarts[k] < stop:
+                if ostarts[k] > start:
+                    ranges.append((start, ostarts[k]))
+                start = max(start, ostops[k])
+                if start >= stop:
+                    break
+                k += 1
+            if start < stop:
+                ranges.append((start, stop))
+        return _merged(ranges)
+
+    def _intersection(self, other):
+        ranges = []
+        astarts, astops = self._starts, self._stops
+        bstarts, bstops = other._starts, other._stops
+        i = j = 0
+        while i < len(astarts) and j < len(bstarts):
+            start = max(astarts[i], bstarts[j])
+            stop = min(astops[i], bstops[j])
+            if start < stop:
+                ranges.append((start, stop))
+            if astops[i] < bstops[j]:
+                i += 1
+            else:
+                j += 1
+        return _merged(ranges)
+
+    def _operand(self, other):
+        if isinstance(other, JobidSet):
+            return other
+        elif isinstance(other, Set):
+            return JobidSet(other)
+        return None
+
+    def _new(self, starts, stops):
+        rtn = JobidSet.__new__(JobidSet)
+        rtn._set(starts, stops)
+        return rtn
+
+    def __or__(self, other):
+        other = self._operand(other)
+        if other is None:
+            return NotImplemented
+        return self._new(*self._union(other))
+
+    __ror__ = __or__
+
+    def __and__(self, other):
+        other = self._operand(other)
+        if other is None:
+            return NotImplemented
+        return self._new(*self._intersection(other))
+
+    __rand__ = __and__
+
+    def __sub__(self, other):
+        other = self._operand(other)
+        if other is None:
+            return NotImplemented
+        return self._new(*self._difference(other))
+
+    def __rsub__(self, other):
+        other = self._operand(other)
+        if other is None:
+            return NotImplemented
+        return other - self
+
+    def __ior__(self, other):
+        other = self._operand(other)
+        if other is None:
+            return NotImplemented
+        self._set(*self._union(other))
+        return self
+
+    def __iand__(self, other):
+        other = self._operand(other)
+        if other is None:
+            return NotImplemented
+        self._set(*self._intersection(other))
+        return self
+
+    def __isub__(self, other):
+        other = self._operand(other)
+        if other is None:
+            return NotImplemented
+        self._set(*self._difference(other))
+        return self
+
+    def update(self, *iterables):
+        """Adds the jobids of any number of iterables, with a single merge."""
+        others = [self] + [other if isinstance(other, JobidSet) else JobidSet(other)
+                           for other in iterables]
+        self._set(*_merged(heapq.merge(*[zip(other._starts, other._stops)
+                                         for other in others])))
+
+    def difference_update(self, *iterables):
+        """Removes the jobids of any number of iterables."""
+        for other in iterables:
+            self -= other if isinstance(other, JobidSet) else JobidSet(other)
+
+    def __eq__(self, other):
+        if isinstance(other, JobidSet):
+            return self._starts == other._starts and self._stops == other._stops
+        return super().__eq__(other)
+
+    __hash__ = None
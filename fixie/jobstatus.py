@@ -0,0 +1,223 @@
+"""Push-based job status for fixie, so that clients need not poll.
+
+Jobs that are launched with ``detached_call(..., jobid=...)`` are watched by
+``JOB_EVENTS``, which publishes an event when the job's process starts and
+exits. Process exits are detected with pidfds on the IOLoop, where available,
+and otherwise by periodically checking the watched PIDs. Clients subscribe to
+the events of jobs, by jobid or alias, through ``JobStatusHandler``, either as
+a long-poll or as a stream of server-sent events. Subscribers must be logged in,
+and may only look up their own aliases and the jobs that are aliased to them.
+"""
+import os
+import time
+import datetime
+import functools
+from collections import OrderedDict
+
+import tornado.ioloop
+import tornado.queues
+from tornado.iostream import StreamClosedError
+from tornado.util import TimeoutError
+
+from fixie.environ import ENV
+from fixie.request_handler import RequestHandler, authenticated
+from fixie.response_cache import RESPONSE_CACHE
+from fixie.tools import jobids_from_alias, jobids_of_user
+import fixie.jsonutils as json
+
+
+class JobEvents:
+    """A hub that publishes the state changes of jobs to their subscribers,
+    and remembers the latest event of recent jobs. Listeners are functions
+    that are called with every event.
+    """
+
+    # number of jobs whose latest event is remembered
+    max_states = 10000
+    # seconds between checks of the watched PIDs, when pidfds are unavailable
+    poll_interval = 0.5
+
+    def __init__(self):
+        self.states = OrderedDict()
+        self.subscribers = {}
+        self.listeners = []
+        self.watched = {}
+        self._poller = None
+
+    def publish(self, event):
+        """Publishes an event for event['jobid'] to its subscribers."""
+        jobid = event['jobid']
+        self.states[jobid] = event
+        self.states.move_to_end(jobid)
+        while len(self.states) > self.max_states:
+            self.states.popitem(last=False)
+        if event['state'] == 'exited':
+            RESPONSE_CACHE.invalidate('job:' + str(jobid))
+        for listener in self.listeners:
+            listener(event)
+        for queue in self.subscribers.get(jobid, ()):
+            queue.put_nowait(event)
+
+    def subscribe(self, jobids):
+        """Returns a queue that receives the events of the jobids."""
+        queue = tornado.queues.Queue()
+        queue.jobids = frozenset(jobids)
+        for jobid in queue.jobids:
+            self.subscribers.setdefault(jobid, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        """Stops sending events to a queue from subscribe()."""
+        for jobid in queue.jobids:
+            queues = self.subscribers.get(jobid, None)
+            if queues is None:
+                continue
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[jobid]
+
+    def _event(self, jobid, pid, state):
+        return {'jobid': jobid, 'pid': pid, 'state': state, 'time': time.time()}
+
+    def watch(self, jobid, pid):
+        """Publishes that a job is running as process pid, and watches the
+        process so that its exit is published too.
+        """
+        self.publish(self._event(jobid, pid, 'running'))
+        loop = tornado.ioloop.IOLoop.current()
+        try:
+            fd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            self.publish(self._event(jobid, pid, 'exited'))
+            return
+        except (AttributeError, OSError):
+            # no pidfd support, check the PID periodically instead
+            self.watched[pid] = jobid
+            if self._poller is None:
+                self._poller = tornado.ioloop.PeriodicCallback(self._poll,
+                                                               self.poll_interval * 1000)
+                self._poller.start()
+            return
+
+        def exited(fd, events):
+            loop.remove_handler(fd)
+            os.close(fd)
+            self.publish(self._event(jobid, pid, 'exited'))
+
+        loop.add_handler(fd, exited, loop.READ)
+
+    def _poll(self):
+        for pid, jobid in list(self.watched.items()):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                del self.watched[pid]
+                self.publish(self._event(jobid, pid, 'exited'))
+            except PermissionError:
+                pass
+        if not self.watched:
+            self._poller.stop()
+            self._poller = None
+
+
+JOB_EVENTS = JobEvents()
+
+
+def _event_key(event):
+    return event['jobid'], event['state'], event['time']
+
+
+class JobStatusHandler(RequestHandler):
+    """Sends the status events of jobs, given as a list of jobids and/or an
+    alias (user, name, and project). Events newer than the 'since' timestamp
+    are sent. By default, this long-polls: it responds as soon as there is at
+    least one such event, or after $FIXIE_LONGPOLL_TIMEOUT seconds with an
+    empty list of events. Clients that accept text/event-stream instead receive
+    each event as a server-sent event until all of the jobs have exited.
+    The user must be logged in, and the user of an alias, if given, must be
+    the logged in user. Other jobids are ignored unless they have an alias of
+    the logged in user.
+    """
+
+    schema = {
+        'jobids': {'type': 'list', 'schema': {'type': 'integer'}},
+        'user': {'type': 'string'},
+        'name': {'type': 'string'},
+        'project': {'type': 'string'},
+        'since': {'type': 'number'},
+        }
+
+    def _requested_jobids(self, user):
+        args = self.request.arguments
+        jobids = set(args.get('jobids', ()))
+        if jobids:
+            jobids &= jobids_of_user(user)
+        if 'user' in args:
+            jobids |= jobids_from_alias(user, name=args.get('name', ''),
+                                        project=args.get('project', ''))
+        return jobids
+
+    async def requested_jobids(self):
+        """Returns the set of the logged in user's jobids in the request. The
+        aliases are looked up on an executor thread, since this takes a lock.
+        """
+        user = self.current_user.decode('utf-8')
+        return await tornado.ioloop.IOLoop.current().run_in_executor(
+            None, functools.partial(self._requested_jobids, user))
+
+    @authenticated
+    async def post(self):
+        user = self.request.arguments.get('user', None)
+        if user is not None and user != self.current_user.decode('utf-8'):
+            self.send_error(403, message='Only your own aliases may be looked up.')
+            return
+        jobids = await self.requested_jobids()
+        since = self.request.arguments.get('since', 0.0)
+        timeout = datetime.timedelta(seconds=ENV.get('FIXIE_LONGPOLL_TIMEOUT', 30.0))
+        queue = JOB_EVENTS.subscribe(jobids)
+        try:
+            # events published after subscribing may also be in the snapshot
+            events = [e for e in map(JOB_EVENTS.states.get, jobids)
+                      if e is not None and e['time'] > since]
+            seen = {_event_key(e) for e in events}
+            if 'text/event-stream' in self.request.headers.get('Accept', ''):
+                await self.stream(queue, jobids, events, seen, timeout)
+                return
+            if not events and jobids:
+                try:
+                    events.append(await queue.get(timeout=timeout))
+                except TimeoutError:
+                    pass
+            while queue.qsize() > 0:
+                event = queue.get_nowait()
+                if _event_key(event) not in seen:
+                    events.append(event)
+            self.write({'events': events, 'timeout': not events})
+        finally:
+            JOB_EVENTS.unsubscribe(queue)
+
+    async def stream(self, queue, jobids, events, seen, timeout):
+        """Sends events as server-sent events until all of the jobs have exited."""
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        pending = set(jobids)
+        try:
+            while True:
+                for event in events:
+                    self.write('data: ' + json.encode(event) + '\n\n')
+                    if event['state'] == 'exited':
+                        pending.discard(event['jobid'])
+                events = []
+                if not pending:
+                    break
+                await self.flush()
+                try:
+                    event = await queue.get(timeout=timeout)
+                except TimeoutError:
+                    # keep the connection alive, and detect closed connections
+                    self.write(': keepalive\n\n')
+                    continue
+                if _event_key(event) not in seen:
+                    events.append(event)
+        except StreamClosedError:
+            pass
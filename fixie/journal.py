@@ -0,0 +1,342 @@
+"""A write-ahead journal for jobid and alias mutations.
+
+When $FIXIE_JOURNAL is enabled, jobid allocations and alias changes are not
+written by rewriting $FIXIE_JOBID_FILE and $FIXIE_JOB_ALIASES_FILE. Instead,
+they are appended as line-oriented JSON records to $FIXIE_JOURNAL_FILE, and
+those two files become the snapshot that the journal is replayed on top of.
+
+Mutations are committed by a single committer thread, which group commits the
+mutations that arrive while it is busy: they are appended with a single write
+and a single fsync while holding the journal lock. Threads may wait for their
+commits with ``commit()``, and coroutines on the IOLoop may await them with
+``commit_async()``, so that concurrent requests share commits without blocking
+the IOLoop. Every process keeps the current state in memory and only reads the records that
+were appended since it last looked. Once the journal holds
+$FIXIE_JOURNAL_COMPACT_SIZE records, it is compacted into a new snapshot.
+
+All records are idempotent, so replaying a journal onto a snapshot that
+already contains some of its records (e.g. after a crash during compaction)
+gives the same state. A partially written last record (e.g. after a crash
+during a commit) is discarded.
+"""
+import os
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from fixie.environ import ENV, ensure_parent_dir
+from fixie.tools import flock
+from fixie.jobidset import JobidSet
+import fixie.jsonutils as json
+
+
+def atomic_write(filename, s):
+    """Durably replaces the contents of a file with a string, so that the file
+    has either its old or its new contents even if the process crashes.
+    """
+    d = os.path.dirname(ensure_parent_dir(filename)) or '.'
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as fh:
+        fh.write(s)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, filename)
+    fd = os.open(d, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _Pending:
+    """A mutation that is waiting to be committed."""
+
+    __slots__ = ('op', 'result', 'error', 'future')
+
+    def __init__(self, op):
+        self.op = op
+        self.result = None
+        self.error = None
+        self.future = Future()
+
+
+class Journal:
+    """The jobid and alias state, as seen by this process, and the committer
+    of mutations to it.
+    """
+
+    def __init__(self, filename=None):
+        """
+        Parameters
+        ----------
+        filename : str or None, optional
+            Path to the journal file, if None, defaults to $FIXIE_JOURNAL_FILE.
+        """
+        self._filename = filename
+        self._start_lock = threading.Lock()
+        self._committer = None
+        self._pid = None
+        self.commits = 0
+        self.clear()
+
+    @property
+    def filename(self):
+        value = self._filename
+        if value is None:
+            value = ENV['FIXIE_JOURNAL_FILE']
+        return value
+
+    @filename.setter
+    def filename(self, value):
+        self._filename = value
+        self.clear()
+
+    def clear(self):
+        """Forgets the in-memory state, so that it is reread."""
+        self.next_jobid = None
+        self.aliases = None
+        self.records = 0
+        self.offset = 0
+        self._inode = None
+
+    #
+    # state
+    #
+
+    def _load_snapshot(self):
+        f = ENV['FIXIE_JOBID_FILE']
+        self.next_jobid = 0
+        if os.path.isfile(f):
+            with open(f) as fh:
+                self.next_jobid = int(fh.read().strip() or 0)
+        f = ENV['FIXIE_JOB_ALIASES_FILE']
+        self.aliases = {}
+        if os.path.isfile(f):
+            with open(f) as fh:
+                s = fh.read()
+            if s.strip():
+                self.aliases = json.loads(s)
+        for u in self.aliases.values():
+            for p in u.values():
+                for name, j in p.items():
+                    if not isinstance(j, JobidSet):
+                        p[name] = JobidSet(j)
+        self.records = 0
+
+    def _apply(self, rec):
+        op = rec['op']
+        if op == 'jobids':
+            self.next_jobid = max(self.next_jobid, rec['start'] + rec['n'])
+        elif op == 'alias':
+            for jobid, user, name, project in rec['aliases']:
+                names = self.aliases.setdefault(user, {}).setdefault(project, {})
+                names.setdefault(name, JobidSet()).add(jobid)
+        elif op == 'unalias':
+            jobids = JobidSet(rec['jobids'])
+            for user, u in list(self.aliases.items()):
+                for project, p in list(u.items()):
+                    for name, j in list(p.items()):
+                        j -= jobids
+                        if not j:
+                            del p[name]
+                    if not p:
+                        del u[project]
+                if not u:
+                    del self.aliases[user]
+        else:
+            raise ValueError('unknown journal operation: ' + repr(op))
+        self.records += 1
+
+    def update(self):
+        """Reads the records that were appended to the journal since the last
+        update, reloading the snapshot if the journal was compacted. This must
+        be called while holding the journal lock.
+        """
+        f = self.filename
+        try:
+            st = os.stat(f)
+        except FileNotFoundError:
+            st = None
+        inode = None if st is None else st.st_ino
+        if self.aliases is None or inode != self._inode or \
+                (st is not None and st.st_size < self.offset):
+            self._load_snapshot()
+            self._inode = inode
+            self.offset = 0
+        if st is None or st.st_size == self.offset:
+            return
+        with open(f, 'rb') as fh:
+            fh.seek(self.offset)
+            data = fh.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            # discard a partially written record
+            with open(f, 'r+b') as fh:
+                fh.truncate(self.offset + end)
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._apply(json.loads(line.decode('utf-8')))
+        self.offset += end
+
+    def _record(self, op):
+        """Turns a requested operation into a journal record and its result."""
+        kind, arg = op
+        if kind == 'jobids':
+            rec = {'op': 'jobids', 'start': self.next_jobid, 'n': arg}
+            return rec, range(self.next_jobid, self.next_jobid + arg)
+        elif kind == 'alias':
+            return {'op': 'alias', 'aliases': [list(a) for a in arg]}, True
+        elif kind == 'unalias':
+            return {'op': 'unalias', 'jobids': JobidSet(arg)}, True
+        raise ValueError('unknown journal operation: ' + repr(kind))
+
+    def _commit_batch(self, batch):
+        """Commits a batch of pending mutations with a single write and fsync."""
+        f = self.filename
+        try:
+            with flock(f, timeout=None):
+                try:
+                    self._write_batch(f, batch)
+                except Exception:
+                    # the in-memory state may be ahead of the journal, reread it
+                    self.clear()
+                    raise
+        except Exception as e:
+            for item in batch:
+                if item.error is None:
+                    item.error = e
+
+    def _write_batch(self, f, batch):
+        self.update()
+        lines = []
+        for item in batch:
+            try:
+                rec, item.result = self._record(item.op)
+            except Exception as e:
+                item.error = e
+                continue
+            self._apply(rec)
+            lines.append(json.dumps(rec) + '\n')
+        if lines:
+            data = ''.join(lines).encode('utf-8')
+            fd = os.open(ensure_parent_dir(f), os.O_WRONLY|os.O_APPEND|os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+                os.fsync(fd)
+                self._inode = os.fstat(fd).st_ino
+            finally:
+                os.close(fd)
+            self.offset += len(data)
+            self.commits += 1
+        if self.records >= ENV.get('FIXIE_JOURNAL_COMPACT_SIZE', 10000):
+            self._compact()
+
+    def _compact(self):
+        """Writes the current state as the snapshot and empties the journal. This
+        must be called while holding the journal lock.
+        """
+        atomic_write(ENV['FIXIE_JOBID_FILE'], str(self.next_jobid))
+        atomic_write(ENV['FIXIE_JOB_ALIASES_FILE'], json.dumps(self.aliases))
+        atomic_write(self.filename, '')
+        self._inode = os.stat(self.filename).st_ino
+        self.offset = 0
+        self.records = 0
+
+    def compact(self):
+        """Compacts the journal into a new snapshot."""
+        with flock(self.filename, timeout=None):
+            self.update()
+            self._compact()
+
+    #
+    # committing
+    #
+
+    def submit(self, op):
+        """Submits a mutation to the committer thread, and returns a
+        concurrent.futures.Future of its result. Operations are ('jobids', n),
+        ('alias', [(jobid, user, name, project), ...]), and ('unalias', jobids).
+        """
+        item = _Pending(op)
+        if self._pid != os.getpid():
+            self._start_committer()
+        with self._mutex:
+            self._pending.append(item)
+        self._committer.submit(self._drain)
+        return item.future
+
+    def _start_committer(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # the committer thread does not survive a fork, so each process
+            # starts its own
+            self._mutex = threading.Lock()
+            self._pending = []
+            self._committer = ThreadPoolExecutor(max_workers=1,
+                                                 thread_name_prefix='fixie-journal')
+            self._pid = os.getpid()
+
+    def _drain(self):
+        with self._mutex:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self._commit_batch(batch)
+        for item in batch:
+            if item.error is not None:
+                item.future.set_exception(item.error)
+            else:
+                item.future.set_result(item.result)
+
+    def commit(self, op):
+        """Commits a mutation, and returns its result. Mutations that are
+        submitted while the committer thread is busy are committed together.
+        """
+        return self.submit(op).result()
+
+    def commit_async(self, op):
+        """Commits a mutation from a coroutine on the IOLoop, returning an
+        awaitable of its result. The IOLoop is not blocked while committing,
+        so the mutations of concurrent requests are committed together.
+        """
+        return asyncio.wrap_future(self.submit(op))
+
+    #
+    # queries
+    #
+
+    def read(self):
+        """Brings the in-memory state up to date."""
+        with flock(self.filename, timeout=None):
+            self.update()
+
+    def jobids_from_alias(self, user, name='', project=''):
+        """Returns the JobidSet of the jobids with an alias."""
+        # the committer thread changes the state while holding the lock
+        with flock(self.filename, timeout=None):
+            self.update()
+            return JobidSet(self.aliases.get(user, {}).get(project, {}).get(name, ()))
+
+    def jobids_of_user(self, user):
+        """Returns the JobidSet of the jobids with any alias of a user."""
+        jobids = JobidSet()
+        with flock(self.filename, timeout=None):
+            self.update()
+            jobids.update(*[j for p in self.aliases.get(user, {}).values()
+                            for j in p.values()])
+        return jobids
+
+    def jobids_with_name(self, name):
+        """Returns the JobidSet of the jobids with a name, across all users and
+        projects.
+        """
+        jobids = JobidSet()
+        with flock(self.filename, timeout=None):
+            self.update()
+            jobids.update(*[p[name] for u in self.aliases.values() for p in u.values()
+                            if name in p])
+        return jobids
+
+
+JOURNAL = Journal()
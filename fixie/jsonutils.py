@@ -4,10 +4,14 @@ import uuid
 import base64
 from collections.abc import Set
 
+from fixie.jobidset import JobidSet
+
 
 def default(obj):
     """For custom object serialization."""
-    if isinstance(obj, Set):
+    if isinstance(obj, JobidSet):
+        return {'__jobidset__': True, 'ranges': obj.ranges()}
+    elif isinstance(obj, Set):
         return {'__set__': True, 'elements': sorted(obj)}
     elif isinstance(obj, bytes):
         return {'__bytes__': 'base64',
@@ -19,7 +23,9 @@ def default(obj):
 
 def object_hook(dct):
     """For custom object deserialization."""
-    if '__set__' in dct:
+    if '__jobidset__' in dct:
+        return JobidSet.from_ranges(dct['ranges'])
+    elif '__set__' in dct:
         return set(dct['elements'])
     elif '__bytes__' in dct:
         return base64.standard_b64decode(dct['value'].encode('utf-8'))
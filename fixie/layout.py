@@ -0,0 +1,152 @@
+"""Tools for laying out per-job storage on the filesystem.
+
+Clients always see the logical paths made by ``fixie.tools.default_path()``,
+such as ``/proj/42.h5``. On disk, these may be fanned out into subdirectories
+so that no single directory grows too large. The layout is selected by
+$FIXIE_SHARD_LAYOUT, which may be one of:
+
+* ``'flat'``: the physical path is the logical path (the default),
+* ``'hash'``: two levels of directories from the hash of the file name,
+  e.g. ``/proj/95/b3/42.h5``,
+* ``'range'``: one level of directories from the jobid divided by
+  $FIXIE_SHARD_SIZE, e.g. ``/proj/0/42.h5``. Files whose names are not
+  jobids fall back to the hash layout.
+"""
+import os
+import sys
+import argparse
+import hashlib
+
+from fixie.environ import ENV, context, ensure_parent_dir
+from fixie.logger import LOGGER
+from fixie.tools import flock
+from fixie.reaper import rewrite_index
+import fixie.jsonutils as json
+
+
+LAYOUTS = frozenset(['flat', 'hash', 'range'])
+
+
+def _jobid_stem(base):
+    """Returns the jobid that a file name represents, or None."""
+    stem = base.split('.', 1)[0]
+    return int(stem) if stem.isdigit() else None
+
+
+def _shard_dirs(base, layout, size):
+    """Returns the list of shard directories for a file name."""
+    if layout == 'flat':
+        return []
+    elif layout not in LAYOUTS:
+        raise ValueError('shard layout {0!r} not recognized'.format(layout))
+    jobid = _jobid_stem(base)
+    if layout == 'range' and jobid is not None:
+        return [str(jobid // size)]
+    h = hashlib.sha1(base.encode('utf-8')).hexdigest()
+    return [h[:2], h[2:4]]
+
+
+def shard_path(path, layout=None, size=None):
+    """Maps a logical path (e.g. from default_path()) to its sharded location.
+    The result still starts with a '/' and must be joined to a storage root.
+    If layout or size is None, $FIXIE_SHARD_LAYOUT or $FIXIE_SHARD_SIZE is used.
+    """
+    layout = ENV['FIXIE_SHARD_LAYOUT'] if layout is None else layout
+    size = ENV['FIXIE_SHARD_SIZE'] if size is None else size
+    if not path.startswith('/'):
+        path = '/' + path
+    d, base = path.rsplit('/', 1)
+    return '/'.join([d] + _shard_dirs(base, layout, size) + [base])
+
+
+def unshard_path(path, layout=None):
+    """Inverse of shard_path(). Maps a sharded path back to its logical path."""
+    layout = ENV['FIXIE_SHARD_LAYOUT'] if layout is None else layout
+    parts = path.strip('/').split('/')
+    base = parts[-1]
+    n = len(_shard_dirs(base, layout, 1))
+    if len(parts) < n + 1:
+        raise ValueError('{0!r} is not a {1!r} sharded path'.format(path, layout))
+    return '/' + '/'.join(parts[:-n - 1] + [base])
+
+
+def storage_path(path, root=None, layout=None, size=None):
+    """Resolves a logical path to the physical path of the file in the storage
+    root, which defaults to $FIXIE_SIMS_DIR. This does not touch the filesystem.
+    """
+    root = ENV['FIXIE_SIMS_DIR'] if root is None else root
+    return os.path.join(root, shard_path(path, layout=layout, size=size).lstrip('/'))
+
+
+def _remove_empty_dirs(root):
+    """Removes empty directories under (but not including) root."""
+    for d, dirs, files in os.walk(root, topdown=False):
+        if d != root and not os.listdir(d):
+            os.rmdir(d)
+
+
+def _update_expiry_index(moved):
+    """Rewrites the paths in the expiry index after files have been moved."""
+    # the index is replaced atomically, so that running reapers start over
+    # rather than reading it from the middle of a line
+    f = ENV['FIXIE_EXPIRY_FILE']
+    with flock(f, timeout=None) as lockfd:
+        if not os.path.isfile(f):
+            return
+        entries = json.loadlines(f)
+        for entry in entries:
+            entry['paths'] = [moved.get(p, p) for p in entry['paths']]
+        rewrite_index(entries)
+
+
+def migrate_layout(root, src, dst, size=None, update_index=True):
+    """Moves all of the files in a storage root from the src layout to the dst
+    layout, and removes any directories left empty. When update_index is True,
+    the paths in the expiry index are updated too. The logical paths are not
+    changed. Returns a dict mapping old physical paths to new ones.
+    """
+    size = ENV['FIXIE_SHARD_SIZE'] if size is None else size
+    moved = {}
+    for d, dirs, files in os.walk(root):
+        for fname in files:
+            old = os.path.join(d, fname)
+            rel = '/' + os.path.relpath(old, root).replace(os.sep, '/')
+            logical = unshard_path(rel, layout=src)
+            new = storage_path(logical, root=root, layout=dst, size=size)
+            if new != old:
+                moved[old] = new
+    for old, new in moved.items():
+        os.replace(old, ensure_parent_dir(new))
+    _remove_empty_dirs(root)
+    if update_index and moved:
+        _update_expiry_index(moved)
+    return moved
+
+
+def make_parser():
+    """Makes an argument parser for the layout migration tool."""
+    p = argparse.ArgumentParser('fixie.layout',
+                                description='Migrates fixie storage between layouts.')
+    p.add_argument('--root', default=None,
+                   help='storage root to migrate, default is $FIXIE_SIMS_DIR.')
+    p.add_argument('--size', default=None, type=int,
+                   help='number of jobids per range directory, default is '
+                        '$FIXIE_SHARD_SIZE.')
+    p.add_argument('src', choices=sorted(LAYOUTS), help='current layout.')
+    p.add_argument('dst', choices=sorted(LAYOUTS), help='layout to migrate to.')
+    return p
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    with context():
+        ns = make_parser().parse_args(args)
+        root = ENV['FIXIE_SIMS_DIR'] if ns.root is None else ns.root
+        moved = migrate_layout(root, ns.src, ns.dst, size=ns.size)
+        LOGGER.log('migrated {0} files from {1} to {2} layout', category='layout',
+                   data={'root': root, 'src': ns.src, 'dst': ns.dst},
+                   args=(len(moved), ns.src, ns.dst))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""A load generator that drives a local fixie server end to end.
+
+The server runs in a child process with mock services, and is driven over
+HTTP on the loopback interface by an asynchronous client with a configurable
+number of concurrent requests. While under load, the server measures how late
+its IOLoop wakes up, which exposes callbacks that block the loop. Run with::
+
+    $ python -m fixie.loadtest --requests 10000 --concurrency 64 --payload 1000
+"""
+import sys
+import time
+import argparse
+import multiprocessing
+
+import tornado.gen
+import tornado.web
+import tornado.ioloop
+import tornado.httpserver
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from tornado.testing import bind_unused_port
+
+from fixie.metrics import Histogram, MetricsHandler
+from fixie.request_handler import RequestHandler
+import fixie.jsonutils as json
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2,
+                   0.5, 1.0, 2.0, 5.0)
+
+
+class NameObjectRequest(RequestHandler):
+    """Mock service that echos a name, ignoring any payload."""
+
+    schema = {'name': {'type': 'string'}, 'payload': {'type': 'list'}}
+
+    def post(self):
+        name = self.request.arguments['name']
+        self.write({'nomen': 'My name is ' + name})
+
+
+class MockVerifyRequest(RequestHandler):
+    """Mock service that only verifies if user == token"""
+
+    schema = {'user': {'type': 'string'}, 'token': {'type': 'string'}}
+
+    def post(self):
+        verified = self.request.arguments['user'] == self.request.arguments['token']
+        self.write({'verified': verified, 'message': '', 'status': True})
+
+
+class LoopLagMonitor:
+    """Measures how late the IOLoop runs a callback that is scheduled every
+    interval seconds. Large lags mean that something blocked the loop.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = Histogram(LATENCY_BUCKETS)
+        self.max_lag = 0.0
+        self._expected = None
+        self._handle = None
+
+    def start(self):
+        self._expected = time.perf_counter() + self.interval
+        self._handle = tornado.ioloop.IOLoop.current().call_later(self.interval,
+                                                                  self._tick)
+
+    def stop(self):
+        if self._handle is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._handle)
+            self._handle = None
+
+    def _tick(self):
+        now = time.perf_counter()
+        lag = max(0.0, now - self._expected)
+        self.lags.observe(lag)
+        self.max_lag = max(self.max_lag, lag)
+        self._expected = now + self.interval
+        self._handle = tornado.ioloop.IOLoop.current().call_later(self.interval,
+                                                                  self._tick)
+
+    def report(self):
+        return {'buckets': self.lags.buckets, 'counts': self.lags.counts,
+                'count': self.lags.count, 'max': self.max_lag}
+
+
+class LagReportRequest(tornado.web.RequestHandler):
+    """Reports the IOLoop lags measured by the server."""
+
+    def initialize(self, monitor):
+        self.monitor = monitor
+
+    def get(self):
+        self.write(json.encode(self.monitor.report()))
+
+
+def make_app(monitor):
+    """Makes the application with the mock services."""
+    handlers = [
+        (r'/', NameObjectRequest),
+        (r'/verify', MockVerifyRequest),
+        (r'/metrics', MetricsHandler),
+        (r'/loadtest/lag', LagReportRequest, {'monitor': monitor}),
+    ]
+    return tornado.web.Application(handlers)
+
+
+def serve(conn, lag_interval=0.01):
+    """Runs the mock server in the current process, sending its port over conn."""
+    sock, port = bind_unused_port()
+    monitor = LoopLagMonitor(lag_interval)
+    server = tornado.httpserver.HTTPServer(make_app(monitor))
+    server.add_sockets([sock])
+    conn.send(port)
+    conn.close()
+    loop = tornado.ioloop.IOLoop.current()
+    loop.add_callback(monitor.start)
+    loop.start()
+
+
+def start_server(lag_interval=0.01):
+    """Starts the mock server in a child process. Returns the process and its
+    base URL.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    parent, child = ctx.Pipe()
+    proc = ctx.Process(target=serve, args=(child, lag_interval), daemon=True)
+    proc.start()
+    port = parent.recv()
+    return proc, 'http://127.0.0.1:' + str(port)
+
+
+def make_body(endpoint, payload):
+    """Returns the request body for an endpoint, with payload extra elements."""
+    if endpoint == 'verify':
+        return json.encode({'user': 'me', 'token': 'me'})
+    return json.encode({'name': 'Inigo Montoya', 'payload': list(range(payload))})
+
+
+@tornado.gen.coroutine
+def drive(url, body, requests=1000, concurrency=10):
+    """Sends a number of POST requests to a URL, keeping concurrency requests
+    in flight. Returns the list of latencies, the number of errors, and
+    the total elapsed time.
+    """
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    latencies = []
+    errors = [0]
+    remaining = [requests]
+
+    @tornado.gen.coroutine
+    def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            t0 = time.perf_counter()
+            try:
+                yield client.fetch(url, method='POST', body=body)
+            except (HTTPError, OSError):
+                errors[0] += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    yield [worker() for i in range(concurrency)]
+    elapsed = time.perf_counter() - t0
+    client.close()
+    return latencies, errors[0], elapsed
+
+
+def percentile(values, p):
+    """Returns the p-th percentile (0 <= p <= 100) of sorted values."""
+    if not values:
+        return 0.0
+    i = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[i]
+
+
+@tornado.gen.coroutine
+def _fetch_lag(base_url):
+    client = AsyncHTTPClient(force_instance=True)
+    response = yield client.fetch(base_url + '/loadtest/lag')
+    client.close()
+    return json.decode(response.body)
+
+
+def run(requests=1000, concurrency=10, payload=0, endpoint='name', lag_interval=0.01):
+    """Starts a mock server, drives it, and returns a report dict."""
+    proc, base_url = start_server(lag_interval=lag_interval)
+    url = base_url + ('/verify' if endpoint == 'verify' else '/')
+    body = make_body(endpoint, payload)
+    loop = tornado.ioloop.IOLoop.current()
+    try:
+        latencies, errors, elapsed = loop.run_sync(
+            lambda: drive(url, body, requests=requests, concurrency=concurrency))
+        lag = loop.run_sync(lambda: _fetch_lag(base_url))
+    finally:
+        proc.terminate()
+        proc.join()
+    hist = Histogram(LATENCY_BUCKETS)
+    for x in latencies:
+        hist.observe(x)
+    latencies.sort()
+    return {'requests': requests, 'concurrency': concurrency, 'payload': payload,
+            'endpoint': endpoint, 'bytes': len(body), 'errors': errors,
+            'elapsed': elapsed, 'throughput': len(latencies) / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99), 'max': latencies[-1] if latencies else 0.0,
+            'latency': {'buckets': hist.buckets, 'counts': hist.counts},
+            'lag': lag, 'lag_interval': lag_interval}
+
+
+def _format_histogram(buckets, counts, width=40):
+    lines = []
+    top = max(counts) or 1
+    lower = 0.0
+    for bound, c in zip(tuple(buckets) + (float('inf'),), counts):
+        label = '{0:>8.1f} - {1:<8.1f} ms'.format(lower * 1e3, bound * 1e3)
+        lines.append('{0} {1:>8d} {2}'.format(label, c, '#' * int(width * c / top)))
+        lower = bound
+    return '\n'.join(lines)
+
+
+def format_report(report):
+    """Formats a load test report as a string."""
+    s = ('{requests} {endpoint} requests of {bytes} bytes, {concurrency} concurrent\n'
+         'errors: {errors}, elapsed: {elapsed:.3f} s, throughput: {throughput:.1f} req/s\n'
+         'latency p50: {p50_ms:.3f} ms, p90: {p90_ms:.3f} ms, p99: {p99_ms:.3f} ms, '
+         'max: {max_ms:.3f} ms\n')
+    ms = {k + '_ms': report[k] * 1e3 for k in ('p50', 'p90', 'p99', 'max')}
+    s = s.format(**report, **ms)
+    s += 'latency histogram:\n'
+    s += _format_histogram(report['latency']['buckets'], report['latency']['counts'])
+    lag = report['lag']
+    s += '\nserver IOLoop lag (checked every {0:.1f} ms), max: {1:.3f} ms\n'.format(
+         report['lag_interval'] * 1e3, lag['max'] * 1e3)
+    s += _format_histogram(lag['buckets'], lag['counts'])
+    return s
+
+
+def make_parser():
+    """Makes an argument parser for the load generator."""
+    p = argparse.ArgumentParser('fixie.loadtest',
+                                description='Drives a local fixie server with mock services.')
+    p.add_argument('-n', '--requests', default=1000, type=int,
+                   help='total number of requests to send.')
+    p.add_argument('-c', '--concurrency', default=10, type=int,
+                   help='number of requests in flight at once.')
+    p.add_argument('--payload', default=0, type=int,
+                   help='number of extra elements in each request body.')
+    p.add_argument('--endpoint', default='name', choices=['name', 'verify'],
+                   help='mock service to drive.')
+    p.add_argument('--lag-interval', default=0.01, type=float, dest='lag_interval',
+                   help='seconds between server IOLoop lag checks.')
+    p.add_argument('--json', default=False, action='store_true',
+                   help='print the report as JSON.')
+    return p
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    ns = make_parser().parse_args(args)
+    report = run(requests=ns.requests, concurrency=ns.concurrency, payload=ns.payload,
+                 endpoint=ns.endpoint, lag_interval=ns.lag_interval)
+    print(json.dumps(report) if ns.json else format_report(report))
+
+
+if __name__ == '__main__':
+    main()
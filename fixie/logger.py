@@ -1,14 +1,75 @@
-"""Logging tools for fixie"""
+"""Logging tools for fixie.
+
+Each message has a level, and is only logged if its level is at least the
+minimum level for its category, from $FIXIE_LOG_CATEGORY_LEVELS or else
+$FIXIE_LOG_LEVEL. High-volume categories may also be sampled with
+$FIXIE_LOG_SAMPLING. The minimum level and sampling fraction of each category
+are cached until the environment changes, so that a message that is filtered
+out costs a dict lookup and a comparison, and is never formatted or encoded.
+"""
 import os
 import time
+import random
 from collections.abc import Set
 
 from xonsh.tools import print_color
+from xonsh.events import events
 
-from fixie.environ import ENV, expand_file_and_mkdirs
+from fixie.environ import ENV, LOG_LEVELS, expand_file, ensure_parent_dir
 import fixie.jsonutils as json
 
 
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+CRITICAL = 50
+
+# the names are validated by the ensurers of $FIXIE_LOG_LEVEL and
+# $FIXIE_LOG_CATEGORY_LEVELS, so that bad names are rejected when set
+LEVELS = dict(zip(LOG_LEVELS, (DEBUG, INFO, WARNING, ERROR, CRITICAL)))
+LEVEL_NAMES = {value: key for key, value in LEVELS.items()}
+
+
+def level_number(level):
+    """Returns the number of a level, given as a number or a name."""
+    if isinstance(level, int):
+        return level
+    try:
+        return LEVELS[level.lower()]
+    except KeyError:
+        raise ValueError('unknown log level: ' + repr(level)) from None
+
+
+# (minimum level, sampling fraction) by category, and the number of variables
+# in ENV when they were computed, since deletions do not fire events.
+_THRESHOLDS = {}
+_THRESHOLDS_LEN = [-1]
+
+
+def invalidate_thresholds(*args, **kwargs):
+    """Clears the cached minimum levels and sampling fractions. This is called
+    automatically whenever a variable in ENV is added or changed.
+    """
+    _THRESHOLDS.clear()
+
+
+events.on_envvar_new(invalidate_thresholds)
+events.on_envvar_change(invalidate_thresholds)
+
+
+def _threshold(category):
+    n = len(ENV)
+    if _THRESHOLDS_LEN[0] != n:
+        _THRESHOLDS.clear()
+        _THRESHOLDS_LEN[0] = n
+    levels = ENV.get('FIXIE_LOG_CATEGORY_LEVELS', None) or {}
+    level = levels.get(category, None) or ENV.get('FIXIE_LOG_LEVEL', 'info')
+    sampling = ENV.get('FIXIE_LOG_SAMPLING', None) or {}
+    rtn = _THRESHOLDS[category] = (level_number(level), sampling.get(category, 1.0))
+    return rtn
+
+
 class Logger:
     """A logging object for fixie that stores information in line-oriented JSON
     format.
@@ -34,18 +95,40 @@ class Logger:
         self._dirty = True
         self._cached_entries = ()
 
-    def log(self, message, category='misc', data=None):
-        """Logs a message, the timestamp, its category, and the
-        and any data to the log file.
+    def enabled(self, category='misc', level=INFO):
+        """Returns whether messages of a level in a category are logged,
+        ignoring sampling.
+        """
+        threshold = _THRESHOLDS.get(category, None)
+        if threshold is None or _THRESHOLDS_LEN[0] != len(ENV):
+            threshold = _threshold(category)
+        return level >= threshold[0]
+
+    def log(self, message, category='misc', data=None, level=INFO, args=()):
+        """Logs a message, the timestamp, its category and level, and
+        any data to the log file. If there are args, the message is
+        formatted with them, but only if it is logged.
         """
+        threshold = _THRESHOLDS.get(category, None)
+        if threshold is None or _THRESHOLDS_LEN[0] != len(ENV):
+            threshold = _threshold(category)
+        if level < threshold[0]:
+            return
+        sample = threshold[1]
+        if sample < 1.0 and random.random() >= sample:
+            return
+        if args:
+            message = message.format(*args)
         self._dirty = True
         entry = {'message': message, 'timestamp': time.time(),
-                 'category': category}
+                 'category': category, 'level': LEVEL_NAMES.get(level, level)}
         if data is not None:
             entry['data'] = data
+        if sample < 1.0:
+            entry['sample'] = sample
 
         # write to log file
-        json.appendline(entry, self.filename)
+        json.appendline(entry, ensure_parent_dir(self.filename))
         # write to stdout
         msg = '{INTENSE_CYAN}' + category + '{PURPLE}:'
         msg += '{INTENSE_WHITE}' + message + '{NO_COLOR}'
@@ -76,7 +159,7 @@ class Logger:
         if value is None:
             self._filename = value
         else:
-            self._filename = expand_file_and_mkdirs(value)
+            self._filename = expand_file(value)
 
 
 LOGGER = Logger()
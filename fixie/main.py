@@ -1,14 +1,23 @@
 """Main function for fixie."""
+import os
 import sys
 import argparse
 import importlib
 
 import tornado.web
 import tornado.ioloop
+from tornado.netutil import bind_unix_socket
 
-from fixie.environ import ENV, ENVVARS, SERVICES, context
+from fixie.environ import (ENV, ENVVARS, SERVICES, context, invalidate_detyped_env,
+    ensure_dir)
 from fixie.logger import LOGGER
-from fixie.tools import cookie_secret
+from fixie.tools import cookie_secret, LAUNCHER
+from fixie.reaper import Reaper
+from fixie.results import RESULT_CACHE
+from fixie.metrics import METRICS, MetricsHandler
+from fixie.watchdog import Watchdog
+from fixie.coordinator import HANDLERS as COORDINATOR_HANDLERS
+from fixie.dispatch import register_application
 
 
 ALL_SERVICES = SERVICES | frozenset(['all'])
@@ -62,6 +71,9 @@ def make_parser():
     p = argparse.ArgumentParser('fixie', description='Cyclus-as-a-Service')
     p.add_argument('-p', '--port', default=8642, dest='port', type=int,
                    help='port to serve the fixie services on.')
+    p.add_argument('-u', '--unix-socket', default=None, dest='unix_socket',
+                   help='path of a Unix domain socket to also serve the fixie '
+                        'services on, for services on the same host.')
     for name, (default, validate, convert, detype, docstr) in ENVVARS.items():
         dest = name
         if name.startswith('FIXIE_'):
@@ -84,28 +96,64 @@ def set_envvars(ns):
             delattr(ns, name)
             continue
         ENV[name] = val
+    invalidate_detyped_env()
+
 
 def run_application(ns):
     """Starts up an application with the loaded services."""
+    # external services write into these without creating them first
+    for name in ('FIXIE_JOBS_DIR', 'FIXIE_SIMS_DIR', 'FIXIE_PATHS_DIR'):
+        ensure_dir(ENV[name])
     # first, find the request handler
     handlers = []
     for service in ns.services:
         name = 'fixie_' + service + '.handlers'
         mod = importlib.import_module(name)
         handlers.extend(mod.HANDLERS)
+    handlers.append((r'/metrics', MetricsHandler))
+    if ENV['FIXIE_COORDINATOR']:
+        handlers.extend(COORDINATOR_HANDLERS)
     # construct the app
     # app = tornado.web.Application(handlers)
     SETTINGS['cookie_secret'] = cookie_secret()
     app = tornado.web.Application(handlers, **SETTINGS)
-    serv = app.listen(ns.port)
+    serv = app.listen(ns.port, max_body_size=ENV['FIXIE_MAX_BODY_SIZE'])
     data = vars(ns)
     url = 'http://localhost:' + str(ns.port)
-    LOGGER.log('debuging fixie')
+    # other URLs only reach this server, e.g. through a proxy, if we are told so
+    urls = [url, 'http://127.0.0.1:' + str(ns.port)]
+    urls.extend(sorted(ENV['FIXIE_SELF_URLS']))
+    unix_socket = getattr(ns, 'unix_socket', None)
+    if unix_socket:
+        unix_socket = os.path.abspath(unix_socket)
+        serv.add_socket(bind_unix_socket(unix_socket))
+        urls.append('unix://' + unix_socket)
+    register_application(app, *filter(None, urls))
     LOGGER.log('starting fixie ' + url, category='server', data=data)
+    # start the supervisor server now, rather than on the first launch
+    LAUNCHER.start()
+    reaper = Reaper()
+    if ENV['FIXIE_HOLDING_TIME'] < float('inf'):
+        reaper.start()
+    RESULT_CACHE.start()
+    dumper = tornado.ioloop.PeriodicCallback(METRICS.dump,
+                                             ENV['FIXIE_METRICS_INTERVAL'] * 1000)
+    dumper.start()
+    watchdog = Watchdog()
+    if watchdog.threshold > 0.0:
+        watchdog.start()
     try:
         tornado.ioloop.IOLoop.current().start()
     except KeyboardInterrupt:
         print()
+    reaper.stop()
+    RESULT_CACHE.stop()
+    dumper.stop()
+    watchdog.stop()
+    LAUNCHER.stop()
+    if unix_socket:
+        serv.stop()
+        os.unlink(unix_socket)
     LOGGER.log('stopping fixie ' + url, category='server', data=data)
 
 
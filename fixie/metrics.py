@@ -0,0 +1,244 @@
+"""Lightweight metrics for fixie, exported in the Prometheus text format.
+
+Each process records counters and histograms in plain dicts, under a lock,
+since metrics are recorded from executor and other threads as well as the
+IOLoop. Processes periodically dump their metrics to $FIXIE_METRICS_DIR, in
+files named by host and PID, and the metrics from all live processes on this
+host are merged when the /metrics endpoint is scraped. The directory may be
+shared between hosts, each of which is scraped on its own.
+"""
+import os
+import time
+import bisect
+import socket
+import functools
+import threading
+from contextlib import contextmanager
+
+import tornado.web
+
+from fixie.environ import ENV, ensure_dir
+import fixie.jsonutils as json
+
+
+HOSTNAME = socket.gethostname()
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+class Histogram:
+    """A histogram of observed values. The counts are per bucket (i.e. not
+    cumulative), with a final overflow bucket for values above the last bound.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts, sum, count):
+        """Adds the counts from another histogram with the same buckets."""
+        for i, c in enumerate(counts):
+            self.counts[i] += c
+        self.sum += sum
+        self.count += count
+
+
+class Metrics:
+    """A registry of the counters and histograms for this process."""
+
+    __inst = None
+
+    def __new__(cls, *args, **kwargs):
+        # make the metrics registry a singleton
+        if Metrics.__inst is None:
+            Metrics.__inst = object.__new__(cls)
+        return Metrics.__inst
+
+    def __init__(self, directory=None):
+        """
+        Parameters
+        ----------
+        directory : str or None, optional
+            Path to the directory that processes dump their metrics into,
+            if None, defaults to $FIXIE_METRICS_DIR.
+        """
+        self._directory = directory
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @property
+    def directory(self):
+        value = self._directory
+        if value is None:
+            value = ENV['FIXIE_METRICS_DIR']
+        return value
+
+    @directory.setter
+    def directory(self, value):
+        self._directory = value
+
+    def inc(self, name, value=1, **labels):
+        """Increments a counter."""
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Records a value in a histogram."""
+        key = _key(name, labels)
+        with self._lock:
+            h = self.histograms.get(key, None)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+            h.observe(value)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """A context manager that records the time spent in its body (in
+        seconds) in a histogram.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def clear(self):
+        """Removes all metrics from this process."""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        """Returns a JSON serializable snapshot of this process' metrics."""
+        with self._lock:
+            counters = [[name, dict(labels), value]
+                        for (name, labels), value in self.counters.items()]
+            histograms = [[name, dict(labels), h.buckets, list(h.counts), h.sum, h.count]
+                          for (name, labels), h in self.histograms.items()]
+        return {'counters': counters, 'histograms': histograms}
+
+    def dump(self):
+        """Writes a snapshot of this process' metrics to the metrics directory."""
+        d = ensure_dir(self.directory)
+        f = os.path.join(d, '{0}-{1}.json'.format(HOSTNAME, os.getpid()))
+        tmp = f + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(tmp, f)
+
+    def _snapshots(self):
+        """Yields the snapshots of all live processes on this host, removing
+        the files of its processes that have exited. The files of other hosts
+        are left alone.
+        """
+        yield self.snapshot()
+        d = self.directory
+        if not os.path.isdir(d):
+            return
+        pid = os.getpid()
+        for de in os.scandir(d):
+            if not de.name.endswith('.json'):
+                continue
+            host, _, base = de.name[:-5].rpartition('-')
+            if host != HOSTNAME or not base.isdigit() or int(base) == pid:
+                continue
+            try:
+                os.kill(int(base), 0)
+            except ProcessLookupError:
+                os.remove(de.path)
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(de.path) as fh:
+                    yield json.load(fh)
+            except (FileNotFoundError, ValueError):
+                continue
+
+    def collect(self):
+        """Returns the counters and histograms merged across all live processes,
+        as two dicts keyed by (name, labels) tuples.
+        """
+        counters = {}
+        histograms = {}
+        for snap in self._snapshots():
+            for name, labels, value in snap['counters']:
+                key = _key(name, labels)
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, buckets, counts, sum, count in snap['histograms']:
+                key = _key(name, labels)
+                h = histograms.get(key, None)
+                if h is None:
+                    h = histograms[key] = Histogram(buckets)
+                h.merge(counts, sum, count)
+        return counters, histograms
+
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    s = ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                 for k, v in labels)
+    return '{' + s + '}'
+
+
+def render(counters, histograms):
+    """Renders counters and histograms in the Prometheus text format."""
+    lines = []
+    typed = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append('# TYPE ' + name + ' counter')
+            typed.add(name)
+        lines.append(name + _format_labels(labels) + ' ' + repr(value))
+    for (name, labels), h in sorted(histograms.items(), key=lambda x: x[0]):
+        if name not in typed:
+            lines.append('# TYPE ' + name + ' histogram')
+            typed.add(name)
+        cumulative = 0
+        for bound, c in zip(h.buckets + (float('inf'),), h.counts):
+            cumulative += c
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(name + '_bucket' + _format_labels(labels, [('le', le)]) +
+                         ' ' + str(cumulative))
+        lines.append(name + '_sum' + _format_labels(labels) + ' ' + repr(h.sum))
+        lines.append(name + '_count' + _format_labels(labels) + ' ' + str(h.count))
+    return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def timed(name, **labels):
+    """A decorator that records the time spent in a function (in seconds)
+    in a histogram.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with METRICS.time(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serves the metrics of all fixie processes in the Prometheus text format."""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(render(*METRICS.collect()))
@@ -0,0 +1,264 @@
+"""Tools for removing databases that have outlived $FIXIE_HOLDING_TIME.
+
+Databases are recorded in a line-oriented JSON expiry index ($FIXIE_EXPIRY_FILE)
+when they are created. The reaper keeps the index in memory as a heap ordered
+by creation time, and only reads lines that have been appended since its last
+check, so the sims and paths directories are never rescanned. The index is
+only ever rewritten by atomically replacing it (see ``rewrite_index()``), and
+readers start over when its inode changes. When it runs on
+the IOLoop, each check runs on an executor thread, since removing databases may
+take a long time.
+"""
+import os
+import time
+import heapq
+import shutil
+import functools
+import itertools
+
+import tornado.ioloop
+
+from fixie.environ import ENV, ensure_parent_dir
+from fixie.logger import LOGGER, ERROR
+from fixie.tools import flock, remove_job_aliases
+import fixie.jsonutils as json
+
+
+def register_expiry(paths, jobid=None, created=None, timeout=None, sleepfor=0.1,
+                    raise_errors=True):
+    """Registers one or more files or directories in the expiry index, so that
+    they are removed once they are older than $FIXIE_HOLDING_TIME. If a jobid
+    is given, its aliases are removed along with the paths. Returns whether the
+    registration was successful or not.
+    """
+    return register_expiries([(paths, jobid)], created=created, timeout=timeout,
+                             sleepfor=sleepfor, raise_errors=raise_errors)
+
+
+def register_expiries(expiries, created=None, timeout=None, sleepfor=0.1,
+                      raise_errors=True):
+    """Registers many (paths, jobid) pairs in the expiry index with a single
+    write, see ``register_expiry()``. Returns whether the registration was
+    successful or not.
+    """
+    f = ENV['FIXIE_EXPIRY_FILE']
+    created = time.time() if created is None else created
+    entries = []
+    for paths, jobid in expiries:
+        paths = [paths] if isinstance(paths, str) else list(paths)
+        entry = {'created': created, 'paths': paths}
+        if jobid is not None:
+            entry['jobid'] = jobid
+        entries.append(entry)
+    with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
+        if lockfd == 0:
+            return False
+        with open(ensure_parent_dir(f), 'a') as fh:
+            for entry in entries:
+                json.appendline(entry, fh)
+    return True
+
+
+def rewrite_index(entries):
+    """Atomically replaces the contents of the expiry index with entries, so
+    that readers never see a partial index. Returns the inode and size of the
+    new index. This must be called while holding the index lock.
+    """
+    f = ENV['FIXIE_EXPIRY_FILE']
+    tmp = f + '.' + str(os.getpid()) + '.tmp'
+    with open(ensure_parent_dir(tmp), 'w') as fh:
+        for entry in entries:
+            json.appendline(entry, fh)
+        size = fh.tell()
+    os.replace(tmp, f)
+    return os.stat(f).st_ino, size
+
+
+def index_tree(dirs):
+    """Creates expiry index entries for all of the files that currently exist
+    in a collection of directories. File modification times are used as the
+    creation times, and files whose base name is an integer are assumed to
+    belong to that jobid. This is only needed to seed a new index.
+    """
+    entries = []
+    stack = [d for d in dirs if os.path.isdir(d)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for de in it:
+                if de.is_dir(follow_symlinks=False):
+                    stack.append(de.path)
+                    continue
+                entry = {'created': de.stat(follow_symlinks=False).st_mtime,
+                         'paths': [de.path]}
+                base = de.name.split('.', 1)[0]
+                if base.isdigit():
+                    entry['jobid'] = int(base)
+                entries.append(entry)
+    return entries
+
+
+def _remove_path(path):
+    """Removes a file or directory, returning the number of bytes freed."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return 0
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return 0
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    return st.st_size
+
+
+class Reaper:
+    """Periodically removes databases (and their job aliases) whose age exceeds
+    $FIXIE_HOLDING_TIME. At most $FIXIE_REAPER_BATCH_SIZE databases are removed
+    every $FIXIE_REAPER_INTERVAL seconds. A check is skipped if the previous
+    one is still running, or if the index lock is not obtained within an
+    interval.
+    """
+
+    def __init__(self, batch_size=None, interval=None, seed=True):
+        """
+        Parameters
+        ----------
+        batch_size : int or None, optional
+            Maximum number of index entries removed per check, if None,
+            defaults to $FIXIE_REAPER_BATCH_SIZE.
+        interval : float or None, optional
+            Number of seconds between checks, if None, defaults to
+            $FIXIE_REAPER_INTERVAL.
+        seed : bool, optional
+            Whether to seed the expiry index from the contents of $FIXIE_SIMS_DIR
+            and $FIXIE_PATHS_DIR if the index does not yet exist.
+        """
+        self._batch_size = batch_size
+        self._interval = interval
+        self.seed = seed
+        self.heap = []
+        self.offset = 0
+        self._inode = None
+        self.callback = None
+        self.running = None
+        self._counter = itertools.count()
+
+    @property
+    def batch_size(self):
+        value = self._batch_size
+        if value is None:
+            value = ENV['FIXIE_REAPER_BATCH_SIZE']
+        return value
+
+    @property
+    def interval(self):
+        value = self._interval
+        if value is None:
+            value = ENV['FIXIE_REAPER_INTERVAL']
+        return value
+
+    def _push(self, entry):
+        heapq.heappush(self.heap, (entry['created'], next(self._counter), entry))
+
+    def update(self):
+        """Reads entries that have been appended to the expiry index since the
+        last update. This must be called while holding the index lock.
+        """
+        f = ENV['FIXIE_EXPIRY_FILE']
+        if not os.path.isfile(f):
+            if not self.seed:
+                return
+            rewrite_index(index_tree([ENV['FIXIE_SIMS_DIR'], ENV['FIXIE_PATHS_DIR']]))
+        st = os.stat(f)
+        if st.st_ino != self._inode or st.st_size < self.offset:
+            # the index was rewritten by someone else, start over.
+            self.heap.clear()
+            self.offset = 0
+            self._inode = st.st_ino
+        with open(f) as fh:
+            fh.seek(self.offset)
+            for line in fh:
+                if line.strip():
+                    self._push(json.loads(line))
+            self.offset = fh.tell()
+
+    def _compact(self):
+        """Rewrites the expiry index with the entries that remain in the heap.
+        This must be called while holding the index lock, just after update().
+        """
+        self._inode, self.offset = rewrite_index(entry for _, _, entry in sorted(self.heap))
+
+    def reap(self, now=None, timeout=None, sleepfor=0.1, raise_errors=False):
+        """Removes up to batch_size expired databases, prunes their jobids from
+        the job alias cache, and logs a summary. Returns the list of removed
+        index entries.
+        """
+        now = time.time() if now is None else now
+        holding_time = ENV['FIXIE_HOLDING_TIME']
+        f = ENV['FIXIE_EXPIRY_FILE']
+        expired = []
+        with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
+            if lockfd == 0:
+                return expired
+            self.update()
+            heap = self.heap
+            batch_size = self.batch_size
+            while heap and len(expired) < batch_size and heap[0][0] + holding_time <= now:
+                expired.append(heapq.heappop(heap)[2])
+            if expired:
+                self._compact()
+        if not expired:
+            return expired
+        # remove the databases outside of the lock
+        nfiles = nbytes = 0
+        jobids = set()
+        for entry in expired:
+            for path in entry['paths']:
+                nbytes += _remove_path(path)
+                nfiles += 1
+            if 'jobid' in entry:
+                jobids.add(entry['jobid'])
+        if jobids:
+            remove_job_aliases(jobids, timeout=timeout, sleepfor=sleepfor,
+                               raise_errors=raise_errors)
+        data = {'entries': len(expired), 'paths': nfiles, 'bytes': nbytes,
+                'jobids': jobids, 'remaining': len(heap)}
+        LOGGER.log('reaped {0} expired databases', category='reaper', data=data,
+                   args=(len(expired),))
+        return expired
+
+    def reap_in_executor(self):
+        """Starts a reap on the IOLoop's executor, unless the previous one is
+        still running. Returns the future of the reap, or None if it was
+        skipped.
+        """
+        if self.running is not None and not self.running.done():
+            return None
+        loop = tornado.ioloop.IOLoop.current()
+        self.running = loop.run_in_executor(None, functools.partial(
+            self.reap, timeout=self.interval))
+        self.running.add_done_callback(self._reaped)
+        return self.running
+
+    def _reaped(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        LOGGER.log('reaping failed: {0!r}', category='reaper', level=ERROR,
+                   args=(future.exception(),))
+
+    def start(self):
+        """Starts reaping periodically, on executor threads of the IOLoop."""
+        if self.callback is not None:
+            return
+        self.callback = tornado.ioloop.PeriodicCallback(self.reap_in_executor,
+                                                        self.interval * 1000)
+        self.callback.start()
+
+    def stop(self):
+        """Stops periodic reaping."""
+        if self.callback is None:
+            return
+        self.callback.stop()
+        self.callback = None
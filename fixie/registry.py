@@ -0,0 +1,407 @@
+"""A persistent registry of fixie jobs, with indexed queries.
+
+Each job has a record with its jobid, user, project, name, pid, state,
+timestamps, and output path. Changes to records are appended to a
+line-oriented JSON file ($FIXIE_REGISTRY_FILE) under its lock, so every change
+is atomic and visible to all processes. Each process keeps the records in
+memory, indexed by user, state, and submission and finish times, and only
+reads the lines that were appended since it last looked. The indexes may be
+read from any thread. Once the file holds more than twice as many lines as
+there are jobs (and at least COMPACT_LINES lines), it is compacted to one line
+per job.
+
+Job states are 'submitted', 'running', 'exited', and 'failed'. Jobs that are
+launched with ``detached_call(..., jobid=...)`` move to 'running' when they
+start and to 'exited' when their process exits, at which point their
+supervisor also records their 'returncode' and resource 'usage'. The
+transitions of job status events are queued and written by a background
+thread, so that the IOLoop that publishes them never waits for the lock.
+"""
+import os
+import time
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fixie.environ import ENV
+from fixie.logger import LOGGER, ERROR
+from fixie.tools import flock
+from fixie.jobstatus import JOB_EVENTS
+import fixie.jsonutils as json
+
+
+STATES = frozenset(['submitted', 'running', 'exited', 'failed'])
+TIME_FIELDS = ('submitted', 'finished')
+FIELDS = frozenset(['jobid', 'user', 'project', 'name', 'pid', 'state', 'submitted',
+                    'started', 'finished', 'path', 'returncode', 'usage'])
+SUMMARY_KEYS = ('user', 'project')
+COMPACT_LINES = 1000
+
+
+class JobRegistry:
+    """The registry of jobs, as seen by this process."""
+
+    def __init__(self, filename=None):
+        """
+        Parameters
+        ----------
+        filename : str or None, optional
+            Path to the registry file, if None, defaults to $FIXIE_REGISTRY_FILE.
+        """
+        self._filename = filename
+        # guards the in-memory indexes, which are only changed while also
+        # holding the registry lock
+        self._lock = threading.RLock()
+        self._events = []
+        self._events_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix='fixie-registry')
+        self.clear()
+
+    @property
+    def filename(self):
+        value = self._filename
+        if value is None:
+            value = ENV['FIXIE_REGISTRY_FILE']
+        return value
+
+    @filename.setter
+    def filename(self, value):
+        self._filename = value
+        self.clear()
+
+    def clear(self):
+        """Forgets the in-memory records, so that they are reread."""
+        with self._lock:
+            self.jobs = {}
+            self.by_user = {}
+            self.by_state = {}
+            self.times = {field: [] for field in TIME_FIELDS}
+            self._inode = None
+            self.offset = 0
+            self.lines = 0
+
+    #
+    # in-memory indexes
+    #
+
+    def _apply(self, change):
+        jobid = change['jobid']
+        job = self.jobs.get(jobid, None)
+        if job is None:
+            job = self.jobs[jobid] = {'jobid': jobid}
+        for key, index in (('user', self.by_user), ('state', self.by_state)):
+            if key in change and job.get(key) != change[key]:
+                if key in job:
+                    index[job[key]].discard(jobid)
+                index.setdefault(change[key], set()).add(jobid)
+        for field in TIME_FIELDS:
+            if field in change and job.get(field) != change[field]:
+                times = self.times[field]
+                if job.get(field) is not None:
+                    i = bisect.bisect_left(times, (job[field], jobid))
+                    if i < len(times) and times[i] == (job[field], jobid):
+                        del times[i]
+                if change[field] is not None:
+                    bisect.insort(times, (change[field], jobid))
+        job.update(change)
+
+    def update(self):
+        """Reads the changes that were appended to the registry file since the
+        last update. This should be called while holding the registry lock.
+        """
+        f = self.filename
+        try:
+            st = os.stat(f)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if st.st_ino != self._inode or st.st_size < self.offset:
+                # the registry was compacted, start over.
+                self.clear()
+                self._inode = st.st_ino
+            if st.st_size == self.offset:
+                return
+            with open(f) as fh:
+                fh.seek(self.offset)
+                for line in fh:
+                    if line.strip():
+                        self._apply(json.loads(line))
+                        self.lines += 1
+                self.offset = fh.tell()
+
+    def _append(self, changes):
+        with self._lock:
+            with open(self.filename, 'a') as fh:
+                for change in changes:
+                    json.appendline(change, fh)
+                self.offset = fh.tell()
+                self._inode = os.fstat(fh.fileno()).st_ino
+            for change in changes:
+                self._apply(change)
+            self.lines += len(changes)
+            if self.lines >= COMPACT_LINES and self.lines > 2 * len(self.jobs):
+                self._compact()
+
+    #
+    # changes
+    #
+
+    def add(self, jobid, user='', name='', project='', path='', state='submitted',
+            timeout=None, sleepfor=0.1, raise_errors=True, **kwargs):
+        """Adds a job to the registry. Returns whether the job was added."""
+        job = dict(kwargs, jobid=jobid, user=user, name=name, project=project,
+                   path=path, state=state)
+        return self.add_many([job], timeout=timeout, sleepfor=sleepfor,
+                             raise_errors=raise_errors)
+
+    def add_many(self, jobs, timeout=None, sleepfor=0.1, raise_errors=True):
+        """Adds many jobs (dicts with at least a 'jobid') to the registry with a
+        single write. Returns whether the jobs were added.
+        """
+        now = time.time()
+        changes = []
+        for job in jobs:
+            change = {k: v for k, v in job.items() if k in FIELDS}
+            change.setdefault('state', 'submitted')
+            change.setdefault('submitted', now)
+            changes.append(change)
+        f = self.filename
+        with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
+            if lockfd == 0:
+                return False
+            self.update()
+            self._append(changes)
+        return True
+
+    def transition(self, jobid, state, expected=None, timeout=None, sleepfor=0.1,
+                   raise_errors=True, **fields):
+        """Atomically moves a job to a new state, updating any other fields that
+        are given. If expected is a collection of states, the job only moves if
+        it is currently in one of them. Unknown jobs are added. Returns whether
+        the transition happened.
+        """
+        n = self.transition_many([(jobid, state, expected, fields)], timeout=timeout,
+                                 sleepfor=sleepfor, raise_errors=raise_errors)
+        return n == 1
+
+    def transition_many(self, transitions, timeout=None, sleepfor=0.1,
+                        raise_errors=True):
+        """Atomically applies many (jobid, state, expected, fields) transitions,
+        as with ``transition()``, with a single write. Returns the number of
+        transitions that happened.
+        """
+        changes = []
+        for jobid, state, expected, fields in transitions:
+            if state not in STATES:
+                raise ValueError('job state must be one of {0}, got {1!r}'.format(
+                                 sorted(STATES), state))
+            change = {k: v for k, v in fields.items() if k in FIELDS}
+            change['jobid'] = jobid
+            change['state'] = state
+            changes.append((change, expected))
+        f = self.filename
+        with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
+            if lockfd == 0:
+                return 0
+            self.update()
+            moved = []
+            # later transitions of the same job see the states of earlier ones
+            states = {}
+            for change, expected in changes:
+                jobid = change['jobid']
+                if jobid not in states and jobid in self.jobs:
+                    states[jobid] = self.jobs[jobid].get('state')
+                if jobid not in states:
+                    change.setdefault('submitted', time.time())
+                elif expected is not None and states[jobid] not in expected:
+                    continue
+                states[jobid] = change['state']
+                moved.append(change)
+            if moved:
+                self._append(moved)
+        return len(moved)
+
+    def _compact(self):
+        f = self.filename
+        with self._lock:
+            tmp = f + '.tmp'
+            with open(tmp, 'w') as fh:
+                for jobid in sorted(self.jobs):
+                    json.appendline(self.jobs[jobid], fh)
+                offset = fh.tell()
+            os.replace(tmp, f)
+            self._inode = os.stat(f).st_ino
+            self.offset = offset
+            self.lines = len(self.jobs)
+
+    def compact(self, timeout=None, sleepfor=0.1, raise_errors=True):
+        """Rewrites the registry file with one line per job. This happens
+        automatically as the file grows.
+        """
+        f = self.filename
+        with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
+            if lockfd == 0:
+                return False
+            self.update()
+            self._compact()
+        return True
+
+    #
+    # queries
+    #
+
+    def get(self, jobid):
+        """Returns the record of a job, or None."""
+        with flock(self.filename, timeout=None):
+            self.update()
+        with self._lock:
+            job = self.jobs.get(jobid, None)
+            return None if job is None else dict(job)
+
+    def query(self, user=None, state=None, since=None, until=None, by='submitted',
+              offset=0, limit=100, newest=True):
+        """Returns a page of job records, filtered by user, state, and time.
+
+        Parameters
+        ----------
+        user : str or None, optional
+            Only return the jobs of this user.
+        state : str or None, optional
+            Only return jobs in this state.
+        since, until : float or None, optional
+            Only return jobs whose time is in [since, until).
+        by : str, optional
+            The time to filter and order by, 'submitted' or 'finished'.
+        offset, limit : int, optional
+            The page of results to return.
+        newest : bool, optional
+            Whether the newest jobs come first.
+        """
+        if by not in TIME_FIELDS:
+            raise ValueError('by must be one of {0}, got {1!r}'.format(TIME_FIELDS, by))
+        with flock(self.filename, timeout=None):
+            self.update()
+        with self._lock:
+            times = self.times[by]
+            lo = 0 if since is None else bisect.bisect_left(times, (since,))
+            hi = len(times) if until is None else bisect.bisect_left(times, (until,))
+            sets = []
+            if user is not None:
+                sets.append(self.by_user.get(user, set()))
+            if state is not None:
+                sets.append(self.by_state.get(state, set()))
+            if sets and min(map(len, sets)) < hi - lo:
+                # sorting the (smaller) filtered jobs is cheaper than scanning the times
+                candidates = set.intersection(*sets)
+                jobs = self.jobs
+                keyed = []
+                for jobid in candidates:
+                    t = jobs[jobid].get(by)
+                    if t is None or (since is not None and t < since) or \
+                            (until is not None and t >= until):
+                        continue
+                    keyed.append((t, jobid))
+                keyed.sort(reverse=newest)
+                jobids = [jobid for _, jobid in keyed[offset:offset + limit]]
+            else:
+                rng = range(hi - 1, lo - 1, -1) if newest else range(lo, hi)
+                jobids = []
+                skipped = 0
+                for i in rng:
+                    jobid = times[i][1]
+                    if any(jobid not in s for s in sets):
+                        continue
+                    if skipped < offset:
+                        skipped += 1
+                        continue
+                    jobids.append(jobid)
+                    if len(jobids) >= limit:
+                        break
+            return [dict(self.jobs[jobid]) for jobid in jobids]
+
+    def usage_summary(self, by='user', since=None, until=None):
+        """Returns summary statistics of the resource usage of the jobs that
+        finished in [since, until), grouped by user or project. Each group has
+        the number of 'jobs', the number that 'failed' (i.e. exited with a
+        nonzero code), the total and mean 'cpu_time' and 'wall_time', the
+        largest 'max_rss' and the 'mean_max_rss', and the total 'read_blocks' and
+        'write_blocks'. Jobs without recorded usage are left out.
+        """
+        if by not in SUMMARY_KEYS:
+            raise ValueError('by must be one of {0}, got {1!r}'.format(SUMMARY_KEYS, by))
+        with flock(self.filename, timeout=None):
+            self.update()
+        with self._lock:
+            times = self.times['finished']
+            lo = 0 if since is None else bisect.bisect_left(times, (since,))
+            hi = len(times) if until is None else bisect.bisect_left(times, (until,))
+            summary = {}
+            for _, jobid in times[lo:hi]:
+                job = self.jobs[jobid]
+                usage = job.get('usage', None)
+                if usage is None:
+                    continue
+                s = summary.get(job.get(by, ''), None)
+                if s is None:
+                    s = summary[job.get(by, '')] = {
+                        'jobs': 0, 'failed': 0, 'cpu_time': 0.0, 'wall_time': 0.0,
+                        'max_rss': 0, 'mean_max_rss': 0.0, 'read_blocks': 0,
+                        'write_blocks': 0}
+                s['jobs'] += 1
+                s['failed'] += usage['returncode'] != 0
+                s['cpu_time'] += usage['cpu_time']
+                s['wall_time'] += usage['wall_time']
+                s['max_rss'] = max(s['max_rss'], usage['max_rss'])
+                s['mean_max_rss'] += usage['max_rss']
+                s['read_blocks'] += usage['read_blocks']
+                s['write_blocks'] += usage['write_blocks']
+        for s in summary.values():
+            n = s['jobs']
+            s['mean_cpu_time'] = s['cpu_time'] / n
+            s['mean_wall_time'] = s['wall_time'] / n
+            s['mean_max_rss'] /= n
+        return summary
+
+    #
+    # job status events
+    #
+
+    def on_event(self, event):
+        """Queues the state transitions of job status events, to be written by
+        the registry's writer thread. The supervisor of a short job may have
+        recorded its exit before these are written.
+        """
+        jobid = event['jobid']
+        if event['state'] == 'running':
+            transition = (jobid, 'running', {'submitted'},
+                          {'pid': event['pid'], 'started': event['time']})
+        elif event['state'] == 'exited':
+            transition = (jobid, 'exited', {'submitted', 'running'},
+                          {'finished': event['time']})
+        else:
+            return
+        with self._events_lock:
+            self._events.append(transition)
+        self._writer.submit(self._write_events)
+
+    def _write_events(self):
+        with self._events_lock:
+            batch, self._events = self._events, []
+        if not batch:
+            return
+        try:
+            self.transition_many(batch, raise_errors=False)
+        except Exception as e:
+            LOGGER.log('could not record {0} job status events: {1!r}',
+                       category='registry', level=ERROR, args=(len(batch), e))
+
+    def flush_events(self, timeout=None):
+        """Waits until the queued transitions of job status events have been
+        written.
+        """
+        self._writer.submit(lambda: None).result(timeout)
+
+
+REGISTRY = JobRegistry()
+JOB_EVENTS.listeners.append(REGISTRY.on_event)
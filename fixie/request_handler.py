@@ -1,10 +1,30 @@
 """A request handler for fixie that expects JSON data and validates it."""
+import os
+import time
+import cProfile
+import itertools
+
 import cerberus
 import tornado.web
 import functools
 from tornado.escape import utf8
 
 import fixie.jsonutils as json
+from fixie.environ import ENV, ensure_dir
+from fixie.logger import LOGGER
+from fixie.metrics import METRICS
+from fixie.admission import ADMISSION, Rejected
+from fixie.sessions import SESSIONS
+from fixie.tracing import (span, start_span, finish_span, TRACE_HEADER,
+    SPAN_HEADER)
+
+
+PROFILE_HEADER = 'X-Fixie-Profile'
+_PROFILE_COUNTER = itertools.count(1)
+# only one request may be profiled at a time. The profiler sees the whole
+# process, so its profile also has the frames of any requests that were
+# interleaved with it on the IOLoop.
+_PROFILE_ACTIVE = False
 
 
 def authenticated(method):
@@ -19,6 +39,8 @@ def authenticated(method):
             self.finish('Unauthorized')
             raise tornado.web.Finish
         return method(self, *args, **kwargs)
+    # lets other decorators, e.g. fixie.cached(), check for the user first
+    wrapper.requires_user = True
     return wrapper
 
 
@@ -30,7 +52,8 @@ class RequestHandler(tornado.web.RequestHandler):
     """
 
     def get_current_user(self):
-        return self.get_secure_cookie('user')
+        with span('auth'):
+            return SESSIONS.user(self)
         # if user is not None:
         #     return user
         # else:
@@ -52,23 +75,162 @@ class RequestHandler(tornado.web.RequestHandler):
             self.__class__._validator = v
         return v
 
-    def prepare(self):
-        self.response = {}
-        body = self.request.body
-        if not body:
+    def _profile_requested(self):
+        """Returns whether this request must be profiled (True), may be profiled
+        and kept if it is slow (None), or is not profiled (False).
+        """
+        if PROFILE_HEADER in self.request.headers:
+            user = self.current_user
+            if user is not None and user.decode('utf-8') in ENV.get('FIXIE_ADMINS', ()):
+                return True
+        every = ENV.get('FIXIE_PROFILE_EVERY', 0)
+        if every > 0 and next(_PROFILE_COUNTER) % every == 0:
+            return True
+        if ENV.get('FIXIE_PROFILE_THRESHOLD', 0.0) > 0.0:
+            return None
+        return False
+
+    def start_profile(self):
+        """Starts profiling this request, if it was selected for profiling via
+        $FIXIE_PROFILE_EVERY, $FIXIE_PROFILE_THRESHOLD, or an admin's
+        X-Fixie-Profile header. The profile is process-wide, so it also counts
+        the work of other requests that run while this one is waiting.
+        """
+        global _PROFILE_ACTIVE
+        self._profile = None
+        if _PROFILE_ACTIVE:
+            return
+        requested = self._profile_requested()
+        if requested is False:
             return
+        self._profile_forced = requested
+        self._profile = cProfile.Profile()
+        _PROFILE_ACTIVE = True
+        self._profile.enable()
+
+    def stop_profile(self):
+        """Stops profiling this request, so that another may be profiled.
+        Returns the profile, or None if this request was not profiled.
+        """
+        global _PROFILE_ACTIVE
+        prof = getattr(self, '_profile', None)
+        if prof is None:
+            return None
         try:
-            data = json.decode(body)
-        except ValueError:
-            self.send_error(400, message='Unable to parse JSON.')
+            prof.disable()
+        finally:
+            self._profile = None
+            _PROFILE_ACTIVE = False
+        return prof
+
+    def finish_profile(self):
+        """Stops profiling this request, and writes the profile to
+        $FIXIE_PROFILE_DIR if it was requested or the request was slow.
+        """
+        prof = self.stop_profile()
+        if prof is None:
             return
-        if not self.validator.validate(data):
-            msg = 'Input to ' + self.__class__.__name__ + ' is not valid: '
-            msg += str(self.validator.errors)
-            self.send_error(400, message=msg)
+        duration = self.request.request_time()
+        if not self._profile_forced and duration < ENV['FIXIE_PROFILE_THRESHOLD']:
             return
-        self.request.arguments.clear()
-        self.request.arguments.update(data)
+        name = self.__class__.__name__
+        d = ensure_dir(ENV['FIXIE_PROFILE_DIR'])
+        filename = os.path.join(d, '{0}-{1:.6f}-{2}.pstats'.format(name, time.time(),
+                                                                    os.getpid()))
+        prof.dump_stats(filename)
+        data = {'handler': name, 'uri': self.request.uri, 'status': self.get_status(),
+                'duration': duration, 'filename': filename}
+        LOGGER.log('profiled {0} in {1:.6f} s', category='profile', data=data,
+                   args=(name, duration))
+
+    def _admission_key(self):
+        """Returns the key that the request rate is limited by, which is the
+        verified user if there is one, and otherwise the remote address.
+        """
+        if self.settings.get('cookie_secret', None):
+            user = self.current_user
+            if user is not None:
+                return user
+        return self.request.remote_ip
+
+    def admit(self):
+        """Admits this request under the server's admission control limits,
+        or rejects it. Returns whether the request was admitted.
+        """
+        self._admitted = False
+        key = self._admission_key() if ENV.get('FIXIE_RATE_LIMIT', 0.0) > 0.0 else None
+        try:
+            ADMISSION.admit(key, len(self.request.body))
+        except Rejected as e:
+            self.send_error(e.status, message=e.message, retry_after=e.retry_after)
+            return False
+        self._admitted = True
+        return True
+
+    def start_trace(self):
+        """Starts the tracing span for this request, continuing the trace
+        from the X-Fixie-Trace and X-Fixie-Span headers, if present.
+        """
+        headers = self.request.headers
+        self._trace_span = start_span('request', trace=headers.get(TRACE_HEADER, None),
+                                      parent=headers.get(SPAN_HEADER, None),
+                                      handler=self.__class__.__name__,
+                                      uri=self.request.uri)
+        self._body_span = None
+
+    def finish_trace(self):
+        """Finishes the tracing spans for this request."""
+        finish_span(getattr(self, '_body_span', None))
+        finish_span(getattr(self, '_trace_span', None))
+
+    def prepare(self):
+        # reject before doing any work on the body
+        if not self.admit():
+            return
+        self.start_trace()
+        self.start_profile()
+        self.response = {}
+        # requests dispatched in process (see fixie.dispatch) carry an object
+        data = getattr(self.request, 'local_object', None)
+        body = self.request.body
+        if data is None and body:
+            try:
+                with span('parse'):
+                    data = json.decode(body)
+            except ValueError:
+                self.send_error(400, message='Unable to parse JSON.')
+                return
+        if data is not None:
+            with span('validate'):
+                valid = self.validator.validate(data)
+            if not valid:
+                msg = 'Input to ' + self.__class__.__name__ + ' is not valid: '
+                msg += str(self.validator.errors)
+                self.send_error(400, message=msg)
+                return
+            self.request.arguments.clear()
+            self.request.arguments.update(data)
+        self._body_span = start_span('handler')
+
+    def on_finish(self):
+        if getattr(self, '_admitted', False):
+            ADMISSION.release()
+            self._admitted = False
+        self.finish_profile()
+        self.finish_trace()
+        name = self.__class__.__name__
+        status = self.get_status()
+        METRICS.inc('fixie_requests_total', handler=name, code=status)
+        METRICS.observe('fixie_request_duration_seconds', self.request.request_time(),
+                        handler=name, code=status)
+
+    def on_connection_close(self):
+        # on_finish() only runs once the handler returns, which may be much
+        # later for a long-poll or a slow coroutine. Until then, the
+        # process-wide profiler would keep profiling, and no other request
+        # could be profiled. The profile of an abandoned request is dropped.
+        self.stop_profile()
+        super().on_connection_close()
 
     def set_default_headers(self):
         self.set_header('Content-Type', 'application/json')
@@ -86,12 +248,19 @@ class RequestHandler(tornado.web.RequestHandler):
                 message += ". Lists not accepted for security reasons; see http://www.tornadoweb.org/en/stable/web.html#tornado.web.RequestHandler.write"
             raise TypeError(message)
         if isinstance(chunk, dict):
+            if hasattr(self.request, 'local_response'):
+                # dispatched in process, so the object is returned as is
+                self.request.local_response = chunk
+                return
             chunk = json.encode(chunk) + '\n'
             self.set_header("Content-Type", "application/json; charset=UTF-8")
         chunk = utf8(chunk)
         self._write_buffer.append(chunk)
 
     def write_error(self, status_code, **kwargs):
+        retry_after = kwargs.pop('retry_after', None)
+        if retry_after is not None:
+            self.set_header('Retry-After', str(retry_after))
         if 'message' not in kwargs:
             if status_code == 405:
                 kwargs['message'] = 'Invalid HTTP method.'
@@ -0,0 +1,274 @@
+"""An in-process cache of responses from idempotent fixie request handlers.
+
+Handler methods opt in with the ``cached()`` decorator. Responses are keyed by
+the handler class, the verified user, and the canonical (sorted key) JSON
+encoding of the request arguments, and expire after a time-to-live. Entries may also be labeled with
+tags, such as ``'job:42'``, so that they can be invalidated explicitly when the
+state that they depend on changes. Every cached response carries an ETag, so
+clients that send a matching If-None-Match header get a 304 with no body.
+
+The cache lives in each server process, and invalidations are not shared
+between processes, so the time-to-live bounds how stale a response may be.
+Within a process, entries may be invalidated from any thread, e.g. by alias
+changes that run on executor threads. A response whose tags are invalidated
+while it is being made is not cached, since it may already be stale.
+"""
+import time
+import hashlib
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+
+from fixie.environ import ENV
+from fixie.metrics import METRICS
+import fixie.jsonutils as json
+
+
+class CachedResponse:
+    """A cached response body and the headers needed to replay it."""
+
+    __slots__ = ('body', 'etag', 'content_type', 'expires', 'tags')
+
+    def __init__(self, body, content_type, expires, tags):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.content_type = content_type
+        self.expires = expires
+        self.tags = tags
+
+
+class TagWatch:
+    """Records whether any of a set of tags is invalidated, from when it is
+    made by ``ResponseCache.watch()`` until it is passed to ``put()`` or
+    ``unwatch()``.
+    """
+
+    __slots__ = ('tags', 'changed')
+
+    def __init__(self, tags):
+        self.tags = frozenset(tags)
+        self.changed = False
+
+
+class ResponseCache:
+    """A bounded, least-recently-used cache of responses with expiry and tags."""
+
+    def __init__(self, size=None):
+        """
+        Parameters
+        ----------
+        size : int or None, optional
+            Maximum number of entries, if None, defaults to
+            $FIXIE_RESPONSE_CACHE_SIZE.
+        """
+        self._size = size
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.watches = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        value = self._size
+        if value is None:
+            value = ENV.get('FIXIE_RESPONSE_CACHE_SIZE', 1024)
+        return value
+
+    @size.setter
+    def size(self, value):
+        self._size = value
+
+    def get(self, key, now=None):
+        """Returns the unexpired entry for a key, or None."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires <= now:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def watch(self, tags):
+        """Starts watching tags for invalidations, returning a TagWatch."""
+        watch = TagWatch(tags)
+        with self._lock:
+            for tag in watch.tags:
+                self.watches.setdefault(tag, set()).add(watch)
+        return watch
+
+    def _unwatch(self, watch):
+        for tag in watch.tags:
+            watches = self.watches.get(tag, None)
+            if watches is None:
+                continue
+            watches.discard(watch)
+            if not watches:
+                del self.watches[tag]
+
+    def unwatch(self, watch):
+        """Stops watching the tags of a TagWatch, if it is still watched."""
+        with self._lock:
+            self._unwatch(watch)
+
+    def put(self, key, body, content_type=None, ttl=None, tags=(), now=None, watch=None):
+        """Adds a response body to the cache, returning its entry. If a TagWatch
+        from watch() is given, it is stopped, and the entry is only added if none
+        of its tags have been invalidated since it was made.
+        """
+        ttl = ENV.get('FIXIE_RESPONSE_CACHE_TIME', 10.0) if ttl is None else ttl
+        now = time.monotonic() if now is None else now
+        entry = CachedResponse(body, content_type, now + ttl, frozenset(tags))
+        size = self.size
+        with self._lock:
+            if watch is not None:
+                self._unwatch(watch)
+                if watch.changed:
+                    return entry
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            for tag in entry.tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > size:
+                self._remove(next(iter(self.entries)))
+        return entry
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        for tag in entry.tags:
+            keys = self.tags.get(tag, None)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self.tags[tag]
+
+    def invalidate(self, *tags):
+        """Removes all entries that are labeled with any of the tags. Returns
+        the number of entries removed.
+        """
+        n = 0
+        with self._lock:
+            for tag in tags:
+                for watch in self.watches.get(tag, ()):
+                    watch.changed = True
+                for key in list(self.tags.get(tag, ())):
+                    self._remove(key)
+                    n += 1
+        return n
+
+    def clear(self):
+        """Removes all entries."""
+        with self._lock:
+            for watches in self.watches.values():
+                for watch in watches:
+                    watch.changed = True
+            self.entries.clear()
+            self.tags.clear()
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+def response_key(handler):
+    """Returns the cache key for a request to a handler, which includes the
+    verified user, if any, so that users never see each other's responses.
+    """
+    request = handler.request
+    if request.body or getattr(request, 'local_object', None) is not None:
+        args = json.dumps(request.arguments)
+    else:
+        args = request.query
+    user = handler.current_user if handler.settings.get('cookie_secret', None) else None
+    return (type(handler).__qualname__, request.method, request.path, user, args)
+
+
+def _format_tags(tags, handler):
+    if callable(tags):
+        return tags(handler)
+    args = handler.request.arguments
+    rtn = []
+    for tag in tags:
+        try:
+            rtn.append(tag.format(**args))
+        except (KeyError, IndexError):
+            # the tag refers to an optional argument that was not given
+            continue
+    return rtn
+
+
+def cached(ttl=None, tags=()):
+    """A decorator for RequestHandler methods whose responses only depend on
+    the request arguments, and so may be cached.
+
+    Parameters
+    ----------
+    ttl : float or None, optional
+        Number of seconds that responses are cached for, if None, defaults to
+        $FIXIE_RESPONSE_CACHE_TIME.
+    tags : sequence of str or callable, optional
+        Invalidation tags for the responses. Strings are formatted with the
+        request arguments, e.g. ``'job:{jobid}'``. Alternatively, a function
+        that takes the handler and returns a list of tags. Tags that refer to
+        arguments that are missing from a request are left out.
+
+    Methods that are decorated with ``authenticated()`` (in either order) are
+    called, and so reject the request, before the cache is looked up for
+    users who are not logged in. Responses are not cached if any of their tags
+    are invalidated while the method runs.
+    """
+    def decorator(method):
+        requires_user = getattr(method, 'requires_user', False)
+
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            key = response_key(self)
+            if requires_user and not self.current_user:
+                entry = None
+            else:
+                entry = RESPONSE_CACHE.get(key)
+            if entry is None:
+                entry_tags = _format_tags(tags, self)
+                watch = RESPONSE_CACHE.watch(entry_tags)
+                try:
+                    rtn = method(self, *args, **kwargs)
+                    if inspect.isawaitable(rtn):
+                        rtn = await rtn
+                except BaseException:
+                    RESPONSE_CACHE.unwatch(watch)
+                    raise
+                if self._finished or self.get_status() != 200:
+                    RESPONSE_CACHE.unwatch(watch)
+                    return rtn
+                local = getattr(self.request, 'local_response', None)
+                if local is None:
+                    body = b''.join(self._write_buffer)
+                else:
+                    # dispatched in process, the response was not encoded
+                    body = (json.encode(local) + '\n').encode('utf-8')
+                    self.set_header('Content-Type', 'application/json; charset=UTF-8')
+                entry = RESPONSE_CACHE.put(key, body,
+                                           content_type=self._headers.get('Content-Type'),
+                                           ttl=ttl, tags=entry_tags, watch=watch)
+                METRICS.inc('fixie_response_cache_total', result='miss')
+            else:
+                self._write_buffer = [entry.body]
+                if entry.content_type is not None:
+                    self.set_header('Content-Type', entry.content_type)
+                METRICS.inc('fixie_response_cache_total', result='hit')
+            self.set_header('Etag', entry.etag)
+            if self.check_etag_header():
+                self._write_buffer = []
+                self.set_status(304)
+                METRICS.inc('fixie_response_cache_total', result='not_modified')
+        return wrapper
+    return decorator
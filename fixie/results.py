@@ -0,0 +1,236 @@
+"""Content-addressed cache of simulation results, so that jobs with identical
+inputs can reuse an existing database rather than rerunning the simulation.
+
+Entries are small JSON files stored in $FIXIE_RESULTS_DIR and named by the
+SHA-256 hash of the canonical (sorted key) JSON encoding of the input.
+Expired entries are evicted when they are looked up, and periodically by the
+server, on executor threads of the IOLoop.
+"""
+import os
+import time
+import shutil
+import hashlib
+
+import tornado.ioloop
+
+from fixie.environ import ENV, ensure_parent_dir
+from fixie.logger import LOGGER, ERROR
+from fixie.metrics import METRICS
+from fixie.tools import register_job_alias
+from fixie.reaper import register_expiry
+import fixie.jsonutils as json
+
+
+def input_hash(obj):
+    """Returns the hex digest of the canonical JSON encoding of an input object.
+    Inputs that are equal as Python objects always have the same hash.
+    """
+    s = json.dumps(obj)
+    return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+
+def link_path(src, dst):
+    """Links dst to the existing file src, using a hard link if possible and
+    falling back to a copy (e.g. across filesystems). Either way, dst stays
+    valid when src is removed, so the two may expire independently.
+    """
+    ensure_parent_dir(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # copy atomically, so that readers never see a partial database
+        tmp = dst + '.' + str(os.getpid()) + '.tmp'
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+
+class ResultCache:
+    """A cache that maps simulation inputs to the databases that they produced.
+    Entries expire after $FIXIE_RESULT_CACHE_TIME seconds, or when their
+    database no longer exists. Hit and miss counts are kept for this process,
+    and are exported as the fixie_result_cache_total metric.
+    """
+
+    def __init__(self, directory=None):
+        """
+        Parameters
+        ----------
+        directory : str or None, optional
+            Path to the cache directory, if None, defaults to $FIXIE_RESULTS_DIR.
+        """
+        self._directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.callback = None
+        self.running = None
+
+    @property
+    def directory(self):
+        value = self._directory
+        if value is None:
+            value = ENV['FIXIE_RESULTS_DIR']
+        return value
+
+    @directory.setter
+    def directory(self, value):
+        self._directory = value
+
+    def entry_filename(self, h):
+        """Returns the filename of the entry for a hash."""
+        return os.path.join(self.directory, h[:2], h + '.json')
+
+    def _expired(self, entry, now):
+        if entry['created'] + ENV['FIXIE_RESULT_CACHE_TIME'] <= now:
+            return True
+        return not os.path.exists(entry['path'])
+
+    def _evict(self, filename):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            return
+        self.evictions += 1
+        METRICS.inc('fixie_result_cache_evictions_total')
+
+    def _count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        METRICS.inc('fixie_result_cache_total', result='hit' if hit else 'miss')
+
+    def _lookup(self, f, now):
+        """Returns the valid entry in the file f, or None, without counting."""
+        try:
+            with open(f) as fh:
+                entry = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+        if self._expired(entry, now):
+            self._evict(f)
+            return None
+        return entry
+
+    def get(self, obj, now=None):
+        """Returns the cache entry for an input object, or None if there is no
+        valid entry. Entries are dicts with 'path', 'jobid', and 'created' keys.
+        Expired entries are evicted.
+        """
+        now = time.time() if now is None else now
+        entry = self._lookup(self.entry_filename(input_hash(obj)), now)
+        self._count(entry is not None)
+        return entry
+
+    def put(self, obj, path, jobid, created=None):
+        """Records that the database at path, which was made by jobid, is the
+        result of an input object. Returns the input hash.
+        """
+        h = input_hash(obj)
+        entry = {'path': os.path.abspath(path), 'jobid': jobid,
+                 'created': time.time() if created is None else created}
+        f = ensure_parent_dir(self.entry_filename(h))
+        # write atomically, so that readers never see a partial entry
+        tmp = f + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(entry, fh)
+        os.replace(tmp, f)
+        return h
+
+    def satisfy(self, obj, path, jobid, user, name='', project='', **kwargs):
+        """Attempts to satisfy a new job from the cache, without rerunning it.
+        On a hit, the existing database is linked to path, the new jobid is
+        registered with the job alias cache and the expiry index, and the cache
+        entry is returned. On a miss, None is returned and the caller should run
+        the job (and then put() the result). Extra keyword arguments are passed
+        to register_job_alias().
+        """
+        f = self.entry_filename(input_hash(obj))
+        entry = self._lookup(f, time.time())
+        if entry is not None:
+            try:
+                link_path(entry['path'], path)
+            except FileNotFoundError:
+                # the database was reaped after it was looked up
+                self._evict(f)
+                entry = None
+        self._count(entry is not None)
+        if entry is None:
+            return None
+        register_job_alias(jobid, user, name=name, project=project, **kwargs)
+        register_expiry(path, jobid=jobid)
+        return entry
+
+    def evict(self, now=None):
+        """Removes all expired entries from the cache directory, returning the
+        number of entries removed.
+        """
+        now = time.time() if now is None else now
+        n = 0
+        d = self.directory
+        if not os.path.isdir(d):
+            return n
+        for sub in os.scandir(d):
+            if not sub.is_dir():
+                continue
+            for de in os.scandir(sub.path):
+                if not de.name.endswith('.json'):
+                    continue
+                try:
+                    with open(de.path) as fh:
+                        entry = json.load(fh)
+                except (FileNotFoundError, ValueError):
+                    continue
+                if self._expired(entry, now):
+                    self._evict(de.path)
+                    n += 1
+        return n
+
+    def stats(self):
+        """Returns a dict of the hits, misses, evictions, and hit rate for
+        this process.
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0}
+
+    def evict_in_executor(self):
+        """Starts an eviction on the IOLoop's executor, unless the previous one
+        is still running. Returns the future of the eviction, or None if it
+        was skipped.
+        """
+        if self.running is not None and not self.running.done():
+            return None
+        loop = tornado.ioloop.IOLoop.current()
+        self.running = loop.run_in_executor(None, self.evict)
+        self.running.add_done_callback(self._evicted)
+        return self.running
+
+    def _evicted(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        LOGGER.log('result cache eviction failed: {0!r}', category='results',
+                   level=ERROR, args=(future.exception(),))
+
+    def start(self, interval=None):
+        """Starts evicting expired entries periodically, every interval
+        seconds, on executor threads of the IOLoop. The interval defaults to
+        $FIXIE_REAPER_INTERVAL.
+        """
+        if self.callback is not None:
+            return
+        interval = ENV['FIXIE_REAPER_INTERVAL'] if interval is None else interval
+        self.callback = tornado.ioloop.PeriodicCallback(self.evict_in_executor,
+                                                        interval * 1000)
+        self.callback.start()
+
+    def stop(self):
+        """Stops periodic eviction."""
+        if self.callback is None:
+            return
+        self.callback.stop()
+        self.callback = None
+
+
+RESULT_CACHE = ResultCache()
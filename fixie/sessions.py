@@ -0,0 +1,92 @@
+"""A cache of verified session cookies.
+
+Verifying a signed cookie means an HMAC computation, base64 decoding, and
+timestamp parsing. Since clients send the same cookie with every request, the
+user of each verified cookie is cached by the raw cookie value, until the
+cookie expires after $FIXIE_COOKIE_MAX_AGE_DAYS. Invalid cookies are never
+cached.
+"""
+import time
+from collections import OrderedDict
+
+from fixie.environ import ENV
+from fixie.metrics import METRICS
+
+
+def cookie_timestamp(value):
+    """Returns the time at which a signed cookie value was signed."""
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    parts = value.split(b'|')
+    if parts[0] == b'2':
+        # version 2 fields are length prefixed, e.g. b'10:1500000000'
+        ts = parts[2].partition(b':')[2]
+    else:
+        ts = parts[1]
+    return float(ts)
+
+
+class SessionCache:
+    """A bounded, least-recently-used cache of users by raw cookie value."""
+
+    def __init__(self, size=None):
+        """
+        Parameters
+        ----------
+        size : int or None, optional
+            Maximum number of sessions, if None, defaults to
+            $FIXIE_SESSION_CACHE_SIZE.
+        """
+        self._size = size
+        self.sessions = OrderedDict()
+
+    @property
+    def size(self):
+        value = self._size
+        if value is None:
+            value = ENV.get('FIXIE_SESSION_CACHE_SIZE', 10000)
+        return value
+
+    @size.setter
+    def size(self, value):
+        self._size = value
+
+    def user(self, handler, name='user'):
+        """Returns the user in the signed cookie of a request handler, or None
+        if there is no valid cookie.
+        """
+        raw = handler.get_cookie(name)
+        if raw is None:
+            return None
+        key = (name, raw)
+        now = time.time()
+        entry = self.sessions.get(key, None)
+        if entry is not None:
+            user, expires = entry
+            if expires > now:
+                self.sessions.move_to_end(key)
+                METRICS.inc('fixie_session_cache_total', result='hit')
+                return user
+            del self.sessions[key]
+        METRICS.inc('fixie_session_cache_total', result='miss')
+        max_age_days = ENV.get('FIXIE_COOKIE_MAX_AGE_DAYS', 31.0)
+        user = handler.get_secure_cookie(name, value=raw, max_age_days=max_age_days)
+        if user is None:
+            return None
+        expires = cookie_timestamp(raw) + max_age_days * 86400
+        self.sessions[key] = (user, expires)
+        size = self.size
+        while len(self.sessions) > size:
+            self.sessions.popitem(last=False)
+        return user
+
+    def discard(self, raw, name='user'):
+        """Removes a raw cookie value from the cache, e.g. on logout."""
+        self.sessions.pop((name, raw), None)
+
+    def clear(self):
+        """Removes all sessions."""
+        self.sessions.clear()
+
+
+SESSIONS = SessionCache()
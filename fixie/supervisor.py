@@ -0,0 +1,349 @@
+"""A thin supervisor that accounts for the resources that jobs use.
+
+Each process launched by ``detached_call()`` is the child of a small
+supervisor process, rather than being reparented to init. The supervisors
+are forked by a supervisor server, a separate single-threaded interpreter
+that runs this module, rather than by the server itself::
+
+    $ python -m fixie.supervisor CTRL_FD
+
+The server is started once per process, by ``LAUNCHER``, and reads jobs from
+the Unix socket CTRL_FD until it is closed. Each job is sent as the file
+descriptors of its standard streams and of a reply socket. The server forks a
+supervisor for the job, which reads the JSON job spec, with the 'args',
+'env', 'jobid', Popen 'kwargs' of the job, and the fixie 'environ' of the
+caller, from the reply socket. The supervisor starts the job, replies with its
+PID (or the error that kept it from starting), and then waits for the job
+with ``wait4()``. It records the job's exit code, wall time, CPU time, maximum
+resident set size, and block I/O as a 'usage' log entry and, for jobs with a
+jobid, in the job registry. If $FIXIE_CGROUP_DIR is set to a (delegated)
+cgroup v2 directory, each job also runs in its own cgroup below it, whose
+CPU, memory, and I/O statistics include all of the job's descendants. Errors
+in the supervisors go to the standard error of the supervisor server, which
+is that of the process that started it.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import threading
+import traceback
+import subprocess
+
+from fixie.environ import ENV, ENVVARS, context, detyped_env
+from fixie.logger import LOGGER
+import fixie.jsonutils as json
+
+
+# ru_maxrss is in kilobytes, except on macOS
+MAXRSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+
+def rusage_stats(rusage):
+    """Returns a dict of the statistics of a resource.struct_rusage."""
+    return {'user_time': rusage.ru_utime, 'system_time': rusage.ru_stime,
+            'cpu_time': rusage.ru_utime + rusage.ru_stime,
+            'max_rss': rusage.ru_maxrss * MAXRSS_SCALE,
+            'read_blocks': rusage.ru_inblock, 'write_blocks': rusage.ru_oublock,
+            'major_faults': rusage.ru_majflt,
+            'voluntary_switches': rusage.ru_nvcsw,
+            'involuntary_switches': rusage.ru_nivcsw}
+
+
+def _read_keyed(filename):
+    """Reads a cgroup file of 'key value' lines into a dict of ints."""
+    rtn = {}
+    with open(filename) as f:
+        for line in f:
+            key, _, value = line.partition(' ')
+            if value.strip().isdigit():
+                rtn[key] = int(value)
+    return rtn
+
+
+def cgroup_stats(path):
+    """Returns a dict of the statistics of a cgroup v2 directory, with the
+    statistics that are unavailable left out.
+    """
+    stats = {}
+    try:
+        cpu = _read_keyed(os.path.join(path, 'cpu.stat'))
+        stats['cpu_time'] = cpu['usage_usec'] / 1e6
+    except (OSError, KeyError):
+        pass
+    try:
+        with open(os.path.join(path, 'memory.peak')) as f:
+            stats['memory_peak'] = int(f.read())
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(path, 'io.stat')) as f:
+            lines = f.read().split('\n')
+    except OSError:
+        lines = None
+    if lines is not None:
+        rbytes = wbytes = 0
+        for line in lines:
+            for field in line.split()[1:]:
+                key, _, value = field.partition('=')
+                if key == 'rbytes':
+                    rbytes += int(value)
+                elif key == 'wbytes':
+                    wbytes += int(value)
+        stats['read_bytes'] = rbytes
+        stats['write_bytes'] = wbytes
+    return stats
+
+
+def _make_cgroup(jobid):
+    """Makes the cgroup of a job, returning its path, or None if cgroups are
+    not configured or the cgroup cannot be made.
+    """
+    root = ENV.get('FIXIE_CGROUP_DIR', '')
+    if not root:
+        return None
+    name = 'fixie-' + (str(os.getpid()) if jobid is None else str(jobid))
+    path = os.path.join(root, name)
+    try:
+        os.mkdir(path)
+    except FileExistsError:
+        pass
+    except OSError:
+        return None
+    return path
+
+
+def _enter_cgroup(path):
+    def enter():
+        with open(os.path.join(path, 'cgroup.procs'), 'w') as f:
+            f.write('0')
+    return enter
+
+
+def record_usage(jobid, usage):
+    """Records the resource usage of a job in the job registry, if it has a
+    jobid, and in the log.
+    """
+    if jobid is not None:
+        from fixie.registry import REGISTRY
+        REGISTRY.transition(jobid, 'exited', finished=usage['finished'],
+                            returncode=usage['returncode'], usage=usage,
+                            raise_errors=False)
+    LOGGER.log('job {0} exited with {1} after {2:.3f} s', category='usage',
+               data=dict(usage, jobid=jobid),
+               args=(jobid, usage['returncode'], usage['wall_time']))
+
+
+def _reply(fd, **kwargs):
+    os.write(fd, json.encode(kwargs).encode('utf-8'))
+    os.close(fd)
+
+
+def supervise(args, replyfd, jobid=None, **kwargs):
+    """Runs a job as a child of the current process, and records its resource
+    usage when it exits. The job's PID, or the error that kept it from
+    starting, is written as JSON to the file descriptor replyfd, which is then
+    closed. kwargs are passed through to Popen, and integer stdin, stdout, and
+    stderr file descriptors are closed once the job has started. This never
+    returns.
+    """
+    try:
+        cgroup = _make_cgroup(jobid)
+        if cgroup is not None:
+            kwargs['preexec_fn'] = _enter_cgroup(cgroup)
+        t0 = time.time()
+        try:
+            proc = subprocess.Popen(args, **kwargs)
+        except Exception as e:
+            _reply(replyfd, error='{0}: {1}'.format(e.__class__.__name__, e))
+            return
+        pid = proc.pid
+        _reply(replyfd, pid=pid)
+        # don't hold the job's streams open
+        for key in ('stdin', 'stdout', 'stderr'):
+            if isinstance(kwargs.get(key, None), int) and kwargs[key] > 2:
+                os.close(kwargs[key])
+        _, status, rusage = os.wait4(pid, 0)
+        t1 = time.time()
+        usage = {'returncode': os.waitstatus_to_exitcode(status), 'pid': pid,
+                 'started': t0, 'finished': t1, 'wall_time': t1 - t0}
+        usage.update(rusage_stats(rusage))
+        if cgroup is not None:
+            usage['cgroup'] = cgroup_stats(cgroup)
+            try:
+                os.rmdir(cgroup)
+            except OSError:
+                pass
+        record_usage(jobid, usage)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(0)
+
+
+def _read_all(fd):
+    chunks = []
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def _run_job(replyfd, stdin, stdout, stderr):
+    """Reads a job spec from replyfd and supervises the job, in a freshly
+    forked supervisor. This never returns.
+    """
+    try:
+        spec = json.decode(_read_all(replyfd).decode('utf-8'))
+        # the job's usage is recorded under the caller's fixie environment
+        environ = spec['environ']
+        for name in ENVVARS:
+            if name in environ:
+                ENV[name] = environ[name]
+            elif name in ENV._d:
+                del ENV[name]
+        supervise(spec['args'], replyfd, jobid=spec['jobid'], env=spec['env'],
+                  stdin=stdin, stdout=stdout, stderr=stderr, **spec['kwargs'])
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(0)
+
+
+def serve(ctrl):
+    """Forks a supervisor for each job that is sent over the control socket,
+    until the socket is closed. Jobs are sent as the file descriptors of a
+    reply socket and of the job's stdin, stdout, and stderr.
+    """
+    # the supervisors are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        msg, fds, _, _ = socket.recv_fds(ctrl, 16, 4)
+        if not msg:
+            break
+        if len(fds) != 4:
+            for fd in fds:
+                os.close(fd)
+            continue
+        try:
+            pid = os.fork()
+        except OSError:
+            traceback.print_exc()
+            pid = -1
+        if pid == 0:
+            ctrl.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            # each job has its own session, as if it were started on its own
+            os.setsid()
+            _run_job(*fds)
+        for fd in fds:
+            os.close(fd)
+
+
+class Launcher:
+    """Launches jobs through a supervisor server, which is started when it is
+    first needed and restarted if it exits. This may be used from any thread,
+    and never forks the current process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._proc = None
+        self._ctrl = None
+        self._pid = None
+
+    def start(self):
+        """Starts the supervisor server, if it is not already running, and
+        returns its control socket.
+        """
+        with self._lock:
+            if (self._proc is not None and self._pid == os.getpid() and
+                    self._proc.poll() is None):
+                return self._ctrl
+            self._close()
+            ctrl, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            try:
+                # errors go to our stderr, where they can be seen
+                self._proc = subprocess.Popen([sys.executable, '-m', 'fixie.supervisor',
+                                               str(theirs.fileno())],
+                                              stdin=subprocess.DEVNULL,
+                                              stdout=subprocess.DEVNULL,
+                                              env=detyped_env(),
+                                              pass_fds=(theirs.fileno(),),
+                                              start_new_session=True)
+            except BaseException:
+                ctrl.close()
+                raise
+            finally:
+                theirs.close()
+            self._ctrl = ctrl
+            self._pid = os.getpid()
+            return ctrl
+
+    def _close(self):
+        if self._ctrl is not None:
+            self._ctrl.close()
+            self._ctrl = None
+        proc, self._proc = self._proc, None
+        if proc is not None and self._pid == os.getpid():
+            # the server exits once its control socket is closed
+            try:
+                proc.wait(timeout=5.0)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+    def stop(self):
+        """Stops the supervisor server. The supervisors of running jobs are
+        not affected.
+        """
+        with self._lock:
+            self._close()
+
+    def launch(self, spec, stdin, stdout, stderr):
+        """Launches a job, given its JSON spec and the file descriptors of its
+        standard streams, and returns its PID. Raises a RuntimeError if the job
+        could not be started.
+        """
+        ctrl = self.start()
+        ours, theirs = socket.socketpair()
+        try:
+            try:
+                socket.send_fds(ctrl, [b'job'], [theirs.fileno(), stdin, stdout, stderr])
+            finally:
+                theirs.close()
+            ours.sendall(spec.encode('utf-8'))
+            ours.shutdown(socket.SHUT_WR)
+            reply = _read_all(ours.fileno())
+        except OSError:
+            reply = b''
+        finally:
+            ours.close()
+        reply = json.decode(reply.decode('utf-8')) if reply else {}
+        if 'pid' not in reply:
+            raise RuntimeError(reply.get('error', 'the supervisor failed, see the '
+                                                  'standard error of the server'))
+        return reply['pid']
+
+
+LAUNCHER = Launcher()
+
+
+def main(args=None):
+    """Runs a supervisor server, see the module docstring."""
+    args = sys.argv[1:] if args is None else args
+    ctrl = socket.socket(fileno=int(args[0]))
+    # the fixie variables are passed in the environment
+    values = {name: os.environ[name] for name in ENVVARS if name in os.environ}
+    with context():
+        for name, value in values.items():
+            ENV[name] = value
+        # import before forking, rather than once per job
+        import fixie.registry
+        serve(ctrl)
+
+
+if __name__ == '__main__':
+    main()
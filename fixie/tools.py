@@ -2,9 +2,10 @@
 import os
 import time
 import errno
-import subprocess
-import multiprocessing
 import base64
+import asyncio
+import functools
+import threading
 from contextlib import contextmanager
 from pathlib import Path
 
@@ -13,8 +14,14 @@ import tornado.ioloop
 from tornado.httpclient import AsyncHTTPClient
 from lazyasd import lazyobject
 
-from fixie.environ import ENV
-from fixie.logger import LOGGER
+from fixie.environ import ENV, detyped_env, fixie_detype_env, ensure_parent_dir
+from fixie.logger import LOGGER, WARNING
+from fixie.metrics import METRICS, timed
+from fixie.tracing import span, trace_headers
+from fixie.response_cache import RESPONSE_CACHE
+from fixie.jobidset import JobidSet
+from fixie.dispatch import APPLICATIONS, find_route, dispatch
+import fixie.unix as unix
 import fixie.jsonutils as json
 
 
@@ -22,22 +29,113 @@ import fixie.jsonutils as json
 def fetch(url, obj):
     """Asynrochously fetches a fixie URL, using the standard fixie interface
     (POST method, fixie JSON utilties). This fetch functions accepts a Python
-    object, rather than a string for its body.
+    object, rather than a string for its body. If the URL is served by a fixie
+    request handler in this process (see ``fixie.dispatch``), the handler is
+    called with the object directly, skipping serialization and the network.
+    URLs may also be unix:// URLs of Unix domain sockets (see ``fixie.unix``).
     """
-    body = json.encode(obj)
-    http_client = AsyncHTTPClient()
-    response = yield http_client.fetch(url, method='POST', body=body)
-    assert response.code == 200
-    rtn = json.decode(response.body)
+    t0 = time.perf_counter()
+    route = find_route(url) if APPLICATIONS else None
+    with span('fetch', url=url):
+        if route is None:
+            body = json.encode(obj)
+            if url.startswith('unix:'):
+                http_client = unix.client()
+                target = unix.http_url(url)
+            else:
+                http_client = AsyncHTTPClient()
+                target = url
+            response = yield http_client.fetch(target, method='POST', body=body,
+                                               headers=trace_headers())
+        else:
+            rtn = yield dispatch(route, obj)
+    METRICS.observe('fixie_fetch_seconds', time.perf_counter() - t0)
+    if route is None:
+        assert response.code == 200
+        rtn = json.decode(response.body)
     return rtn
 
 
+# the pid and IOLoop of the thread that runs synchronous fetches
+_FETCH_LOOP = [None, None]
+_FETCH_LOOP_LOCK = threading.Lock()
+
+
+def _fetch_loop():
+    pid, loop = _FETCH_LOOP
+    if pid == os.getpid():
+        return loop
+    with _FETCH_LOOP_LOCK:
+        if _FETCH_LOOP[0] == os.getpid():
+            return _FETCH_LOOP[1]
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            _FETCH_LOOP[1] = tornado.ioloop.IOLoop.current()
+            started.set()
+            _FETCH_LOOP[1].start()
+
+        threading.Thread(target=run, name='fixie-fetch', daemon=True).start()
+        started.wait()
+        _FETCH_LOOP[0] = os.getpid()
+        return _FETCH_LOOP[1]
+
+
+def fetch_sync(url, obj, timeout=None):
+    """Synchronously fetches a fixie URL, like ``fetch()``, waiting at most
+    timeout seconds for the response. The request runs on a separate thread,
+    so this may be called from any thread, including one that is running an
+    IOLoop.
+    """
+    async def call():
+        return await fetch(url, obj)
+    loop = _fetch_loop()
+    future = asyncio.run_coroutine_threadsafe(call(), loop.asyncio_loop)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
 @lazyobject
 def CREDS_CACHE():
     from fixie_creds.cache import CACHE
     return CACHE
 
 
+@lazyobject
+def COORDINATOR():
+    from fixie.coordinator import COORDINATOR
+    return COORDINATOR
+
+
+@lazyobject
+def LEASES():
+    from fixie.coordinator import LEASES
+    return LEASES
+
+
+@lazyobject
+def JOURNAL():
+    from fixie.journal import JOURNAL
+    return JOURNAL
+
+
+@lazyobject
+def JOB_EVENTS():
+    from fixie.jobstatus import JOB_EVENTS
+    return JOB_EVENTS
+
+
+@lazyobject
+def LAUNCHER():
+    # not imported with the package, so that it can run as __main__
+    from fixie.supervisor import LAUNCHER
+    return LAUNCHER
+
+
 def verify_user_local(user, token):
     """Verifies a user via the local (in process) credetialling service."""
     return CREDS_CACHE.verify(user, token)
@@ -57,49 +155,139 @@ def verify_user(user, token, url=None):
     """
     url = ENV.get('FIXIE_CREDS_URL', '') if url is None else url
     if url:
-        return verify_user(user, token, url)
+        METRICS.inc('fixie_verify_user_total', source='remote')
+        return verify_user_remote(user, token, url)
     else:
+        METRICS.inc('fixie_verify_user_total', source='local')
         return verify_user_local(user, token)
 
 
+def coordinator_url():
+    """Returns the base URL of the coordinator that this process uses, or an
+    empty string if it manages jobids, aliases, and locks through the
+    filesystem, as the coordinator itself does.
+    """
+    if ENV.get('FIXIE_COORDINATOR', False):
+        return ''
+    return ENV.get('FIXIE_COORDINATOR_URL', '')
+
+
+def in_data_dir(filename):
+    """Returns whether a file resolves to a path below $FIXIE_DATA_DIR."""
+    d = os.path.realpath(ENV['FIXIE_DATA_DIR'])
+    f = os.path.realpath(filename)
+    return f != d and os.path.commonpath([d, f]) == d
+
+
+def _acquire_lease(filename, timeout, sleepfor, raise_errors):
+    t0 = time.time()
+    while True:
+        try:
+            token = COORDINATOR.acquire(filename, timeout=timeout)
+        except Exception:
+            if raise_errors:
+                raise
+            return 0
+        if token != 0:
+            return token
+        elif timeout is not None and (time.time() - t0) >= timeout:
+            if raise_errors:
+                raise TimeoutError("lease on " + filename + " could not be obtained in time.")
+            return 0
+        time.sleep(sleepfor)
+
+
 @contextmanager
 def flock(filename, timeout=None, sleepfor=0.1, raise_errors=True):
     """A context manager for locking a file via the filesystem.
     This yeilds the file descriptor of the lockfile.
     If raise_errors is False and an exception would have been raised,
     a file descriptor of zero is yielded instead.
+    If $FIXIE_COORDINATOR_URL is set and the file is in the (shared)
+    $FIXIE_DATA_DIR, the lock is a lease from the coordinator instead, and the
+    (nonzero) token of the lease is yielded.
     """
     fd = 0
-    lockfile = filename + '.lock'
     t0 = time.time()
-    while True:
+    if coordinator_url() and in_data_dir(filename):
+        with span('lock', file=filename, lease=True):
+            token = _acquire_lease(filename, timeout, sleepfor, raise_errors)
+        METRICS.observe('fixie_flock_wait_seconds', time.time() - t0)
         try:
-            fd = os.open(lockfile, os.O_CREAT|os.O_EXCL|os.O_RDWR)
-            break
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                if raise_errors:
-                    raise
-                else:
-                    break
-            elif (time.time() - t0) >= timeout:
-                if raise_errors:
-                    raise TimeoutError(lockfile + " could not be obtained in time.")
-                else:
-                    break
-            time.sleep(sleepfor)
-    yield fd
-    if fd == 0:
+            yield token
+        finally:
+            if token != 0 and not COORDINATOR.release(token):
+                LOGGER.log('lease on {0} expired before it was released',
+                           category='coordinator', level=WARNING, args=(filename,))
         return
-    os.close(fd)
-    os.unlink(lockfile)
+    serving = ENV.get('FIXIE_COORDINATOR', False)
+    lockfile = ensure_parent_dir(filename + '.lock')
+    with span('lock', file=filename):
+        while True:
+            try:
+                fd = os.open(lockfile, os.O_CREAT|os.O_EXCL|os.O_RDWR)
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    if raise_errors:
+                        raise
+                    else:
+                        break
+                elif timeout is not None and (time.time() - t0) >= timeout:
+                    if raise_errors:
+                        raise TimeoutError(lockfile + " could not be obtained in time.")
+                    else:
+                        break
+                if serving:
+                    # the lock may be held by a lease that has expired, but
+                    # that is only released on the next lease request
+                    LEASES.expire()
+                time.sleep(sleepfor)
+    METRICS.observe('fixie_flock_wait_seconds', time.time() - t0)
+    try:
+        yield fd
+    finally:
+        if fd != 0:
+            os.close(fd)
+            os.unlink(lockfile)
 
 
+def _remote(method, *args, timeout=None, raise_errors=True, default=None, **kwargs):
+    """Calls a coordinator method, returning the default on failure if
+    raise_errors is False.
+    """
+    try:
+        return method(*args, timeout=timeout, **kwargs)
+    except Exception:
+        if raise_errors:
+            raise
+        return default
+
+
+@timed('fixie_next_jobid_seconds')
 def next_jobid(timeout=None, sleepfor=0.1, raise_errors=True):
     """Obtains the next jobid from the $FIXIE_JOBID_FILE and increments the
     value in $FIXIE_JOBID_FILE. A None value means that the jobid could not
     be obtained in time.
     """
+    jobids = next_jobids(1, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors)
+    return None if jobids is None else jobids[0]
+
+
+@timed('fixie_next_jobids_seconds')
+def next_jobids(n, timeout=None, sleepfor=0.1, raise_errors=True):
+    """Obtains the next n jobids from the $FIXIE_JOBID_FILE in a single locked
+    operation, and increments the value in $FIXIE_JOBID_FILE by n. Returns a
+    range of the jobids, or None if they could not be obtained in time.
+    If $FIXIE_COORDINATOR_URL is set, the jobids are allocated by the
+    coordinator. If $FIXIE_JOURNAL is enabled, the allocation is committed to
+    the journal, and the locking parameters are ignored.
+    """
+    if coordinator_url():
+        return _remote(COORDINATOR.next_jobids, n, timeout=timeout,
+                       raise_errors=raise_errors)
+    if ENV.get('FIXIE_JOURNAL', False):
+        return JOURNAL.commit(('jobids', n))
     f = ENV['FIXIE_JOBID_FILE']
     with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
         if lockfd == 0:
@@ -110,18 +298,41 @@ def next_jobid(timeout=None, sleepfor=0.1, raise_errors=True):
             curr = int(curr.strip() or 0)
         else:
             curr = 0
-        inc = str(curr + 1)
+        inc = str(curr + n)
         with open(f, 'w') as fh:
             fh.write(inc)
-    return curr
+    return range(curr, curr + n)
 
 
+@timed('fixie_alias_seconds', op='register')
 def register_job_alias(jobid, user, name='', project='', timeout=None, sleepfor=0.1,
                       raise_errors=True):
     """Registers a job id, user, name, and project in the global jobs alias cache.
     Returns whether the registration was successful or not.
     """
+    return register_job_aliases([(jobid, user, name, project)], timeout=timeout,
+                                sleepfor=sleepfor, raise_errors=raise_errors)
+
+
+@timed('fixie_alias_seconds', op='register_many')
+def register_job_aliases(aliases, timeout=None, sleepfor=0.1, raise_errors=True):
+    """Registers many (jobid, user, name, project) tuples in the global jobs
+    alias cache, with a single write. Returns whether the registration was
+    successful or not.
+    """
+    if coordinator_url() or ENV.get('FIXIE_JOURNAL', False):
+        aliases = list(aliases)
+        if coordinator_url():
+            if not _remote(COORDINATOR.register_job_aliases, aliases, timeout=timeout,
+                           raise_errors=raise_errors, default=False):
+                return False
+        else:
+            JOURNAL.commit(('alias', aliases))
+        RESPONSE_CACHE.invalidate(*{'job:' + str(a[0]) for a in aliases},
+                                  *{'user:' + a[1] for a in aliases})
+        return True
     f = ENV['FIXIE_JOB_ALIASES_FILE']
+    tags = set()
     with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
         if lockfd == 0:
             return False
@@ -135,108 +346,260 @@ def register_job_alias(jobid, user, name='', project='', timeout=None, sleepfor=
                 cache = {}
         else:
             cache = {}
-        # add the entry as approriate
-        if user not in cache:
-            cache[user] = {}
-        u = cache[user]
-        if project not in u:
-            u[project] = {}
-        p = u[project]
-        if name not in p:
-            p[name] = set()
-        p[name].add(jobid)
+        # add the entries as approriate
+        for jobid, user, name, project in aliases:
+            if user not in cache:
+                cache[user] = {}
+            u = cache[user]
+            if project not in u:
+                u[project] = {}
+            p = u[project]
+            j = p.get(name, None)
+            if not isinstance(j, JobidSet):
+                p[name] = j = JobidSet(j or ())
+            j.add(jobid)
+            tags.add('job:' + str(jobid))
+            tags.add('user:' + user)
         # write the file back out
         with open(f, 'w') as fh:
             json.dump(cache, fh)
+    RESPONSE_CACHE.invalidate(*tags)
+    return True
+
+
+@timed('fixie_alias_seconds', op='remove')
+def remove_job_aliases(jobids, timeout=None, sleepfor=0.1, raise_errors=True):
+    """Removes a collection of job ids from the global jobs alias cache, dropping
+    any names, projects, and users that no longer have jobs associated with them.
+    Returns whether the removal was successful or not.
+    """
+    jobids = JobidSet(jobids)
+    if coordinator_url() or ENV.get('FIXIE_JOURNAL', False):
+        if coordinator_url():
+            if not _remote(COORDINATOR.remove_job_aliases, jobids, timeout=timeout,
+                           raise_errors=raise_errors, default=False):
+                return False
+        else:
+            JOURNAL.commit(('unalias', jobids))
+        RESPONSE_CACHE.invalidate(*['job:' + str(jobid) for jobid in jobids])
+        return True
+    f = ENV['FIXIE_JOB_ALIASES_FILE']
+    with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
+        if lockfd == 0:
+            return False
+        # obtain the current contents
+        if not os.path.isfile(f):
+            return True
+        with open(f) as fh:
+            s = fh.read()
+        if not s.strip():
+            return True
+        cache = json.loads(s)
+        # remove the entries, pruning empty containers
+        for user, u in list(cache.items()):
+            for project, p in list(u.items()):
+                for name, j in list(p.items()):
+                    j -= jobids
+                    if not j:
+                        del p[name]
+                if not p:
+                    del u[project]
+            if not u:
+                del cache[user]
+        # write the file back out
+        with open(f, 'w') as fh:
+            json.dump(cache, fh)
+    RESPONSE_CACHE.invalidate(*['job:' + str(jobid) for jobid in jobids])
+    return True
+
+
+def _in_executor(func, *args, **kwargs):
+    loop = tornado.ioloop.IOLoop.current()
+    return loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def _journaling():
+    return ENV.get('FIXIE_JOURNAL', False) and not coordinator_url()
+
+
+async def next_jobids_async(n, timeout=None, sleepfor=0.1, raise_errors=True):
+    """A coroutine version of ``next_jobids()``, for use on the IOLoop. If
+    $FIXIE_JOURNAL is enabled, the allocations of concurrent coroutines are
+    committed together. Otherwise, ``next_jobids()`` is run on an executor
+    thread.
+    """
+    if _journaling():
+        return await JOURNAL.commit_async(('jobids', n))
+    return await _in_executor(next_jobids, n, timeout=timeout, sleepfor=sleepfor,
+                              raise_errors=raise_errors)
+
+
+async def register_job_aliases_async(aliases, timeout=None, sleepfor=0.1,
+                                     raise_errors=True):
+    """A coroutine version of ``register_job_aliases()``, for use on the IOLoop,
+    see ``next_jobids_async()``.
+    """
+    aliases = list(aliases)
+    if not _journaling():
+        return await _in_executor(register_job_aliases, aliases, timeout=timeout,
+                                  sleepfor=sleepfor, raise_errors=raise_errors)
+    await JOURNAL.commit_async(('alias', aliases))
+    RESPONSE_CACHE.invalidate(*{'job:' + str(a[0]) for a in aliases},
+                              *{'user:' + a[1] for a in aliases})
     return True
 
 
+async def remove_job_aliases_async(jobids, timeout=None, sleepfor=0.1,
+                                   raise_errors=True):
+    """A coroutine version of ``remove_job_aliases()``, for use on the IOLoop,
+    see ``next_jobids_async()``.
+    """
+    jobids = JobidSet(jobids)
+    if not _journaling():
+        return await _in_executor(remove_job_aliases, jobids, timeout=timeout,
+                                  sleepfor=sleepfor, raise_errors=raise_errors)
+    await JOURNAL.commit_async(('unalias', jobids))
+    RESPONSE_CACHE.invalidate(*['job:' + str(jobid) for jobid in jobids])
+    return True
+
+
+@timed('fixie_alias_seconds', op='from_alias')
 def jobids_from_alias(user, name='', project='', timeout=None, sleepfor=0.1,
                     raise_errors=True):
     """Obtains a set of job ids from user, name, and project informnation.
     This looks up information in the the global jobs alias cache.
-    Returns a set of jobids.
+    Returns a JobidSet of the jobids.
     """
+    if coordinator_url():
+        return _remote(COORDINATOR.jobids_from_alias, user, name=name, project=project,
+                       timeout=timeout, raise_errors=raise_errors, default=JobidSet())
+    if ENV.get('FIXIE_JOURNAL', False):
+        return JOURNAL.jobids_from_alias(user, name=name, project=project)
     f = ENV['FIXIE_JOB_ALIASES_FILE']
     with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
         if lockfd == 0:
-            return set()
+            return JobidSet()
         # obtain the current contents
         if os.path.isfile(f):
             with open(f) as fh:
                 cache = json.load(fh)
         else:
-            return set()
+            return JobidSet()
         # add the entry as approriate
         if user not in cache:
-            return set()
+            return JobidSet()
         u = cache[user]
         if project not in u:
-            return set()
+            return JobidSet()
         p = u[project]
         if name not in p:
-            return set()
-        return p[name]
+            return JobidSet()
+        j = p[name]
+        return j if isinstance(j, JobidSet) else JobidSet(j)
 
 
+@timed('fixie_alias_seconds', op='with_name')
 def jobids_with_name(name, project='', timeout=None, sleepfor=0.1,
                     raise_errors=True):
     """Obtains a set of job ids across all users and projects
     that has a given name.
     This looks up information in the the global jobs alias cache.
-    Returns a set of jobids.
+    Returns a JobidSet of the jobids.
     """
+    if coordinator_url():
+        return _remote(COORDINATOR.jobids_with_name, name, timeout=timeout,
+                       raise_errors=raise_errors, default=JobidSet())
+    if ENV.get('FIXIE_JOURNAL', False):
+        return JOURNAL.jobids_with_name(name)
     f = ENV['FIXIE_JOB_ALIASES_FILE']
     with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
         if lockfd == 0:
-            return set()
+            return JobidSet()
         # obtain the current contents
         if os.path.isfile(f):
             with open(f) as fh:
                 cache = json.load(fh)
         else:
-            return set()
+            return JobidSet()
         # add the entry as approriate
-        jobids = set()
-        for user in cache.values():
-            for project in user.values():
-                j = project.get(name, None)
-                if j is not None:
-                    jobids |= j
+        jobids = JobidSet()
+        jobids.update(*[project[name] for user in cache.values()
+                        for project in user.values() if name in project])
     return jobids
 
 
-def detached_call(args, stdout=None, stderr=None, stdin=None, env=None, **kwargs):
+@timed('fixie_alias_seconds', op='of_user')
+def jobids_of_user(user, timeout=None, sleepfor=0.1, raise_errors=True):
+    """Obtains the set of job ids with any alias of a user, across all of
+    their names and projects. This looks up information in the the global
+    jobs alias cache. Returns a JobidSet of the jobids.
+    """
+    if coordinator_url():
+        return _remote(COORDINATOR.jobids_of_user, user, timeout=timeout,
+                       raise_errors=raise_errors, default=JobidSet())
+    if ENV.get('FIXIE_JOURNAL', False):
+        return JOURNAL.jobids_of_user(user)
+    f = ENV['FIXIE_JOB_ALIASES_FILE']
+    with flock(f, timeout=timeout, sleepfor=sleepfor, raise_errors=raise_errors) as lockfd:
+        if lockfd == 0:
+            return JobidSet()
+        if os.path.isfile(f):
+            with open(f) as fh:
+                cache = json.load(fh)
+        else:
+            return JobidSet()
+        jobids = JobidSet()
+        jobids.update(*[j for project in cache.get(user, {}).values()
+                        for j in project.values()])
+    return jobids
+
+
+def _stream_fd(stream, flags, opened):
+    if stream is None:
+        fd = os.open(os.devnull, flags)
+        opened.append(fd)
+        return fd
+    return stream if isinstance(stream, int) else stream.fileno()
+
+
+def detached_call(args, stdout=None, stderr=None, stdin=None, env=None, jobid=None,
+                  watch=True, **kwargs):
     """Runs a process and detaches it from its parent (i.e. the current process).
     In the parent process, this will return the PID of the child. By default,
-    this will return redirect all streams to os.devnull. Additionally, if an
-    environment is not provided, the current fixie environment is passed in.
-    If close_fds is provided, it must be True.
-    All other kwargs are passed through to Popen.
+    this will return redirect all streams to os.devnull. Streams may be file
+    descriptors or file objects. Additionally, if an environment is not
+    provided, the current fixie environment is passed in. If close_fds is
+    provided, it must be True. The process runs under a supervisor, which
+    records its resource usage when it exits (see ``fixie.supervisor``). If a
+    jobid is given, the usage is also recorded in the job registry, and, if
+    watch is True, the process is watched on the current IOLoop, and its start
+    and exit are published as job status events. All other kwargs are passed
+    through to Popen, and so must be JSON serializable, e.g. cwd. A
+    RuntimeError is raised if the process could not be started.
+
+    This does not fork the current process, and so is safe to call from any
+    thread. The supervisors are forked by a supervisor server, which is
+    started by the first call, so only that call waits for it to start.
 
     Inspired by detach.call(), Copyright (c) 2014 Ryan Bourgeois.
     """
-    env = ENV.detype() if env is None else env
-    stdin = os.open(os.devnull, os.O_RDONLY) if stdin is None else stdin
-    stdout = os.open(os.devnull, os.O_WRONLY) if stdout is None else stdout
-    stderr = os.open(os.devnull, os.O_WRONLY) if stderr is None else stderr
-    if not kwargs.get('close_fds', True):
+    env = detyped_env() if env is None else env
+    if not kwargs.pop('close_fds', True):
         raise RuntimeError('close_fds must be True.')
-    shared_pid = multiprocessing.Value('i', 0)
-    pid = os.fork()
-    if pid == 0:
-        # in child
-        os.setsid()
-        proc = subprocess.Popen(args, stdout=stdout, stderr=stderr, stdin=stdin,
-                                close_fds=True, env=env)
-        shared_pid.value = proc.pid
-        os._exit(0)
-    else:
-        # in parent
-        os.waitpid(pid, 0)
-        child_pid = shared_pid.value
-        del shared_pid
-        return child_pid
+    spec = json.encode({'args': list(args), 'env': env, 'jobid': jobid,
+                        'kwargs': kwargs, 'environ': fixie_detype_env()})
+    opened = []
+    try:
+        stdin = _stream_fd(stdin, os.O_RDONLY, opened)
+        stdout = _stream_fd(stdout, os.O_WRONLY, opened)
+        stderr = _stream_fd(stderr, os.O_WRONLY, opened)
+        child_pid = LAUNCHER.launch(spec, stdin, stdout, stderr)
+    finally:
+        for fd in opened:
+            os.close(fd)
+    if jobid is not None and watch:
+        JOB_EVENTS.watch(jobid, child_pid)
+    return child_pid
 
 
 def waitpid(pid, timeout=None, sleepfor=0.001, raise_errors=True):
@@ -287,16 +650,66 @@ def default_path(path, name='', project='', jobid=-1, ext='.h5'):
     path += ext
     return path
 
+
+# number of random bytes in a cookie secret, and the length of their base64 encoding
+SECRET_BYTES = 50
+SECRET_LENGTH = 4 * ((SECRET_BYTES + 2) // 3)
+_COOKIE_SECRETS = {}
+
+
 def cookie_secret():
-    secret = None
-    p = Path(ENV['FIXIE_COOKIE_SECRET_FILE'])
-    if p.exists():
-        with open(p, 'r') as f:
-            secret = f.read()
-    if secret is None or len(secret) != 50:
-        secret = base64.b64encode(os.urandom(50)).decode('ascii')
-        with open(p, 'w') as f:
+    """Returns the cookie secret from $FIXIE_COOKIE_SECRET_FILE, generating it
+    first if needed. The file is locked while it is checked and written, so that
+    all of the processes that share the file agree on the secret. The secret is
+    only read once per process.
+    """
+    filename = ENV['FIXIE_COOKIE_SECRET_FILE']
+    secret = _COOKIE_SECRETS.get(filename, None)
+    if secret is not None:
+        return secret
+    p = Path(ensure_parent_dir(filename))
+    with flock(filename, timeout=10.0):
+        if p.exists():
+            with open(p, 'r') as f:
+                secret = f.read().strip()
+        if secret is None or len(secret) != SECRET_LENGTH:
+            secret = base64.b64encode(os.urandom(SECRET_BYTES)).decode('ascii')
+            tmp = Path(filename + '.tmp')
+            fd = os.open(tmp, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o600)
+            with open(fd, 'w') as f:
+                f.write(secret)
+            os.replace(tmp, p)
+    _COOKIE_SECRETS[filename] = secret
+    return secret
+
+
+def coordinator_secret():
+    """Returns the secret from $FIXIE_COORDINATOR_SECRET_FILE, which the
+    coordinator and its nodes share, generating it first if needed. The file
+    is created with a link, rather than under a lock, since on a node the
+    lock would be a lease from the coordinator, which needs the secret.
+    """
+    filename = ENV['FIXIE_COORDINATOR_SECRET_FILE']
+    secret = _COOKIE_SECRETS.get(filename, None)
+    if secret is not None:
+        return secret
+    ensure_parent_dir(filename)
+    try:
+        with open(filename, 'r') as f:
+            secret = f.read().strip()
+    except FileNotFoundError:
+        secret = base64.b64encode(os.urandom(SECRET_BYTES)).decode('ascii')
+        tmp = '{0}.{1}.tmp'.format(filename, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o600)
+        with open(fd, 'w') as f:
             f.write(secret)
-        p.chmod(0o600)
-    print('secret:', secret)
-    return secret
\ No newline at end of file
+        try:
+            os.link(tmp, filename)
+        except FileExistsError:
+            # another process made the secret first
+            with open(filename, 'r') as f:
+                secret = f.read().strip()
+        finally:
+            os.unlink(tmp)
+    _COOKIE_SECRETS[filename] = secret
+    return secret
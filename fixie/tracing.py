@@ -0,0 +1,229 @@
+"""Lightweight request tracing for fixie services.
+
+A trace is a tree of timed spans that share a trace id. The trace id and the
+id of the current span are propagated to other fixie services in the
+X-Fixie-Trace and X-Fixie-Span headers by ``fetch()``, and picked up again
+by ``RequestHandler.prepare()``. When $FIXIE_TRACE is enabled, spans are
+appended to $FIXIE_TRACE_FILE as line-oriented JSON records, one batch per
+request. Running ``python -m fixie.tracing`` reconstructs the critical path
+of a trace from these records.
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import contextvars
+from contextlib import contextmanager
+
+from fixie.environ import ENV, context, ensure_parent_dir
+import fixie.jsonutils as json
+
+
+TRACE_HEADER = 'X-Fixie-Trace'
+SPAN_HEADER = 'X-Fixie-Span'
+
+# (trace id, span id) of the span that is currently active, or None
+_CURRENT = contextvars.ContextVar('fixie_trace', default=None)
+# finished span records, by trace id, that are waiting to be written
+_PENDING = {}
+
+
+def tracing_enabled():
+    """Returns whether spans are being recorded."""
+    return ENV.get('FIXIE_TRACE', False)
+
+
+def new_id():
+    """Returns a new random trace or span id."""
+    return uuid.uuid4().hex[:16]
+
+
+def current():
+    """Returns the (trace id, span id) tuple of the current span, or None."""
+    return _CURRENT.get()
+
+
+def trace_headers():
+    """Returns a dict of the headers that propagate the current span to
+    another service.
+    """
+    cur = _CURRENT.get()
+    if cur is None:
+        return {}
+    return {TRACE_HEADER: cur[0], SPAN_HEADER: cur[1]}
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    def __init__(self, name, trace, parent, data):
+        self.name = name
+        self.trace = trace
+        self.span = new_id()
+        self.parent = parent
+        self.data = data
+        self.start = time.time()
+        self.t0 = time.perf_counter()
+        self.duration = None
+        # spans with no parent in this process flush the trace when finished
+        self.local_root = True
+        self.previous = None
+
+    def record(self):
+        """Returns a compact, JSON serializable record of the span."""
+        rec = {'trace': self.trace, 'span': self.span, 'parent': self.parent,
+               'name': self.name, 'start': self.start, 'dur': self.duration,
+               'pid': os.getpid()}
+        if self.data:
+            rec['data'] = self.data
+        return rec
+
+
+def start_span(name, trace=None, parent=None, **data):
+    """Starts a new span and makes it the current span. If trace is None, the
+    span is a child of the current span, or starts a new trace if there is no
+    current span. Returns the Span object, or None if tracing is disabled.
+    """
+    if not tracing_enabled():
+        return None
+    cur = _CURRENT.get()
+    local_root = True
+    if trace is None:
+        if cur is None:
+            trace = new_id()
+        else:
+            trace, parent = cur
+            local_root = False
+    s = Span(name, trace, parent, data)
+    s.local_root = local_root
+    s.previous = cur
+    _CURRENT.set((trace, s.span))
+    return s
+
+
+def finish_span(s):
+    """Finishes a span, restoring the span that was current when it started.
+    When a local root span finishes, all of the spans of its trace in this
+    process are written to $FIXIE_TRACE_FILE.
+    """
+    if s is None or s.duration is not None:
+        return
+    s.duration = time.perf_counter() - s.t0
+    _CURRENT.set(s.previous)
+    _PENDING.setdefault(s.trace, []).append(s.record())
+    if s.local_root:
+        flush(s.trace)
+
+
+@contextmanager
+def span(name, **data):
+    """A context manager that times its body as a span of the current trace."""
+    s = start_span(name, **data)
+    try:
+        yield s
+    finally:
+        finish_span(s)
+
+
+def flush(trace):
+    """Writes the pending records of a trace to $FIXIE_TRACE_FILE."""
+    records = _PENDING.pop(trace, None)
+    if not records:
+        return
+    f = ensure_parent_dir(ENV['FIXIE_TRACE_FILE'])
+    with open(f, 'a') as fh:
+        for rec in records:
+            json.appendline(rec, fh)
+
+
+#
+# Trace analysis
+#
+
+def load_traces(filenames):
+    """Loads span records from trace files, returning a dict mapping trace ids
+    to lists of records.
+    """
+    traces = {}
+    for filename in filenames:
+        for rec in json.loadlines(filename):
+            traces.setdefault(rec['trace'], []).append(rec)
+    return traces
+
+
+def critical_path(records):
+    """Returns the list of span records on the critical path of a trace. This
+    starts at the longest root span and repeatedly follows the child that
+    finished last, since that child is what its parent was waiting on.
+    """
+    ids = {rec['span'] for rec in records}
+    children = {}
+    roots = []
+    for rec in records:
+        if rec['parent'] in ids:
+            children.setdefault(rec['parent'], []).append(rec)
+        else:
+            roots.append(rec)
+    if not roots:
+        return []
+    path = [max(roots, key=lambda r: r['dur'])]
+    while path[-1]['span'] in children:
+        path.append(max(children[path[-1]['span']],
+                        key=lambda r: r['start'] + r['dur']))
+    return path
+
+
+def format_trace(records):
+    """Returns a string of the span tree of a trace, with the spans on the
+    critical path marked by an asterisk.
+    """
+    ids = {rec['span'] for rec in records}
+    crit = {rec['span'] for rec in critical_path(records)}
+    children = {}
+    for rec in sorted(records, key=lambda r: r['start']):
+        parent = rec['parent'] if rec['parent'] in ids else None
+        children.setdefault(parent, []).append(rec)
+    t0 = min(rec['start'] for rec in records)
+    lines = []
+    stack = [(rec, 0) for rec in reversed(children.get(None, []))]
+    while stack:
+        rec, depth = stack.pop()
+        mark = '*' if rec['span'] in crit else ' '
+        lines.append('{0} {1:10.3f} ms {2:+10.3f} ms {3}{4} [pid {5}]'.format(
+                     mark, rec['dur'] * 1e3, (rec['start'] - t0) * 1e3,
+                     '  ' * depth, rec['name'], rec['pid']))
+        stack.extend((c, depth + 1) for c in reversed(children.get(rec['span'], [])))
+    return '\n'.join(lines)
+
+
+def make_parser():
+    """Makes an argument parser for the trace analysis tool."""
+    p = argparse.ArgumentParser('fixie.tracing',
+                                description='Shows the critical path of a fixie trace.')
+    p.add_argument('-f', '--file', dest='files', action='append', default=None,
+                   help='trace file(s) to read, default is $FIXIE_TRACE_FILE.')
+    p.add_argument('trace', nargs='?', default=None,
+                   help='trace id to show, default is the slowest trace.')
+    return p
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    with context():
+        ns = make_parser().parse_args(args)
+        files = ns.files or [ENV['FIXIE_TRACE_FILE']]
+        traces = load_traces(files)
+    if not traces:
+        print('no traces found')
+        return
+    if ns.trace is None:
+        trace = max(traces, key=lambda t: max(r['dur'] for r in traces[t]))
+    else:
+        trace = ns.trace
+    print('trace ' + trace)
+    print(format_trace(traces[trace]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Unix domain socket transport for fixie services on the same host.
+
+Services that run as separate processes on one host may listen on a Unix
+domain socket (``fixie --unix-socket PATH``) and reach each other with
+``unix://`` base URLs in $FIXIE_*_URL, which avoids the TCP stack and port
+management. The socket path is either the percent-encoded host of the URL,
+e.g. ``unix://%2Frun%2Ffixie%2Fcreds.sock/verify``, or the leading part of
+its path that names a socket, e.g. ``unix:///run/fixie/creds.sock/verify``.
+"""
+import os
+import stat
+import socket
+import hashlib
+import weakref
+from urllib.parse import urlsplit, unquote
+
+import tornado.ioloop
+from tornado.netutil import Resolver, DefaultLoopResolver
+from tornado.httpclient import AsyncHTTPClient
+
+
+# socket paths by the host names that stand in for them in HTTP URLs
+SOCKETS = {}
+_CLIENTS = weakref.WeakKeyDictionary()
+
+
+class UnixResolver(Resolver):
+    """Resolves the stand-in host names of Unix sockets to their paths, and
+    all other host names as usual.
+    """
+
+    def initialize(self, resolver=None):
+        self.resolver = DefaultLoopResolver() if resolver is None else resolver
+
+    def close(self):
+        self.resolver.close()
+
+    async def resolve(self, host, port, family=socket.AF_UNSPEC):
+        path = SOCKETS.get(host, None)
+        if path is None:
+            return await self.resolver.resolve(host, port, family)
+        return [(socket.AF_UNIX, path)]
+
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def split_url(url):
+    """Splits a unix:// URL into its socket path and its HTTP path."""
+    parts = urlsplit(url)
+    if parts.scheme != 'unix':
+        raise ValueError('not a unix:// URL: ' + url)
+    query = '?' + parts.query if parts.query else ''
+    if parts.netloc:
+        return unquote(parts.netloc), (parts.path or '/') + query
+    path = parts.path
+    for known in SOCKETS.values():
+        if path == known or path.startswith(known + '/'):
+            return known, (path[len(known):] or '/') + query
+    i = 0
+    while True:
+        i = path.find('/', i + 1)
+        prefix = path if i < 0 else path[:i]
+        if _is_socket(prefix):
+            return prefix, (path[len(prefix):] or '/') + query
+        if i < 0:
+            raise ValueError('no Unix socket found in URL: ' + url)
+
+
+def http_url(url):
+    """Returns the HTTP URL that ``client()`` fetches for a unix:// URL."""
+    path, rest = split_url(url)
+    host = 'unix-' + hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    SOCKETS[host] = path
+    return 'http://' + host + rest
+
+
+def client():
+    """Returns the HTTP client for Unix socket URLs on the current IOLoop."""
+    loop = tornado.ioloop.IOLoop.current()
+    rtn = _CLIENTS.get(loop, None)
+    if rtn is None:
+        rtn = _CLIENTS[loop] = AsyncHTTPClient(force_instance=True,
+                                               resolver=UnixResolver())
+    return rtn
@@ -0,0 +1,105 @@
+"""An IOLoop watchdog that finds the callbacks that block fixie's event loop.
+
+A heartbeat callback runs on the IOLoop every interval and records how late it
+ran in the fixie_ioloop_lag_seconds histogram. Meanwhile, a watcher thread
+checks that the heartbeat keeps beating. When the loop has been stuck for
+longer than $FIXIE_STALL_THRESHOLD, the watcher captures the stack of the
+IOLoop thread. Once the loop recovers, the stall and its stack are logged in
+the 'stall' category and counted in fixie_ioloop_stalls_total.
+"""
+import sys
+import time
+import threading
+import traceback
+
+import tornado.ioloop
+
+from fixie.environ import ENV
+from fixie.logger import LOGGER, WARNING
+from fixie.metrics import METRICS
+
+
+class Watchdog:
+    """Detects and reports stalls of the current IOLoop."""
+
+    def __init__(self, threshold=None, interval=None):
+        """
+        Parameters
+        ----------
+        threshold : float or None, optional
+            Number of seconds that the loop may be blocked before a stall is
+            reported, if None, defaults to $FIXIE_STALL_THRESHOLD.
+        interval : float or None, optional
+            Number of seconds between heartbeats, if None, defaults to
+            half the threshold.
+        """
+        self.threshold = ENV['FIXIE_STALL_THRESHOLD'] if threshold is None else threshold
+        self.interval = self.threshold / 2 if interval is None else interval
+        self.stalls = 0
+        self._beat = None
+        self._stack = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._handle = None
+        self._loop = None
+        self._loop_thread = None
+
+    def start(self):
+        """Starts the heartbeat on the current IOLoop and the watcher thread."""
+        self._loop = tornado.ioloop.IOLoop.current()
+        self._loop_thread = threading.get_ident()
+        self._stopped.clear()
+        self._beat = time.perf_counter()
+        self._handle = self._loop.call_later(self.interval, self._heartbeat)
+        self._thread = threading.Thread(target=self._watch, name='fixie-watchdog',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the heartbeat and the watcher thread."""
+        self._stopped.set()
+        if self._handle is not None:
+            self._loop.remove_timeout(self._handle)
+            self._handle = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _heartbeat(self):
+        now = time.perf_counter()
+        # how much later than scheduled this callback ran
+        lag = max(0.0, now - self._beat - self.interval)
+        with self._lock:
+            self._beat = now
+            stack, self._stack = self._stack, None
+        METRICS.observe('fixie_ioloop_lag_seconds', lag)
+        if lag >= self.threshold:
+            self.report(lag, stack)
+        self._handle = self._loop.call_later(self.interval, self._heartbeat)
+
+    def _watch(self):
+        period = self.threshold / 4
+        while not self._stopped.wait(period):
+            with self._lock:
+                if self._stack is not None:
+                    continue
+                if time.perf_counter() - self._beat - self.interval < self.threshold:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread, None)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            with self._lock:
+                self._stack = stack
+            del frame
+
+    def report(self, duration, stack=None):
+        """Reports a stall of the IOLoop that lasted for duration seconds. The
+        stack is captured while the loop was blocked, if available.
+        """
+        self.stalls += 1
+        METRICS.inc('fixie_ioloop_stalls_total')
+        METRICS.observe('fixie_ioloop_stall_seconds', duration)
+        LOGGER.log('IOLoop blocked for {0:.3f} s', category='stall', level=WARNING,
+                   data={'duration': duration, 'stack': stack}, args=(duration,))
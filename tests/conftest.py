@@ -56,3 +56,32 @@ def jobaliases(request):
         orig, ENV['FIXIE_JOB_ALIASES_FILE'] = ENV['FIXIE_JOB_ALIASES_FILE'], name
         yield name
         ENV['FIXIE_JOB_ALIASES_FILE'] = orig
+
+
+@pytest.fixture
+def registry(request):
+    """A fixure that creates a temporary job registry file and assigns it in the environment.
+    """
+    with environ.context(), tempfile.NamedTemporaryFile() as f:
+        name = f.name
+        orig, ENV['FIXIE_REGISTRY_FILE'] = ENV['FIXIE_REGISTRY_FILE'], name
+        yield name
+        ENV['FIXIE_REGISTRY_FILE'] = orig
+
+
+def pytest_addoption(parser):
+    parser.addoption('--bench', action='store_true', default=False,
+                     help='run the benchmarks, which are skipped by default.')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'bench: a benchmark, only run with --bench')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('bench'):
+        return
+    skip = pytest.mark.skip(reason='benchmarks are only run with --bench')
+    for item in items:
+        if 'bench' in item.keywords:
+            item.add_marker(skip)
@@ -0,0 +1,81 @@
+"""Tests admission control."""
+import pytest
+import tornado.gen
+import tornado.web
+from tornado.httpclient import HTTPError
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.admission import ADMISSION, TokenBucket
+from fixie.request_handler import RequestHandler
+
+
+class SlowRequest(RequestHandler):
+
+    schema = {'name': {'type': 'string'}}
+
+    @tornado.gen.coroutine
+    def post(self):
+        yield tornado.gen.sleep(0.2)
+        self.write({'hello': self.request.arguments['name']})
+
+
+APP = tornado.web.Application([
+    (r"/", SlowRequest),
+])
+
+BODY = '{"name": "me"}'
+
+
+@pytest.fixture
+def app():
+    ADMISSION.buckets.clear()
+    with environ.context():
+        yield APP
+    ADMISSION.buckets.clear()
+
+
+def test_token_bucket():
+    b = TokenBucket(1.0, 2)
+    now = b.last
+    assert b.take(now) == 0.0
+    assert b.take(now) == 0.0
+    assert b.take(now) == pytest.approx(1.0)
+    assert b.take(now + 1.0) == 0.0
+    assert not b.full(now + 1.0)
+    assert b.full(now + 3.0)
+
+
+@pytest.mark.gen_test
+def test_max_body_size(http_client, base_url):
+    with ENV.swap(FIXIE_MAX_BODY_SIZE=4):
+        with pytest.raises(HTTPError) as e:
+            yield http_client.fetch(base_url, method='POST', body=BODY)
+    assert e.value.code == 413
+    assert ADMISSION.inflight == 0
+
+
+@pytest.mark.gen_test
+def test_max_inflight(http_client, base_url):
+    with ENV.swap(FIXIE_MAX_INFLIGHT=1):
+        first = http_client.fetch(base_url, method='POST', body=BODY)
+        yield tornado.gen.sleep(0.05)
+        with pytest.raises(HTTPError) as e:
+            yield http_client.fetch(base_url, method='POST', body=BODY)
+        assert e.value.code == 503
+        assert e.value.response.headers['Retry-After'] == '1'
+        response = yield first
+        assert response.code == 200
+    assert ADMISSION.inflight == 0
+
+
+@pytest.mark.gen_test
+def test_rate_limit(http_client, base_url):
+    with ENV.swap(FIXIE_RATE_LIMIT=0.01, FIXIE_RATE_BURST=2):
+        for i in range(2):
+            response = yield http_client.fetch(base_url, method='POST', body=BODY)
+            assert response.code == 200
+        with pytest.raises(HTTPError) as e:
+            yield http_client.fetch(base_url, method='POST', body=BODY)
+    assert e.value.code == 429
+    assert int(e.value.response.headers['Retry-After']) > 1
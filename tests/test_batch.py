@@ -0,0 +1,66 @@
+"""Tests batch job submission."""
+import os
+import time
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.batch import submit_batch
+from fixie.registry import REGISTRY
+from fixie.tools import jobids_from_alias, next_jobid, waitpid, LAUNCHER
+import fixie.jsonutils as json
+
+
+def test_submit_batch(jobfile, jobaliases, registry, tmpdir):
+    jobs = [{'args': ['touch', str(tmpdir.join(str(i)))], 'user': 'me',
+             'name': 'sweep', 'project': 'proj'} for i in range(5)]
+    jobs.append({'args': ['fixie-no-such-executable'], 'user': 'me', 'name': 'sweep',
+                 'project': 'proj'})
+    results = submit_batch(jobs, max_workers=2, watch=False)
+    assert [r['jobid'] for r in results] == list(range(6))
+    assert [r['status'] for r in results] == [True] * 5 + [False]
+    assert results[-1]['pid'] == 0
+    for r in results[:5]:
+        waitpid(r['pid'], timeout=5.0)
+    assert sorted(os.listdir(str(tmpdir))) == [str(i) for i in range(5)]
+    # the failed job is not aliased, and all jobids were allocated at once
+    assert jobids_from_alias('me', name='sweep', project='proj') == set(range(5))
+    assert next_jobid() == 6
+    # the supervisor may have already recorded the exit of the job
+    assert REGISTRY.get(0)['state'] in ('running', 'exited')
+    assert REGISTRY.get(0)['path'] == ''
+    assert REGISTRY.get(5)['state'] == 'failed'
+
+
+def test_submit_empty_batch(jobfile, registry):
+    assert submit_batch([]) == []
+    assert next_jobid() == 0
+
+
+def test_submit_batch_without_fork(jobfile, jobaliases, registry, monkeypatch):
+    # the server starts the supervisor server when it starts up
+    LAUNCHER.start()
+
+    def fork():
+        raise AssertionError('the server process must not fork')
+    monkeypatch.setattr(os, 'fork', fork)
+    jobs = [{'args': ['sleep', '3']} for i in range(8)]
+    t0 = time.time()
+    results = submit_batch(jobs, max_workers=4, watch=False)
+    # no launch waits for the other jobs, nor for a new interpreter to start
+    assert time.time() - t0 < 1.0
+    assert all(r['status'] for r in results)
+
+
+def test_submit_batch_registers_expiry(jobfile, jobaliases, registry, tmpdir):
+    simsdir = tmpdir.mkdir('sims')
+    with environ.context(), ENV.swap(FIXIE_EXPIRY_FILE=str(tmpdir.join('expiry.json')),
+                                     FIXIE_SIMS_DIR=str(simsdir)):
+        jobs = [{'args': ['true'], 'path': '/proj/out.h5'},
+                {'args': ['true']},
+                {'args': ['fixie-no-such-executable'], 'path': '/proj/failed.h5'}]
+        results = submit_batch(jobs, watch=False)
+        for r in results[:2]:
+            waitpid(r['pid'], timeout=5.0)
+        entries = json.loadlines(ENV['FIXIE_EXPIRY_FILE'])
+    assert [e['jobid'] for e in entries] == [0]
+    assert entries[0]['paths'] == [str(simsdir.join('proj', 'out.h5'))]
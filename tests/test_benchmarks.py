@@ -0,0 +1,291 @@
+"""Benchmarks of fixie's hot paths. These use pytest-benchmark and are skipped
+unless pytest is run with the --bench flag. To save a baseline and later
+compare against it::
+
+    $ python -m pytest tests/test_benchmarks.py --bench --benchmark-save=baseline
+    $ python -m pytest tests/test_benchmarks.py --bench --benchmark-compare \
+        --benchmark-compare-fail=mean:10%
+    $ pytest-benchmark compare
+
+Baselines are stored in the .benchmarks directory.
+"""
+import asyncio
+import threading
+import multiprocessing
+
+import pytest
+import tornado.web
+import tornado.ioloop
+import tornado.httpserver
+from tornado.httpclient import HTTPClient
+from tornado.netutil import bind_unix_socket
+from tornado.testing import bind_unused_port
+
+pytest.importorskip('pytest_benchmark')
+
+import fixie.jsonutils as json
+from fixie import environ
+from fixie.environ import ENV
+from fixie.logger import LOGGER, DEBUG
+from fixie.journal import JOURNAL
+from fixie.jobidset import JobidSet
+from fixie.request_handler import RequestHandler
+from fixie.dispatch import register_application, unregister_application
+from fixie.tools import (fetch, flock, next_jobid, register_job_alias, jobids_from_alias,
+    jobids_with_name)
+
+
+pytestmark = pytest.mark.bench
+
+ALIAS_SIZES = [1000, 10000, 100000, 1000000]
+LOG_SIZES = [1000, 100000]
+
+
+def make_alias_cache(n):
+    """Makes an alias cache with n jobids in total, spread over users with
+    10 names of mostly consecutive jobids each.
+    """
+    nusers = max(1, n // 1000)
+    per_name = max(1, n // (nusers * 10))
+    cache = {}
+    jobid = 0
+    for u in range(nusers):
+        names = {}
+        for k in range(10):
+            names['sim' + str(k)] = JobidSet(range(jobid, jobid + per_name))
+            jobid += per_name
+        cache['user' + str(u)] = {'proj': names}
+    return cache
+
+
+@pytest.fixture(params=ALIAS_SIZES, ids=lambda n: 'aliases={0}'.format(n))
+def alias_file(request, tmpdir):
+    """A fixture for an aliases file of a given size."""
+    f = str(tmpdir.join('aliases.json'))
+    with open(f, 'w') as fh:
+        json.dump(make_alias_cache(request.param), fh)
+    with environ.context(), ENV.swap(FIXIE_JOB_ALIASES_FILE=f):
+        yield f
+
+
+@pytest.fixture
+def jobid_file(tmpdir):
+    f = str(tmpdir.join('id'))
+    with environ.context(), ENV.swap(FIXIE_JOBID_FILE=f):
+        yield f
+
+
+#
+# jobids and aliases
+#
+
+def test_next_jobid(benchmark, jobid_file):
+    benchmark(next_jobid)
+
+
+@pytest.fixture
+def journal_file(tmpdir):
+    f = str(tmpdir.join('journal.json'))
+    with environ.context(), ENV.swap(FIXIE_JOURNAL=True, FIXIE_JOURNAL_FILE=f,
+                                     FIXIE_JOBID_FILE=str(tmpdir.join('id')),
+                                     FIXIE_JOB_ALIASES_FILE=str(tmpdir.join('aliases.json'))):
+        JOURNAL.clear()
+        yield f
+    JOURNAL.clear()
+
+
+def test_next_jobid_journal(benchmark, journal_file):
+    benchmark(next_jobid)
+
+
+def test_register_job_alias_journal(benchmark, journal_file):
+    benchmark(register_job_alias, 42, 'user0', name='new-sim', project='proj')
+
+
+def test_register_job_alias(benchmark, alias_file):
+    benchmark(register_job_alias, 42, 'user0', name='new-sim', project='proj')
+
+
+def test_jobids_from_alias(benchmark, alias_file):
+    jobids = benchmark(jobids_from_alias, 'user0', name='sim0', project='proj')
+    assert len(jobids) > 0
+
+
+def test_jobids_with_name(benchmark, alias_file):
+    jobids = benchmark(jobids_with_name, 'sim0', project='proj')
+    assert len(jobids) > 0
+
+
+def _hammer_next_jobid(n):
+    for i in range(n):
+        next_jobid(sleepfor=0.0005)
+
+
+@pytest.mark.parametrize('nprocs', [1, 4, 8])
+def test_next_jobid_contention(benchmark, jobid_file, nprocs):
+    ctx = multiprocessing.get_context('fork')
+    nper = 20
+    nruns = []
+
+    def run():
+        nruns.append(1)
+        procs = [ctx.Process(target=_hammer_next_jobid, args=(nper,))
+                 for i in range(nprocs)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+
+    start = next_jobid()
+    benchmark.pedantic(run, rounds=3, iterations=1)
+    assert next_jobid() == start + 1 + len(nruns) * nprocs * nper
+
+
+def test_flock_uncontended(benchmark, tmpdir):
+    f = str(tmpdir.join('lock-bench'))
+
+    def lock():
+        with flock(f, timeout=1.0):
+            pass
+
+    benchmark(lock)
+
+
+#
+# JSON
+#
+
+@pytest.mark.parametrize('n', ALIAS_SIZES)
+def test_json_dumps(benchmark, n):
+    cache = make_alias_cache(n)
+    benchmark(json.dumps, cache)
+
+
+@pytest.mark.parametrize('n', ALIAS_SIZES)
+def test_json_loads(benchmark, n):
+    s = json.dumps(make_alias_cache(n))
+    benchmark(json.loads, s)
+
+
+#
+# logger
+#
+
+@pytest.fixture
+def logfile(tmpdir):
+    f = str(tmpdir.join('log.json'))
+    orig, LOGGER.filename = LOGGER._filename, f
+    yield f
+    LOGGER._filename = orig
+    LOGGER._dirty = True
+
+
+def test_logger_log(benchmark, logfile):
+    benchmark(LOGGER.log, 'benchmarking', category='bench', data={'x': 1})
+
+
+def test_logger_log_filtered(benchmark, logfile):
+    benchmark(LOGGER.log, 'benchmarking {0}', category='bench', data={'x': 1},
+              level=DEBUG, args=(1,))
+    assert LOGGER.load() == []
+
+
+@pytest.mark.parametrize('n', LOG_SIZES)
+def test_logger_load(benchmark, logfile, n):
+    entry = {'message': 'benchmarking', 'timestamp': 0.0, 'category': 'bench',
+             'data': {'x': 1}}
+    with open(logfile, 'w') as fh:
+        for i in range(n):
+            json.appendline(entry, fh)
+
+    def dirty():
+        LOGGER._dirty = True
+
+    entries = benchmark.pedantic(LOGGER.load, setup=dirty, rounds=5)
+    assert len(entries) == n
+
+
+#
+# request handler round trips
+#
+
+class EchoRequest(RequestHandler):
+
+    schema = {'name': {'type': 'string'}, 'data': {'type': 'list'}}
+
+    def post(self):
+        self.write({'name': self.request.arguments['name']})
+
+
+@pytest.fixture(scope='module')
+def server_url():
+    """Runs a fixie app on its own IOLoop in a background thread."""
+    sock, port = bind_unused_port()
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        app = tornado.web.Application([(r'/', EchoRequest)])
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_sockets([sock])
+        loop.call_soon(started.set)
+        loop.run_forever()
+        server.stop()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait()
+    yield 'http://127.0.0.1:{0}/'.format(port)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+@pytest.mark.parametrize('n', [0, 100, 10000])
+def test_request_handler_round_trip(benchmark, server_url, n):
+    client = HTTPClient()
+    body = json.dumps({'name': 'Inigo Montoya', 'data': list(range(n))})
+
+    def fetch():
+        return client.fetch(server_url, method='POST', body=body)
+
+    response = benchmark(fetch)
+    assert response.code == 200
+    client.close()
+
+
+@pytest.fixture
+def fetch_loop(tmpdir):
+    """An IOLoop serving EchoRequest in this thread over TCP and a Unix socket,
+    and the server's URLs.
+    """
+    loop = tornado.ioloop.IOLoop(make_current=False)
+    sock, port = bind_unused_port()
+    path = str(tmpdir.join('fixie.sock'))
+    app = tornado.web.Application([(r'/', EchoRequest)])
+
+    async def listen():
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_sockets([sock, bind_unix_socket(path)])
+        return server
+
+    server = loop.run_sync(listen)
+    urls = {'http': 'http://127.0.0.1:{0}'.format(port), 'unix': 'unix://' + path}
+    yield loop, app, urls
+    server.stop()
+    loop.close(all_fds=True)
+
+
+@pytest.mark.parametrize('n', [0, 10000])
+@pytest.mark.parametrize('transport', ['http', 'unix', 'local'])
+def test_fetch(benchmark, fetch_loop, transport, n):
+    loop, app, urls = fetch_loop
+    url = urls['http' if transport == 'local' else transport]
+    obj = {'name': 'Inigo Montoya', 'data': list(range(n))}
+    if transport == 'local':
+        register_application(app, url)
+    try:
+        response = benchmark(loop.run_sync, lambda: fetch(url + '/', obj))
+    finally:
+        unregister_application(url)
+    assert response == {'name': 'Inigo Montoya'}
@@ -0,0 +1,171 @@
+"""Tests the coordinator, with a coordinator and several nodes as processes."""
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import tornado.web
+import tornado.ioloop
+import tornado.httpserver
+from tornado.testing import bind_unused_port
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.coordinator import Leases, HANDLERS, COORDINATOR
+from fixie.tools import (fetch_sync, flock, next_jobid, next_jobids, register_job_aliases,
+    remove_job_aliases, jobids_from_alias, jobids_with_name, jobids_of_user)
+
+
+def _serve(conn):
+    # keep the forked parent's loop referenced, since closing it when it is
+    # collected would unregister the parent's sockets from their shared epoll
+    inherited = asyncio.get_event_loop_policy().get_event_loop()
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    ENV['FIXIE_COORDINATOR'] = True
+    sock, port = bind_unused_port()
+    server = tornado.httpserver.HTTPServer(tornado.web.Application(HANDLERS))
+    server.add_sockets([sock])
+    conn.send(port)
+    conn.close()
+    tornado.ioloop.IOLoop.current().start()
+
+
+@pytest.fixture
+def coordinator(tmpdir):
+    """A fixture that runs a coordinator in a child process, and makes this
+    process (and its children) a node that uses it.
+    """
+    ctx = multiprocessing.get_context('fork')
+    parent, child = ctx.Pipe()
+    with environ.context(), ENV.swap(FIXIE_DATA_DIR=str(tmpdir),
+                                     FIXIE_JOBID_FILE=str(tmpdir.join('id')),
+                                     FIXIE_JOB_ALIASES_FILE=str(tmpdir.join('aliases.json'))):
+        proc = ctx.Process(target=_serve, args=(child,), daemon=True)
+        proc.start()
+        url = 'http://127.0.0.1:' + str(parent.recv())
+        with ENV.swap(FIXIE_COORDINATOR_URL=url):
+            yield url
+    proc.terminate()
+    proc.join()
+
+
+def _node(counter, n, q):
+    jobids = [next_jobid() for i in range(n)]
+    register_job_aliases([(jobid, 'me', 'sweep', '') for jobid in jobids])
+    for i in range(n):
+        with flock(counter) as token:
+            assert token != 0
+            with open(counter) as f:
+                value = int(f.read() or 0)
+            with open(counter, 'w') as f:
+                f.write(str(value + 1))
+    q.put(jobids)
+
+
+def test_nodes(coordinator, tmpdir):
+    counter = str(tmpdir.join('counter'))
+    open(counter, 'w').close()
+    ctx = multiprocessing.get_context('fork')
+    q = ctx.Queue()
+    procs = [ctx.Process(target=_node, args=(counter, 10, q)) for i in range(4)]
+    for proc in procs:
+        proc.start()
+    jobids = []
+    for proc in procs:
+        jobids.extend(q.get(timeout=60))
+    for proc in procs:
+        proc.join()
+        assert proc.exitcode == 0
+    assert sorted(jobids) == list(range(40))
+    with open(counter) as f:
+        assert f.read() == '40'
+    # the aliases were registered with the coordinator
+    assert not os.path.exists(ENV['FIXIE_JOB_ALIASES_FILE'] + '.lock')
+    assert jobids_from_alias('me', name='sweep') == set(range(40))
+    assert jobids_with_name('sweep') == set(range(40))
+    assert jobids_of_user('me') == set(range(40))
+    assert next_jobids(5) == range(40, 45)
+    assert remove_job_aliases(range(20))
+    assert jobids_from_alias('me', name='sweep') == set(range(20, 40))
+    assert jobids_from_alias('you', name='sweep') == set()
+
+
+def test_lease(coordinator, tmpdir):
+    f = str(tmpdir.join('x'))
+    with flock(f) as token:
+        assert token != 0
+        # the lease is backed by the coordinator's lock file
+        assert os.path.exists(f + '.lock')
+        with flock(f, timeout=0.2, sleepfor=0.05, raise_errors=False) as other:
+            assert other == 0
+        with pytest.raises(TimeoutError):
+            with flock(f, timeout=0.2, sleepfor=0.05):
+                pass
+    assert not os.path.exists(f + '.lock')
+
+
+def test_contended_lease(coordinator):
+    # while the coordinator waits for the lock of a lease, it still serves
+    # the release of that lease
+    with ThreadPoolExecutor(1) as pool:
+        with flock(ENV['FIXIE_JOBID_FILE']) as token:
+            assert token != 0
+            future = pool.submit(next_jobids, 2)
+            time.sleep(0.2)
+            assert not future.done()
+            t0 = time.time()
+        assert future.result(timeout=10.0) == range(0, 2)
+        assert time.time() - t0 < 5.0
+
+
+def test_unauthorized(coordinator, tmpdir):
+    url = coordinator + '/coordinator/'
+    with pytest.raises(Exception) as e:
+        fetch_sync(url + 'jobids', {'n': 1, 'secret': 'guess'})
+    assert e.value.code == 403
+    with pytest.raises(Exception) as e:
+        fetch_sync(url + 'jobids', {'n': 1})
+    assert e.value.code == 400
+    # only the locks of files in $FIXIE_DATA_DIR may be leased
+    with pytest.raises(Exception) as e:
+        COORDINATOR.acquire(str(tmpdir.join('..', 'elsewhere')))
+    assert e.value.code == 403
+    assert not os.path.exists(str(tmpdir.join('..', 'elsewhere.lock')))
+
+
+def test_remote_errors(tmpdir):
+    with environ.context(), ENV.swap(FIXIE_DATA_DIR=str(tmpdir),
+                                     FIXIE_COORDINATOR_URL='http://127.0.0.1:1'):
+        assert next_jobids(1, raise_errors=False) is None
+        assert jobids_from_alias('me', raise_errors=False) == set()
+        with flock(str(tmpdir.join('x')), raise_errors=False) as token:
+            assert token == 0
+        with pytest.raises(Exception):
+            next_jobid()
+
+
+def test_leases(tmpdir):
+    leases = Leases()
+    f = str(tmpdir.join('x'))
+    with environ.context(), ENV.swap(FIXIE_DATA_DIR=str(tmpdir)):
+        token = leases.acquire(f, owner='me', ttl=10.0)
+        assert token != 0
+        assert leases.acquire(f) == 0
+        assert leases.release(token)
+        assert not leases.release(token)
+        assert not os.path.exists(f + '.lock')
+        # expired leases are released
+        token = leases.acquire(f, ttl=0.0)
+        other = leases.acquire(f, ttl=10.0)
+        assert other != 0
+        assert not leases.release(token)
+        # leases last at most $FIXIE_LEASE_TIME
+        with ENV.swap(FIXIE_LEASE_TIME=0.0):
+            token = leases.acquire(str(tmpdir.join('y')), ttl=1e9)
+        assert leases.acquire(str(tmpdir.join('y'))) != 0
+        with pytest.raises(ValueError):
+            leases.acquire(str(tmpdir.join('..', 'x')))
+        leases.clear()
+    assert not os.path.exists(f + '.lock')
@@ -0,0 +1,88 @@
+"""Tests in-process dispatch of fetches."""
+import pytest
+import tornado.web
+from tornado.httpclient import HTTPClientError
+
+from fixie.metrics import METRICS
+from fixie.request_handler import RequestHandler
+from fixie.response_cache import RESPONSE_CACHE, cached
+from fixie.dispatch import register_application, unregister_application
+from fixie.tools import fetch
+
+
+class EchoRequest(RequestHandler):
+
+    schema = {'name': {'type': 'string'}, 'data': {'type': 'list'}}
+
+    def post(self):
+        self.write({'name': self.request.arguments['name'],
+                    'data': self.request.arguments.get('data', [])})
+
+
+class CachedEchoRequest(EchoRequest):
+
+    @cached()
+    def post(self):
+        super().post()
+
+
+APP = tornado.web.Application([
+    (r'/echo', EchoRequest),
+    (r'/cached', CachedEchoRequest),
+])
+
+
+@pytest.fixture
+def app():
+    return APP
+
+
+@pytest.fixture
+def local_url(http_server, base_url):
+    register_application(APP, base_url)
+    yield base_url
+    unregister_application(base_url)
+
+
+def _local_total():
+    return METRICS.counters.get(('fixie_fetch_local_total', ()), 0)
+
+
+@pytest.mark.gen_test
+def test_local(local_url):
+    n = _local_total()
+    obj = {'name': 'Inigo Montoya', 'data': [1, 2, 3]}
+    response = yield fetch(local_url + '/echo', obj)
+    assert response == obj
+    # the object was not serialized
+    assert response['data'] is obj['data']
+    assert _local_total() == n + 1
+
+
+@pytest.mark.gen_test
+def test_local_invalid(local_url):
+    with pytest.raises(HTTPClientError) as exc:
+        yield fetch(local_url + '/echo', {'name': 42})
+    assert exc.value.code == 400
+    assert 'not valid' in exc.value.message
+
+
+@pytest.mark.gen_test
+def test_unrouted_is_remote(local_url):
+    n = _local_total()
+    with pytest.raises(HTTPClientError) as exc:
+        yield fetch(local_url + '/nope', {'name': 'x'})
+    assert exc.value.code == 404
+    assert _local_total() == n
+
+
+@pytest.mark.gen_test
+def test_local_cached(local_url, base_url):
+    RESPONSE_CACHE.clear()
+    obj = {'name': 'Inigo Montoya'}
+    local = yield fetch(local_url + '/cached', obj)
+    unregister_application(base_url)
+    remote = yield fetch(base_url + '/cached', obj)
+    assert local == remote == {'name': 'Inigo Montoya', 'data': []}
+    assert RESPONSE_CACHE.hits == 1
+    RESPONSE_CACHE.clear()
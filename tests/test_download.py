@@ -0,0 +1,92 @@
+"""Tests the download handler."""
+import os
+
+import pytest
+import tornado.web
+from tornado.httpclient import HTTPError
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.download import DownloadHandler
+from fixie.layout import storage_path
+
+
+DATA = os.urandom(DownloadHandler.chunk_size * 2 + 1000)
+
+
+class SmallChunkDownloadHandler(DownloadHandler):
+
+    chunk_size = 1000
+
+
+@pytest.fixture
+def app(tmpdir):
+    sims = str(tmpdir.join('sims'))
+    with environ.context(), ENV.swap(FIXIE_SIMS_DIR=sims):
+        f = storage_path('/proj/sim.h5')
+        os.makedirs(os.path.dirname(f))
+        with open(f, 'wb') as fh:
+            fh.write(DATA)
+        yield tornado.web.Application([
+            (r'/download/(.*)', DownloadHandler),
+            (r'/small/(.*)', SmallChunkDownloadHandler),
+        ])
+
+
+@pytest.mark.gen_test
+def test_download(http_client, base_url):
+    chunks = []
+    r = yield http_client.fetch(base_url + '/download/proj/sim.h5',
+                                streaming_callback=chunks.append)
+    assert r.code == 200
+    assert b''.join(chunks) == DATA
+    assert r.headers['Content-Type'] == 'application/x-hdf5'
+    assert r.headers['Accept-Ranges'] == 'bytes'
+
+
+@pytest.mark.gen_test
+def test_range(http_client, base_url):
+    for prefix in ('/download/', '/small/'):
+        r = yield http_client.fetch(base_url + prefix + 'proj/sim.h5',
+                                    headers={'Range': 'bytes=100-2999'})
+        assert r.code == 206
+        assert r.body == DATA[100:3000]
+    # resume from an offset
+    r = yield http_client.fetch(base_url + '/small/proj/sim.h5',
+                                headers={'Range': 'bytes=5000-'})
+    assert r.code == 206
+    assert r.body == DATA[5000:]
+
+
+@pytest.mark.gen_test
+def test_conditional_get(http_client, base_url):
+    url = base_url + '/download/proj/sim.h5'
+    r = yield http_client.fetch(url, method='HEAD')
+    etag = r.headers['Etag']
+    with pytest.raises(HTTPError) as e:
+        yield http_client.fetch(url, headers={'If-None-Match': etag})
+    assert e.value.code == 304
+    # rewriting the file changes the tag
+    with open(storage_path('/proj/sim.h5'), 'ab') as fh:
+        fh.write(b'more')
+    r = yield http_client.fetch(url, headers={'If-None-Match': etag})
+    assert r.code == 200
+    assert r.headers['Etag'] != etag
+
+
+@pytest.mark.gen_test
+def test_sharded_download(http_client, base_url):
+    with ENV.swap(FIXIE_SHARD_LAYOUT='hash'):
+        f = storage_path('/42.h5')
+        os.makedirs(os.path.dirname(f))
+        with open(f, 'wb') as fh:
+            fh.write(b'sharded')
+        r = yield http_client.fetch(base_url + '/download/42.h5')
+    assert r.body == b'sharded'
+
+
+@pytest.mark.gen_test
+def test_missing(http_client, base_url):
+    with pytest.raises(HTTPError) as e:
+        yield http_client.fetch(base_url + '/download/proj/nope.h5')
+    assert e.value.code == 404
@@ -0,0 +1,44 @@
+"""Tests fixie environment tools."""
+import os
+
+from fixie import environ
+from fixie.environ import ENV, detyped_env, fixie_detype_env
+
+
+def test_detyped_env_cached():
+    with environ.context():
+        first = detyped_env()
+        assert first is detyped_env()
+        with ENV.swap(FIXIE_DETYPE_TEST='yes'):
+            denv = detyped_env()
+            assert denv is not first
+            assert denv['FIXIE_DETYPE_TEST'] == 'yes'
+        assert 'FIXIE_DETYPE_TEST' not in detyped_env()
+
+
+def test_fixie_detype_env():
+    with environ.context(), ENV.swap(FIXIE_NJOBS=42, FIXIE_DETYPE_TEST='yes'):
+        denv = fixie_detype_env()
+        assert denv is fixie_detype_env()
+        assert denv['FIXIE_NJOBS'] == '42'
+        assert 'FIXIE_DETYPE_TEST' not in denv
+        assert 'PATH' not in denv
+        ENV['FIXIE_NJOBS'] = 7
+        assert fixie_detype_env()['FIXIE_NJOBS'] == '7'
+
+
+def test_lazy_defaults(tmpdir):
+    datahome = str(tmpdir.join('data'))
+    with environ.context(), ENV.swap(XDG_DATA_HOME=datahome):
+        assert isinstance(ENV._defaults['FIXIE_JOBS_DIR'], environ.LazyDefault)
+        jobsdir = ENV['FIXIE_JOBS_DIR']
+        assert jobsdir == os.path.join(datahome, 'fixie', 'jobs')
+        assert jobsdir is ENV['FIXIE_JOBS_DIR']
+        assert not os.path.exists(jobsdir)
+        assert isinstance(ENV['FIXIE_NJOBS'], int)
+
+
+def test_ensure_parent_dir(tmpdir):
+    f = str(tmpdir.join('x', 'y', 'z.json'))
+    assert environ.ensure_parent_dir(f) == f
+    assert os.path.isdir(os.path.dirname(f))
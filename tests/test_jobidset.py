@@ -0,0 +1,76 @@
+"""Tests the compact jobid set."""
+import pickle
+import random
+
+import pytest
+
+from fixie.jobidset import JobidSet
+
+
+def test_add_discard(seed42):
+    s = JobidSet()
+    t = set()
+    for i in range(2000):
+        x = random.randrange(200)
+        if random.random() < 0.6:
+            s.add(x)
+            t.add(x)
+        else:
+            s.discard(x)
+            t.discard(x)
+        assert len(s) == len(t)
+    assert s == t
+    assert list(s) == sorted(t)
+    assert all((x in s) == (x in t) for x in range(-1, 201))
+    # ranges are disjoint and not adjacent
+    ranges = s.ranges()
+    assert all(a[1] < b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+def test_ranges():
+    s = JobidSet(range(10, 20))
+    assert s.ranges() == [(10, 20)]
+    s.add(20)
+    s.add(8)
+    assert s.ranges() == [(8, 9), (10, 21)]
+    s.add(9)
+    assert s.ranges() == [(8, 21)]
+    s.discard(15)
+    assert s.ranges() == [(8, 15), (16, 21)]
+    assert JobidSet.from_ranges([(5, 10), (0, 3), (2, 6)]).ranges() == [(0, 10)]
+    assert 'x' not in s
+    assert JobidSet([3, 1, 2, 2, 7]).ranges() == [(1, 4), (7, 8)]
+
+
+@pytest.mark.parametrize('op', ['|', '&', '-', '^'])
+def test_operators(seed42, op):
+    for i in range(50):
+        a = {random.randrange(100) for k in range(random.randrange(60))}
+        b = {random.randrange(100) for k in range(random.randrange(60))}
+        exp = eval('a {0} b'.format(op))
+        assert eval('JobidSet(a) {0} JobidSet(b)'.format(op)) == exp
+        assert eval('JobidSet(a) {0} b'.format(op)) == exp
+        assert eval('a {0} JobidSet(b)'.format(op)) == exp
+        s = JobidSet(a)
+        exec('s {0}= JobidSet(b)'.format(op))
+        assert s == exp
+
+
+def test_update():
+    s = JobidSet(range(5))
+    s.update([10, 11], range(5, 8))
+    assert s.ranges() == [(0, 8), (10, 12)]
+    s.difference_update({1, 2}, range(6, 11))
+    assert s.ranges() == [(0, 1), (3, 6), (11, 12)]
+    assert s.copy() == s
+    assert s.copy() is not s
+    s.clear()
+    assert len(s) == 0
+
+
+def test_pickle():
+    s = JobidSet(range(1000))
+    s.discard(500)
+    t = pickle.loads(pickle.dumps(s))
+    assert s == t
+    assert len(t) == 999
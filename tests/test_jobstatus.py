@@ -0,0 +1,128 @@
+"""Tests the job status stream."""
+import pytest
+import tornado.gen
+import tornado.web
+from tornado.httpclient import HTTPError
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.jobstatus import JOB_EVENTS, JobEvents, JobStatusHandler
+from fixie.tools import detached_call, register_job_alias, register_job_aliases
+import fixie.jsonutils as json
+
+
+SECRET = 'not-a-secret'
+APP = tornado.web.Application([
+    (r"/status", JobStatusHandler),
+], cookie_secret=SECRET)
+
+
+def cookie(user='me'):
+    value = tornado.web.create_signed_value(SECRET, 'user', user).decode('utf-8')
+    return {'Cookie': 'user=' + value}
+
+
+@pytest.fixture
+def app(registry, jobaliases):
+    with environ.context():
+        # the subscribers may only see the jobs that are aliased to them
+        register_job_aliases([(jobid, 'me', 'sim', '') for jobid in (42, 43, 44, 47)])
+        yield APP
+    JOB_EVENTS.states.clear()
+
+
+def test_publish_subscribe():
+    events = JobEvents()
+    queue = events.subscribe([1, 2])
+    events.publish({'jobid': 1, 'pid': 10, 'state': 'running', 'time': 0.0})
+    events.publish({'jobid': 3, 'pid': 11, 'state': 'running', 'time': 0.0})
+    assert queue.qsize() == 1
+    assert queue.get_nowait()['jobid'] == 1
+    assert set(events.states) == {1, 3}
+    events.unsubscribe(queue)
+    assert events.subscribers == {}
+
+
+@pytest.mark.gen_test
+def test_long_poll(http_client, base_url):
+    url = base_url + '/status'
+    detached_call(['sleep', '0.2'], jobid=42)
+    r = yield http_client.fetch(url, method='POST', body='{"jobids": [42]}',
+                                headers=cookie())
+    events = json.decode(r.body)['events']
+    assert [e['state'] for e in events] == ['running']
+    # wait for the exit
+    body = json.encode({'jobids': [42], 'since': events[-1]['time']})
+    r = yield http_client.fetch(url, method='POST', body=body, request_timeout=5,
+                                headers=cookie())
+    events = json.decode(r.body)['events']
+    assert [e['state'] for e in events] == ['exited']
+
+
+@pytest.mark.gen_test
+def test_long_poll_timeout(http_client, base_url):
+    with ENV.swap(FIXIE_LONGPOLL_TIMEOUT=0.1):
+        r = yield http_client.fetch(base_url + '/status', method='POST',
+                                    body='{"jobids": [43]}', headers=cookie())
+    assert json.decode(r.body) == {'events': [], 'timeout': True}
+
+
+@pytest.mark.gen_test
+def test_event_stream(http_client, base_url):
+    chunks = []
+    detached_call(['sleep', '0.2'], jobid=44)
+    r = yield http_client.fetch(base_url + '/status', method='POST',
+                                body='{"jobids": [44]}', request_timeout=5,
+                                headers=dict(cookie(), Accept='text/event-stream'),
+                                streaming_callback=chunks.append)
+    assert r.headers['Content-Type'] == 'text/event-stream'
+    data = b''.join(chunks).decode()
+    events = [json.decode(line[6:]) for line in data.splitlines()
+              if line.startswith('data: ')]
+    assert [e['state'] for e in events] == ['running', 'exited']
+
+
+@pytest.mark.gen_test
+def test_alias(http_client, base_url):
+    url = base_url + '/status'
+    register_job_alias(45, 'me', name='sim')
+    register_job_alias(46, 'you', name='sim')
+    JOB_EVENTS.publish({'jobid': 45, 'pid': 10, 'state': 'running', 'time': 1.0})
+    r = yield http_client.fetch(url, method='POST', headers=cookie('me'),
+                                body='{"user": "me", "name": "sim"}')
+    assert [e['jobid'] for e in json.decode(r.body)['events']] == [45]
+    # other users' aliases may not be looked up, nor by anonymous users
+    with pytest.raises(HTTPError) as e:
+        yield http_client.fetch(url, method='POST', headers=cookie('me'),
+                                body='{"user": "you", "name": "sim"}')
+    assert e.value.code == 403
+    with pytest.raises(HTTPError) as e:
+        yield http_client.fetch(url, method='POST', body='{"jobids": [45]}')
+    assert e.value.code == 401
+
+
+@pytest.mark.gen_test
+def test_other_users_jobids(http_client, base_url):
+    register_job_alias(48, 'you', name='sim')
+    JOB_EVENTS.publish({'jobid': 47, 'pid': 10, 'state': 'running', 'time': 1.0})
+    JOB_EVENTS.publish({'jobid': 48, 'pid': 11, 'state': 'running', 'time': 1.0})
+    r = yield http_client.fetch(base_url + '/status', method='POST', headers=cookie('me'),
+                                body='{"jobids": [47, 48]}')
+    assert [e['jobid'] for e in json.decode(r.body)['events']] == [47]
+
+
+@pytest.mark.gen_test
+def test_no_duplicate_events(http_client, base_url, monkeypatch):
+    event = {'jobid': 47, 'pid': 10, 'state': 'running', 'time': 1.0}
+    subscribe = JOB_EVENTS.subscribe
+
+    def racing_subscribe(jobids):
+        # the event is published between subscribing and the snapshot
+        queue = subscribe(jobids)
+        JOB_EVENTS.publish(event)
+        return queue
+
+    monkeypatch.setattr(JOB_EVENTS, 'subscribe', racing_subscribe)
+    r = yield http_client.fetch(base_url + '/status', method='POST', headers=cookie('me'),
+                                body='{"jobids": [47]}')
+    assert json.decode(r.body)['events'] == [event]
@@ -0,0 +1,125 @@
+"""Tests the jobid and alias journal."""
+import os
+import threading
+import multiprocessing
+
+import pytest
+import tornado.ioloop
+from tornado.gen import multi
+
+import fixie.jsonutils as json
+from fixie import environ
+from fixie.environ import ENV
+from fixie.journal import JOURNAL, Journal
+from fixie.tools import (next_jobid, next_jobids, register_job_alias,
+    register_job_aliases, remove_job_aliases, jobids_from_alias, jobids_with_name,
+    jobids_of_user, next_jobids_async, register_job_aliases_async, remove_job_aliases_async)
+
+
+@pytest.fixture
+def journal(tmpdir):
+    with environ.context(), ENV.swap(FIXIE_JOURNAL=True,
+                                     FIXIE_JOBID_FILE=str(tmpdir.join('id')),
+                                     FIXIE_JOB_ALIASES_FILE=str(tmpdir.join('aliases.json')),
+                                     FIXIE_JOURNAL_FILE=str(tmpdir.join('journal.json'))):
+        JOURNAL.clear()
+        JOURNAL.commits = 0
+        yield ENV['FIXIE_JOURNAL_FILE']
+    JOURNAL.clear()
+
+
+def test_jobids_and_aliases(journal):
+    assert 0 == next_jobid()
+    assert range(1, 4) == next_jobids(3)
+    register_job_alias(1, 'me', name='some-sim', project='myproj')
+    register_job_aliases([(2, 'me', 'some-sim', 'myproj'), (3, 'you', 'some-sim', '')])
+    assert jobids_from_alias('me', name='some-sim', project='myproj') == {1, 2}
+    assert jobids_with_name('some-sim') == {1, 2, 3}
+    assert jobids_of_user('me') == {1, 2}
+    remove_job_aliases({1, 3})
+    assert jobids_with_name('some-sim') == {2}
+    # the snapshot files are untouched, and another process sees the changes
+    assert not os.path.exists(ENV['FIXIE_JOBID_FILE'])
+    other = Journal()
+    assert other.jobids_from_alias('me', name='some-sim', project='myproj') == {2}
+    other.read()
+    assert other.next_jobid == 4
+
+
+def test_group_commit_threads(journal):
+    n = 20
+    barrier = threading.Barrier(n)
+    jobids = []
+
+    def allocate():
+        barrier.wait()
+        jobids.append(next_jobid())
+
+    threads = [threading.Thread(target=allocate) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(jobids) == list(range(n))
+    assert JOURNAL.commits < n
+
+
+def test_group_commit_async(journal):
+    n = 20
+
+    async def allocate():
+        results = await multi([next_jobids_async(1) for i in range(n)])
+        assert await register_job_aliases_async([(0, 'me', 'sim', '')])
+        assert await remove_job_aliases_async({0})
+        return results
+
+    results = tornado.ioloop.IOLoop.current().run_sync(allocate)
+    assert sorted(r[0] for r in results) == list(range(n))
+    assert JOURNAL.commits < n + 2
+    with open(journal) as f:
+        assert len(f.readlines()) == n + 2
+    assert jobids_from_alias('me', name='sim') == set()
+
+
+def test_compaction(journal):
+    with ENV.swap(FIXIE_JOURNAL_COMPACT_SIZE=5):
+        for i in range(6):
+            register_job_alias(next_jobid(), 'me', name='sim')
+    # the last compaction happened after the 10th record
+    with open(ENV['FIXIE_JOBID_FILE']) as f:
+        assert int(f.read()) == 5
+    with open(ENV['FIXIE_JOB_ALIASES_FILE']) as f:
+        assert json.load(f) == {'me': {'': {'sim': set(range(5))}}}
+    assert jobids_from_alias('me', name='sim') == set(range(6))
+    JOURNAL.compact()
+    assert os.path.getsize(journal) == 0
+    assert Journal().jobids_from_alias('me', name='sim') == set(range(6))
+
+
+def test_partial_record(journal):
+    next_jobid()
+    with open(journal, 'a') as f:
+        f.write('{"op": "jobids", "sta')
+    other = Journal()
+    assert next_jobid() == 1
+    other.read()
+    assert other.next_jobid == 2
+    with open(journal) as f:
+        assert all(line.endswith('}\n') for line in f)
+
+
+def _allocate(n, q):
+    JOURNAL.clear()
+    q.put([next_jobid() for i in range(n)])
+
+
+def test_processes(journal):
+    ctx = multiprocessing.get_context('fork')
+    q = ctx.Queue()
+    procs = [ctx.Process(target=_allocate, args=(10, q)) for i in range(4)]
+    for p in procs:
+        p.start()
+    jobids = sum([q.get() for p in procs], [])
+    for p in procs:
+        p.join()
+    assert sorted(jobids) == list(range(40))
@@ -2,6 +2,7 @@
 import uuid
 
 from fixie import jsonutils
+from fixie.jobidset import JobidSet
 
 
 def test_set():
@@ -12,6 +13,16 @@ def test_set():
     assert s == t
 
 
+def test_jobidset():
+    s = JobidSet(range(100000))
+    s.add(100001)
+    obs = jsonutils.dumps(s)
+    assert obs == '{"__jobidset__":true,"ranges":[[0,100000],[100001,100002]]}'
+    t = jsonutils.loads(obs)
+    assert isinstance(t, JobidSet)
+    assert s == t
+
+
 def test_bytes():
     s = b"some bytes"
     obs = jsonutils.dumps(s)
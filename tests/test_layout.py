@@ -0,0 +1,59 @@
+"""Tests storage layout tools."""
+import os
+
+import pytest
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.layout import shard_path, unshard_path, storage_path, migrate_layout
+from fixie.reaper import Reaper
+import fixie.jsonutils as json
+
+
+@pytest.mark.parametrize('path, layout, exp', [
+    ('/proj/42.h5', 'flat', '/proj/42.h5'),
+    ('/proj/42.h5', 'range', '/proj/0/42.h5'),
+    ('/proj/4242.h5', 'range', '/proj/4/4242.h5'),
+    ('/42.h5', 'range', '/0/42.h5'),
+    ('/proj/sim.h5', 'hash', '/proj/f8/fc/sim.h5'),
+    ('/proj/sim.h5', 'range', '/proj/f8/fc/sim.h5'),
+])
+def test_shard_path(path, layout, exp):
+    obs = shard_path(path, layout=layout, size=1000)
+    assert exp == obs
+    assert path == unshard_path(obs, layout=layout)
+
+
+def test_bad_layout():
+    with pytest.raises(ValueError):
+        shard_path('/x.h5', layout='nope', size=1000)
+
+
+def test_migrate_layout(tmpdir):
+    root = tmpdir.mkdir('sims')
+    expiry = str(tmpdir.join('expiry.json'))
+    old = {}
+    for path in ['/proj/42.h5', '/proj/sim.h5', '/1001.h5']:
+        f = storage_path(path, root=str(root), layout='flat', size=1000)
+        os.makedirs(os.path.dirname(f), exist_ok=True)
+        with open(f, 'w') as fh:
+            fh.write(path)
+        old[path] = f
+    with environ.context(), ENV.swap(FIXIE_EXPIRY_FILE=expiry, FIXIE_SHARD_SIZE=1000):
+        json.appendline({'created': 0, 'paths': [old['/proj/42.h5']]}, expiry)
+        reaper = Reaper(seed=False)
+        reaper.update()
+        moved = migrate_layout(str(root), 'flat', 'range')
+        assert len(moved) == 3
+        for path in old:
+            f = storage_path(path, root=str(root), layout='range')
+            with open(f) as fh:
+                assert fh.read() == path
+        new = storage_path('/proj/42.h5', root=str(root), layout='range')
+        assert json.loadlines(expiry)[0]['paths'] == [new]
+        # a running reaper rereads the replaced index
+        reaper.update()
+        assert [entry['paths'] for _, _, entry in reaper.heap] == [[new]]
+        # and back again
+        migrate_layout(str(root), 'range', 'flat')
+    assert sorted(os.listdir(str(root))) == ['1001.h5', 'proj']
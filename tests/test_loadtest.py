@@ -0,0 +1,23 @@
+"""Tests the load generator."""
+import pytest
+
+from fixie import loadtest
+
+
+@pytest.mark.parametrize('endpoint', ['name', 'verify'])
+def test_run(endpoint):
+    report = loadtest.run(requests=20, concurrency=4, payload=10, endpoint=endpoint)
+    assert report['errors'] == 0
+    assert sum(report['latency']['counts']) == 20
+    assert report['p50'] <= report['p99'] <= report['max']
+    assert report['lag']['count'] >= 0
+    s = loadtest.format_report(report)
+    assert 'latency histogram' in s
+    assert 'IOLoop lag' in s
+
+
+def test_percentile():
+    values = list(range(101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile([], 50) == 0.0
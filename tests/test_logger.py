@@ -0,0 +1,80 @@
+"""Tests the fixie logger."""
+import random
+
+import pytest
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.logger import LOGGER, DEBUG, INFO, WARNING, level_number
+
+
+class Unformattable:
+
+    def __format__(self, spec):
+        raise AssertionError('filtered messages should not be formatted')
+
+
+@pytest.fixture
+def logfile(tmpdir):
+    with environ.context(), ENV.swap(FIXIE_LOGFILE=str(tmpdir.join('log.json'))):
+        yield
+
+
+def test_levels(logfile):
+    LOGGER.log('hidden', category='test', level=DEBUG, args=(Unformattable(),))
+    LOGGER.log('shown {0}', category='test', args=(42,))
+    LOGGER.log('warned', category='test', level=WARNING)
+    entries = LOGGER.load()
+    assert [e['message'] for e in entries] == ['shown 42', 'warned']
+    assert [e['level'] for e in entries] == ['info', 'warning']
+    assert not LOGGER.enabled('test', DEBUG)
+    with ENV.swap(FIXIE_LOG_LEVEL='debug'):
+        assert LOGGER.enabled('test', DEBUG)
+        LOGGER.log('debugged', category='test', level=DEBUG)
+    assert LOGGER.load()[-1]['message'] == 'debugged'
+    assert not LOGGER.enabled('test', DEBUG)
+
+
+def test_category_levels(logfile):
+    with ENV.swap(FIXIE_LOG_CATEGORY_LEVELS='chatty:warning, verbose:debug'):
+        assert ENV['FIXIE_LOG_CATEGORY_LEVELS'] == {'chatty': 'warning',
+                                                    'verbose': 'debug'}
+        LOGGER.log('dropped', category='chatty', args=(Unformattable(),))
+        LOGGER.log('kept', category='chatty', level=WARNING)
+        LOGGER.log('detail', category='verbose', level=DEBUG)
+        LOGGER.log('other', category='misc', level=DEBUG)
+    assert [e['message'] for e in LOGGER.load()] == ['kept', 'detail']
+
+
+def test_sampling(logfile):
+    random.seed(42)
+    with ENV.swap(FIXIE_LOG_SAMPLING='chatty:0.1'):
+        assert ENV['FIXIE_LOG_SAMPLING'] == {'chatty': 0.1}
+        for i in range(1000):
+            LOGGER.log('sampled', category='chatty')
+        LOGGER.log('unsampled', category='misc')
+    entries = LOGGER.load()
+    sampled = [e for e in entries if e['category'] == 'chatty']
+    assert 50 < len(sampled) < 150
+    assert all(e['sample'] == 0.1 for e in sampled)
+    assert entries[-1]['message'] == 'unsampled'
+    assert 'sample' not in entries[-1]
+
+
+def test_bad_level_names(logfile):
+    with pytest.raises(ValueError):
+        ENV['FIXIE_LOG_LEVEL'] = 'warn'
+    with pytest.raises(ValueError):
+        ENV['FIXIE_LOG_CATEGORY_LEVELS'] = 'chatty:loud'
+    with ENV.swap(FIXIE_LOG_LEVEL='Warning'):
+        assert ENV['FIXIE_LOG_LEVEL'] == 'warning'
+    # logging still works
+    LOGGER.log('shown', category='test')
+    assert LOGGER.load()[-1]['message'] == 'shown'
+
+
+def test_level_number():
+    assert level_number('Warning') == WARNING
+    assert level_number(INFO) == INFO
+    with pytest.raises(ValueError):
+        level_number('loud')
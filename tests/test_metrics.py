@@ -0,0 +1,105 @@
+"""Tests fixie metrics."""
+import os
+import threading
+
+import pytest
+import tornado.web
+
+import fixie.jsonutils as json
+from fixie.metrics import Metrics, METRICS, MetricsHandler, render, HOSTNAME
+from fixie.request_handler import RequestHandler
+
+
+class HelloRequest(RequestHandler):
+
+    schema = {'name': {'type': 'string'}}
+
+    def post(self):
+        self.write({'hello': self.request.arguments['name']})
+
+
+APP = tornado.web.Application([
+    (r"/", HelloRequest),
+    (r"/metrics", MetricsHandler),
+])
+
+
+@pytest.fixture
+def app(tmpdir):
+    orig = METRICS._directory
+    METRICS.directory = str(tmpdir)
+    METRICS.clear()
+    yield APP
+    METRICS.directory = orig
+
+
+def test_render():
+    metrics = Metrics()
+    assert metrics is METRICS
+    metrics.clear()
+    metrics.inc('x_total', code=200)
+    metrics.inc('x_total', 2, code=200)
+    metrics.observe('y_seconds', 0.003)
+    metrics.observe('y_seconds', 100.0)
+    s = render(metrics.counters, metrics.histograms)
+    assert '# TYPE x_total counter\nx_total{code="200"} 3\n' in s
+    assert 'y_seconds_bucket{le="0.0025"} 0\n' in s
+    assert 'y_seconds_bucket{le="0.005"} 1\n' in s
+    assert 'y_seconds_bucket{le="+Inf"} 2\n' in s
+    assert 'y_seconds_count 2\n' in s
+    metrics.clear()
+
+
+def test_collect(tmpdir):
+    metrics = Metrics(str(tmpdir))
+    metrics.inc('x_total')
+    metrics.observe('y_seconds', 0.1)
+    # fake another live process (our parent) and a dead one
+    other = metrics.snapshot()
+    with open(str(tmpdir.join(HOSTNAME + '-' + str(os.getppid()) + '.json')), 'w') as f:
+        json.dump(other, f)
+    dead = tmpdir.join(HOSTNAME + '-999999999.json')
+    dead.write(json.dumps(other))
+    # the processes of other hosts are neither merged nor removed
+    remote = tmpdir.join('other-host.example.com-999999999.json')
+    remote.write(json.dumps(other))
+    counters, histograms = metrics.collect()
+    assert counters[('x_total', ())] == 2
+    assert histograms[('y_seconds', ())].count == 2
+    assert not dead.exists()
+    assert remote.exists()
+    metrics.dump()
+    assert tmpdir.join(HOSTNAME + '-' + str(os.getpid()) + '.json').exists()
+    metrics.clear()
+    metrics.directory = None
+
+
+def test_threads():
+    metrics = Metrics()
+    metrics.clear()
+
+    def record():
+        for i in range(10000):
+            metrics.inc('x_total')
+            metrics.observe('y_seconds', 0.001, thread=i % 10)
+
+    threads = [threading.Thread(target=record) for i in range(4)]
+    for t in threads:
+        t.start()
+    for i in range(100):
+        metrics.snapshot()
+    for t in threads:
+        t.join()
+    assert metrics.counters[('x_total', ())] == 40000
+    assert sum(h.count for h in metrics.histograms.values()) == 40000
+    metrics.clear()
+
+
+@pytest.mark.gen_test
+def test_metrics_handler(http_client, base_url):
+    yield http_client.fetch(base_url + '/', method='POST', body='{"name": "me"}')
+    response = yield http_client.fetch(base_url + '/metrics')
+    assert response.code == 200
+    body = response.body.decode()
+    assert 'fixie_requests_total{code="200",handler="HelloRequest"} 1' in body
+    assert 'fixie_request_duration_seconds_count{code="200",handler="HelloRequest"} 1' in body
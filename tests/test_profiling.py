@@ -0,0 +1,73 @@
+"""Tests request profiling in the request handler."""
+import os
+import pstats
+
+import pytest
+import tornado.gen
+import tornado.web
+from tornado.httpclient import HTTPClientError
+
+from fixie import environ
+from fixie import request_handler
+from fixie.environ import ENV
+from fixie.logger import LOGGER
+from fixie.request_handler import RequestHandler
+
+
+class ProfiledRequest(RequestHandler):
+
+    schema = {'name': {'type': 'string'}}
+
+    def post(self):
+        self.write({'hello': self.request.arguments['name']})
+
+
+class SlowRequest(RequestHandler):
+
+    schema = {}
+
+    async def post(self):
+        await tornado.gen.sleep(1.0)
+        self.write({})
+
+
+APP = tornado.web.Application([
+    (r"/", ProfiledRequest),
+    (r"/slow", SlowRequest),
+])
+
+
+@pytest.fixture
+def app(tmpdir):
+    with environ.context(), ENV.swap(FIXIE_PROFILE_DIR=str(tmpdir.join('profiles')),
+                                     FIXIE_LOGFILE=str(tmpdir.join('log.json')),
+                                     FIXIE_PROFILE_EVERY=2):
+        yield APP
+
+
+@pytest.mark.gen_test
+def test_sampled_profile(http_client, base_url):
+    for i in range(4):
+        yield http_client.fetch(base_url, method='POST', body='{"name": "me"}')
+    d = ENV['FIXIE_PROFILE_DIR']
+    files = sorted(os.listdir(d))
+    assert len(files) == 2
+    assert files[0].startswith('ProfiledRequest-')
+    stats = pstats.Stats(os.path.join(d, files[0]))
+    assert stats.total_calls > 0
+    entries = [e for e in LOGGER.load() if e['category'] == 'profile']
+    assert len(entries) == 2
+    assert entries[0]['data']['handler'] == 'ProfiledRequest'
+
+
+@pytest.mark.gen_test
+def test_closed_connection_stops_profile(http_client, base_url):
+    with ENV.swap(FIXIE_PROFILE_EVERY=0, FIXIE_PROFILE_THRESHOLD=100.0):
+        with pytest.raises(HTTPClientError):
+            yield http_client.fetch(base_url + '/slow', method='POST', body='{}',
+                                    request_timeout=0.2)
+        yield tornado.gen.sleep(0.1)
+        # the handler is still sleeping, but the profiler is released already
+        assert not request_handler._PROFILE_ACTIVE
+        yield http_client.fetch(base_url, method='POST', body='{"name": "me"}')
+        assert not request_handler._PROFILE_ACTIVE
@@ -0,0 +1,98 @@
+"""Tests the database reaper."""
+import os
+import time
+
+import pytest
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.tools import register_job_alias, jobids_from_alias
+from fixie.reaper import Reaper, register_expiry, index_tree, rewrite_index
+
+
+@pytest.fixture
+def reaperenv(tmpdir, jobaliases):
+    """A fixture that sets up a temporary expiry index and sims directory."""
+    simsdir = tmpdir.mkdir('sims')
+    with environ.context(), ENV.swap(FIXIE_EXPIRY_FILE=str(tmpdir.join('expiry.json')),
+                                     FIXIE_SIMS_DIR=str(simsdir),
+                                     FIXIE_PATHS_DIR=str(tmpdir.join('paths')),
+                                     FIXIE_HOLDING_TIME=100.0):
+        yield simsdir
+
+
+def make_db(simsdir, jobid):
+    f = simsdir.join(str(jobid) + '.h5')
+    f.write('db')
+    return str(f)
+
+
+def test_reap(reaperenv):
+    now = time.time()
+    reaper = Reaper(batch_size=2)
+    dbs = []
+    for jobid in range(3):
+        dbs.append(make_db(reaperenv, jobid))
+        register_job_alias(jobid, 'me', name='sim', project='proj')
+        register_expiry(dbs[-1], jobid=jobid, created=now - 1000 + jobid)
+    fresh = make_db(reaperenv, 3)
+    register_expiry(fresh, jobid=3, created=now)
+    register_job_alias(3, 'me', name='sim', project='proj')
+    # first batch is rate limited
+    expired = reaper.reap(now=now)
+    assert [e['jobid'] for e in expired] == [0, 1]
+    assert not os.path.exists(dbs[0])
+    assert not os.path.exists(dbs[1])
+    assert os.path.exists(dbs[2])
+    assert jobids_from_alias('me', name='sim', project='proj') == {2, 3}
+    # second batch picks up the rest, without touching fresh databases
+    expired = reaper.reap(now=now)
+    assert [e['jobid'] for e in expired] == [2]
+    assert os.path.exists(fresh)
+    assert jobids_from_alias('me', name='sim', project='proj') == {3}
+    assert reaper.reap(now=now) == []
+    # a new reaper reads the compacted index
+    assert len(Reaper().reap(now=now + 1000)) == 1
+    assert not os.path.exists(fresh)
+
+
+def test_rewritten_index(reaperenv):
+    now = time.time()
+    reaper = Reaper()
+    old = make_db(reaperenv, 0)
+    register_expiry(old, jobid=0, created=now)
+    assert reaper.reap(now=now) == []
+    # another writer replaces the index with a longer one, which must not be
+    # read from the old offset
+    new = make_db(reaperenv, 1)
+    entries = [{'created': now - 1000, 'paths': [new], 'jobid': 1, 'pad': 'x' * 100},
+               {'created': now, 'paths': [old], 'jobid': 0}]
+    rewrite_index(entries)
+    expired = reaper.reap(now=now)
+    assert [e['jobid'] for e in expired] == [1]
+    assert not os.path.exists(new)
+    assert os.path.exists(old)
+    # the compacted index keeps the entry that was not expired
+    assert len(Reaper().reap(now=now + 1000)) == 1
+
+
+def test_index_tree(tmpdir):
+    d = tmpdir.mkdir('sims')
+    d.mkdir('proj').join('42.h5').write('db')
+    d.join('other.h5').write('db')
+    entries = index_tree([str(d), str(tmpdir.join('missing'))])
+    assert len(entries) == 2
+    assert {e.get('jobid', None) for e in entries} == {42, None}
+
+
+@pytest.mark.gen_test
+def test_reap_in_executor(reaperenv):
+    db = make_db(reaperenv, 0)
+    register_expiry(db, created=time.time() - 1000)
+    reaper = Reaper()
+    future = reaper.reap_in_executor()
+    # only one reap runs at a time
+    assert reaper.reap_in_executor() is None
+    expired = yield future
+    assert len(expired) == 1
+    assert not os.path.exists(db)
@@ -0,0 +1,129 @@
+"""Tests the job registry."""
+import time
+
+import pytest
+
+from fixie.jobstatus import JOB_EVENTS
+import fixie.registry
+from fixie.registry import REGISTRY, JobRegistry
+from fixie.tools import flock
+
+
+def test_transitions(registry):
+    reg = JobRegistry()
+    assert reg.add(1, user='me', name='sim', project='proj', path='/proj/sim.h5')
+    job = reg.get(1)
+    assert job['state'] == 'submitted'
+    assert job['path'] == '/proj/sim.h5'
+    assert reg.transition(1, 'running', expected={'submitted'}, pid=42, started=1.0)
+    assert not reg.transition(1, 'running', expected={'submitted'})
+    assert reg.get(1)['pid'] == 42
+    with pytest.raises(ValueError):
+        reg.transition(1, 'bogus')
+    # other processes see the changes
+    other = JobRegistry()
+    assert other.get(1)['state'] == 'running'
+    assert other.by_state == {'submitted': set(), 'running': {1}}
+
+
+def make_jobs(reg, n):
+    reg.add_many([{'jobid': i, 'user': 'user' + str(i % 3), 'submitted': float(i),
+                   'state': 'running' if i % 2 else 'exited'} for i in range(n)])
+
+
+def test_query(registry):
+    reg = JobRegistry()
+    make_jobs(reg, 100)
+    jobs = reg.query(user='user1', limit=5)
+    assert [j['jobid'] for j in jobs] == [97, 94, 91, 88, 85]
+    jobs = reg.query(user='user1', offset=5, limit=2)
+    assert [j['jobid'] for j in jobs] == [82, 79]
+    jobs = reg.query(user='user1', state='running', since=10.0, until=30.0, newest=False)
+    assert [j['jobid'] for j in jobs] == [13, 19, 25]
+    # the time range is smaller than the filtered jobs
+    jobs = reg.query(state='exited', since=10.0, until=15.0)
+    assert [j['jobid'] for j in jobs] == [14, 12, 10]
+    jobs = reg.query(since=98.0)
+    assert [j['jobid'] for j in jobs] == [99, 98]
+    assert reg.query(user='nobody') == []
+    # finish times
+    reg.transition(3, 'exited', finished=200.0)
+    reg.transition(5, 'exited', finished=100.0)
+    jobs = reg.query(by='finished', since=50.0, state='exited')
+    assert [j['jobid'] for j in jobs] == [3, 5]
+
+
+def test_compact(registry):
+    reg = JobRegistry()
+    make_jobs(reg, 10)
+    reg.transition(3, 'exited')
+    other = JobRegistry()
+    other.update()
+    assert reg.compact()
+    with open(registry) as f:
+        assert len(f.readlines()) == 10
+    other.transition(4, 'failed')
+    assert reg.get(4)['state'] == 'failed'
+    assert reg.get(3)['state'] == 'exited'
+    assert reg.by_state['exited'] == {0, 2, 3, 6, 8}
+
+
+def test_auto_compact(registry, monkeypatch):
+    monkeypatch.setattr(fixie.registry, 'COMPACT_LINES', 20)
+    reg = JobRegistry()
+    make_jobs(reg, 5)
+    for i in range(20):
+        reg.transition(i % 5, 'running', pid=i)
+    with open(registry) as f:
+        assert len(f.readlines()) <= 10
+    other = JobRegistry()
+    assert other.get(4)['pid'] == 19
+    assert other.query(state='running', limit=10) == reg.query(state='running', limit=10)
+
+
+def test_job_events(registry):
+    JOB_EVENTS.publish({'jobid': 7, 'pid': 70, 'state': 'running', 'time': 1.0})
+    JOB_EVENTS.publish({'jobid': 7, 'pid': 70, 'state': 'exited', 'time': 2.0})
+    REGISTRY.flush_events(timeout=10.0)
+    job = REGISTRY.get(7)
+    assert job['state'] == 'exited'
+    assert job['pid'] == 70
+    assert job['started'] == 1.0
+    assert job['finished'] == 2.0
+
+
+def test_usage_summary(registry):
+    reg = JobRegistry()
+    for i in range(6):
+        usage = {'returncode': i % 3 == 0, 'cpu_time': 1.0 + i, 'wall_time': 2.0 * i,
+                 'max_rss': 100 * (i + 1), 'read_blocks': i, 'write_blocks': 1}
+        reg.add(i, user='user' + str(i % 2), project='proj')
+        reg.transition(i, 'exited', finished=float(i), returncode=usage['returncode'],
+                       usage=usage)
+    reg.add(6, user='user0', project='proj')
+    summary = reg.usage_summary()
+    assert set(summary) == {'user0', 'user1'}
+    s = summary['user0']
+    assert s['jobs'] == 3
+    assert s['failed'] == 1
+    assert s['cpu_time'] == 1.0 + 3.0 + 5.0
+    assert s['mean_wall_time'] == (0.0 + 4.0 + 8.0) / 3
+    assert s['max_rss'] == 500
+    assert s['mean_max_rss'] == 300.0
+    assert s['read_blocks'] == 6
+    summary = reg.usage_summary(by='project', since=2.0, until=4.0)
+    assert summary['proj']['jobs'] == 2
+    assert summary['proj']['failed'] == 1
+    with pytest.raises(ValueError):
+        reg.usage_summary(by='name')
+
+
+def test_job_events_off_loop(registry):
+    REGISTRY.add(8, user='me')
+    with flock(REGISTRY.filename):
+        t0 = time.time()
+        JOB_EVENTS.publish({'jobid': 8, 'pid': 80, 'state': 'running', 'time': 1.0})
+        assert time.time() - t0 < 1.0
+        assert REGISTRY.jobs[8]['state'] == 'submitted'
+    REGISTRY.flush_events(timeout=10.0)
+    assert REGISTRY.get(8)['state'] == 'running'
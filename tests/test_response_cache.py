@@ -0,0 +1,173 @@
+"""Tests the response cache."""
+import pytest
+import tornado.gen
+import tornado.web
+from tornado.httpclient import HTTPError
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.request_handler import RequestHandler, authenticated
+from fixie.response_cache import RESPONSE_CACHE, ResponseCache, cached
+
+
+CALLS = []
+SECRET = 'not-a-secret'
+
+
+class StatusRequest(RequestHandler):
+
+    schema = {'jobid': {'type': 'integer'}, 'user': {'type': 'string'}}
+
+    @cached(ttl=60.0, tags=['job:{jobid}'])
+    def post(self):
+        jobid = self.request.arguments.get('jobid', None)
+        CALLS.append(jobid)
+        self.write({'jobid': jobid, 'calls': len(CALLS)})
+
+
+class AsyncStatusRequest(StatusRequest):
+
+    @cached(ttl=60.0)
+    @tornado.gen.coroutine
+    def post(self):
+        yield tornado.gen.sleep(0.01)
+        CALLS.append(self.request.arguments['jobid'])
+        self.write({'jobid': self.request.arguments['jobid'], 'calls': len(CALLS)})
+
+
+class RacingStatusRequest(StatusRequest):
+
+    @cached(ttl=60.0, tags=['job:{jobid}'])
+    async def post(self):
+        jobid = self.request.arguments['jobid']
+        CALLS.append(jobid)
+        self.write({'jobid': jobid, 'calls': len(CALLS)})
+        # the job changes while the response is being made
+        await tornado.gen.sleep(0.01)
+        RESPONSE_CACHE.invalidate('job:' + str(jobid))
+
+
+class UserStatusRequest(StatusRequest):
+
+    @cached(ttl=60.0)
+    @authenticated
+    def post(self):
+        CALLS.append(self.request.arguments['jobid'])
+        self.write({'user': self.current_user.decode('utf-8'), 'calls': len(CALLS)})
+
+
+APP = tornado.web.Application([
+    (r"/", StatusRequest),
+    (r"/async", AsyncStatusRequest),
+    (r"/racing", RacingStatusRequest),
+    (r"/user", UserStatusRequest),
+], cookie_secret=SECRET)
+
+
+def cookie(user):
+    value = tornado.web.create_signed_value(SECRET, 'user', user).decode('utf-8')
+    return {'Cookie': 'user=' + value}
+
+
+@pytest.fixture
+def app():
+    CALLS.clear()
+    RESPONSE_CACHE.clear()
+    with environ.context():
+        yield APP
+    RESPONSE_CACHE.clear()
+
+
+def test_expiry_and_eviction():
+    cache = ResponseCache(size=2)
+    cache.put('a', b'1', ttl=1.0, now=0.0)
+    assert cache.get('a', now=0.5).body == b'1'
+    assert cache.get('a', now=1.0) is None
+    cache.put('a', b'1', now=0.0, ttl=10.0)
+    cache.put('b', b'2', now=0.0, ttl=10.0, tags=['x'])
+    cache.get('a', now=0.0)
+    cache.put('c', b'3', now=0.0, ttl=10.0, tags=['x'])
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.tags == {'x': {'c'}}
+    assert cache.invalidate('x', 'y') == 1
+    assert cache.tags == {}
+
+
+@pytest.mark.gen_test
+def test_cached_response(http_client, base_url):
+    # key order should not matter
+    r1 = yield http_client.fetch(base_url, method='POST',
+                                 body='{"jobid": 42, "user": "me"}')
+    r2 = yield http_client.fetch(base_url, method='POST',
+                                 body='{"user": "me", "jobid": 42}')
+    assert r1.body == r2.body
+    assert r1.headers['Etag'] == r2.headers['Etag']
+    assert CALLS == [42]
+    # different arguments are a miss
+    yield http_client.fetch(base_url, method='POST', body='{"jobid": 43}')
+    assert CALLS == [42, 43]
+    # invalidating the tag evicts the entry
+    RESPONSE_CACHE.invalidate('job:42')
+    r3 = yield http_client.fetch(base_url, method='POST',
+                                 body='{"jobid": 42, "user": "me"}')
+    assert CALLS == [42, 43, 42]
+    assert r3.headers['Etag'] != r1.headers['Etag']
+
+
+@pytest.mark.gen_test
+def test_not_modified(http_client, base_url):
+    r1 = yield http_client.fetch(base_url + '/async', method='POST',
+                                 body='{"jobid": 42}')
+    with pytest.raises(HTTPError) as e:
+        yield http_client.fetch(base_url + '/async', method='POST', body='{"jobid": 42}',
+                                headers={'If-None-Match': r1.headers['Etag']})
+    assert e.value.code == 304
+    assert not e.value.response.body
+    assert CALLS == [42]
+
+
+@pytest.mark.gen_test
+def test_invalidated_while_running(http_client, base_url):
+    url = base_url + '/racing'
+    yield http_client.fetch(url, method='POST', body='{"jobid": 42}')
+    yield http_client.fetch(url, method='POST', body='{"jobid": 42}')
+    assert CALLS == [42, 42]
+    assert len(RESPONSE_CACHE.entries) == 0
+    assert RESPONSE_CACHE.watches == {}
+
+
+def test_watch():
+    cache = ResponseCache()
+    watch = cache.watch(['x'])
+    cache.invalidate('x')
+    cache.put('a', b'1', tags=['x'], watch=watch)
+    assert 'a' not in cache.entries
+    cache.put('a', b'1', tags=['x'], watch=cache.watch(['x', 'y']))
+    assert 'a' in cache.entries
+    assert cache.watches == {}
+
+
+@pytest.mark.gen_test
+def test_missing_tag_argument(http_client, base_url):
+    r = yield http_client.fetch(base_url, method='POST', body='{"user": "me"}')
+    assert r.code == 200
+    assert len(RESPONSE_CACHE.entries) == 1
+    assert RESPONSE_CACHE.tags == {}
+
+
+@pytest.mark.gen_test
+def test_cached_per_user(http_client, base_url):
+    url = base_url + '/user'
+    body = '{"jobid": 42}'
+    r1 = yield http_client.fetch(url, method='POST', body=body, headers=cookie('me'))
+    r2 = yield http_client.fetch(url, method='POST', body=body, headers=cookie('you'))
+    r3 = yield http_client.fetch(url, method='POST', body=body, headers=cookie('me'))
+    assert b'"me"' in r1.body
+    assert b'"you"' in r2.body
+    assert r3.body == r1.body
+    assert CALLS == [42, 42]
+    # the cached responses are not served without a user
+    with pytest.raises(HTTPError) as e:
+        yield http_client.fetch(url, method='POST', body=body)
+    assert e.value.code == 401
+    assert CALLS == [42, 42]
@@ -0,0 +1,95 @@
+"""Tests the content-addressed result cache."""
+import os
+import time
+
+import pytest
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.tools import jobids_from_alias
+from fixie.results import ResultCache, input_hash, link_path
+from fixie.metrics import METRICS
+
+
+@pytest.fixture
+def cache(tmpdir, jobaliases):
+    """A fixture that provides a result cache in a temporary directory."""
+    with environ.context(), ENV.swap(FIXIE_EXPIRY_FILE=str(tmpdir.join('expiry.json')),
+                                     FIXIE_RESULT_CACHE_TIME=100.0):
+        yield ResultCache(str(tmpdir.join('results')))
+
+
+def test_input_hash():
+    assert input_hash({'a': 1, 'b': [1, 2]}) == input_hash({'b': [1, 2], 'a': 1})
+    assert input_hash({'a': 1}) != input_hash({'a': 2})
+
+
+def test_satisfy(cache, tmpdir):
+    deck = {'simulation': {'duration': 10}}
+    db = tmpdir.join('0.h5')
+    db.write('db')
+    newdb = str(tmpdir.join('proj', '1.h5'))
+    # miss
+    assert cache.satisfy(deck, newdb, 1, 'me', name='sim') is None
+    cache.put(deck, str(db), 0)
+    # hit
+    entry = cache.satisfy(dict(deck), newdb, 1, 'me', name='sim')
+    assert entry['jobid'] == 0
+    with open(newdb) as f:
+        assert f.read() == 'db'
+    assert jobids_from_alias('me', name='sim') == {1}
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0, 'hit_rate': 0.5}
+
+
+def test_satisfy_reaped(cache, tmpdir, monkeypatch):
+    deck = {'simulation': {'duration': 10}}
+    db = tmpdir.join('0.h5')
+    db.write('db')
+    cache.put(deck, str(db), 0)
+
+    def reaped(src, dst):
+        raise FileNotFoundError(src)
+
+    # the database is removed between the lookup and the link
+    monkeypatch.setattr('fixie.results.link_path', reaped)
+    misses = METRICS.counters.get(('fixie_result_cache_total', (('result', 'miss'),)), 0)
+    assert cache.satisfy(deck, str(tmpdir.join('1.h5')), 1, 'me', name='sim') is None
+    assert cache.stats() == {'hits': 0, 'misses': 1, 'evictions': 1, 'hit_rate': 0.0}
+    assert METRICS.counters[('fixie_result_cache_total', (('result', 'miss'),))] == misses + 1
+
+
+def test_link_path_copies(tmpdir, monkeypatch):
+    db = tmpdir.join('0.h5')
+    db.write('db')
+    newdb = str(tmpdir.join('proj', '1.h5'))
+
+    def cross_device(src, dst):
+        raise OSError('cross-device link')
+
+    monkeypatch.setattr(os, 'link', cross_device)
+    link_path(str(db), newdb)
+    assert not os.path.islink(newdb)
+    # reaping the original leaves the new database in place
+    db.remove()
+    with open(newdb) as f:
+        assert f.read() == 'db'
+
+
+def test_eviction(cache, tmpdir):
+    db = tmpdir.join('0.h5')
+    db.write('db')
+    cache.put('old', str(db), 0, created=time.time() - 1000)
+    cache.put('gone', str(tmpdir.join('missing.h5')), 1)
+    cache.put('new', str(db), 2)
+    assert cache.evict() == 2
+    assert cache.get('old') is None
+    assert cache.get('new')['jobid'] == 2
+
+
+@pytest.mark.gen_test
+def test_evict_in_executor(cache, tmpdir):
+    cache.put('gone', str(tmpdir.join('missing.h5')), 1)
+    future = cache.evict_in_executor()
+    # only one eviction runs at a time
+    assert cache.evict_in_executor() is None
+    assert (yield future) == 1
@@ -0,0 +1,99 @@
+"""Tests the session cache and cookie secret."""
+import os
+import time
+
+import pytest
+import tornado.web
+from tornado.httpclient import HTTPError
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.request_handler import RequestHandler, authenticated
+from fixie.sessions import SESSIONS, cookie_timestamp
+from fixie.tools import cookie_secret, SECRET_LENGTH
+
+
+SECRET = 'not-a-very-secret-secret'
+
+
+class WhoAmIRequest(RequestHandler):
+
+    schema = {}
+
+    @authenticated
+    def get(self):
+        self.write({'user': self.current_user.decode('utf-8')})
+
+
+APP = tornado.web.Application([
+    (r"/", WhoAmIRequest),
+], cookie_secret=SECRET)
+
+
+@pytest.fixture
+def app():
+    SESSIONS.clear()
+    with environ.context():
+        yield APP
+    SESSIONS.clear()
+
+
+def cookie(user, clock=None):
+    value = tornado.web.create_signed_value(SECRET, 'user', user, clock=clock)
+    return value.decode('utf-8')
+
+
+def test_cookie_timestamp():
+    for version in (1, 2):
+        value = tornado.web.create_signed_value(SECRET, 'user', 'me', version=version,
+                                                clock=lambda: 1500000000)
+        assert cookie_timestamp(value) == 1500000000
+
+
+@pytest.mark.gen_test
+def test_cached_session(http_client, base_url):
+    raw = cookie('me')
+    for i in range(2):
+        r = yield http_client.fetch(base_url, headers={'Cookie': 'user=' + raw})
+        assert b'"me"' in r.body
+    (user, expires), = SESSIONS.sessions.values()
+    assert user == b'me'
+    assert expires == pytest.approx(cookie_timestamp(raw) +
+                                    ENV['FIXIE_COOKIE_MAX_AGE_DAYS'] * 86400)
+    # cached sessions skip verification
+    SESSIONS.sessions[('user', raw)] = (b'cached', expires)
+    r = yield http_client.fetch(base_url, headers={'Cookie': 'user=' + raw})
+    assert b'"cached"' in r.body
+
+
+@pytest.mark.gen_test
+def test_invalid_sessions(http_client, base_url):
+    old = cookie('me', clock=lambda: time.time() - 40 * 86400)
+    for raw in (old, cookie('me')[:-2] + 'xx'):
+        with pytest.raises(HTTPError) as e:
+            yield http_client.fetch(base_url, headers={'Cookie': 'user=' + raw})
+        assert e.value.code == 401
+    assert len(SESSIONS.sessions) == 0
+
+
+def test_cookie_secret(tmpdir, capsys):
+    f = str(tmpdir.join('secret'))
+    with environ.context(), ENV.swap(FIXIE_COOKIE_SECRET_FILE=f):
+        secret = cookie_secret()
+        assert len(secret) == SECRET_LENGTH
+        assert os.stat(f).st_mode & 0o777 == 0o600
+        with open(f) as fh:
+            assert fh.read() == secret
+        # loaded only once
+        os.remove(f)
+        assert cookie_secret() == secret
+    assert secret not in capsys.readouterr().out
+
+
+def test_cookie_secret_is_reused(tmpdir):
+    f = str(tmpdir.join('secret'))
+    secret = 'x' * SECRET_LENGTH
+    with open(f, 'w') as fh:
+        fh.write(secret + '\n')
+    with environ.context(), ENV.swap(FIXIE_COOKIE_SECRET_FILE=f):
+        assert cookie_secret() == secret
@@ -0,0 +1,74 @@
+"""Tests the job supervisor's resource accounting."""
+import os
+import sys
+import time
+
+import pytest
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.logger import LOGGER
+from fixie.registry import REGISTRY
+from fixie.supervisor import cgroup_stats
+from fixie.tools import detached_call
+import fixie.jsonutils as json
+
+
+def wait_for_usage(jobid, timeout=10.0):
+    """Waits for the usage of a job to be in the registry and the log."""
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        job = REGISTRY.get(jobid)
+        # LOGGER.load() only notices this process's writes
+        entries = []
+        if os.path.isfile(LOGGER.filename):
+            entries = [e for e in json.loadlines(LOGGER.filename)
+                       if e['category'] == 'usage']
+        if job is not None and 'usage' in job and entries:
+            return job, entries
+        time.sleep(0.01)
+    raise TimeoutError('usage of job {0} was not recorded'.format(jobid))
+
+
+def test_usage(registry, tmpdir):
+    code = 'x = bytearray(64 * 2**20); sum(range(10**6)); raise SystemExit(3)'
+    with environ.context(), ENV.swap(FIXIE_LOGFILE=str(tmpdir.join('log.json'))):
+        REGISTRY.clear()
+        pid = detached_call([sys.executable, '-c', code], jobid=7, watch=False)
+        assert pid != 0
+        job, entries = wait_for_usage(7)
+    assert job['state'] == 'exited'
+    assert job['returncode'] == 3
+    usage = job['usage']
+    assert usage['pid'] == pid
+    assert usage['max_rss'] >= 64 * 2**20
+    assert usage['cpu_time'] > 0.0
+    assert usage['wall_time'] >= usage['cpu_time'] * 0.5
+    assert job['finished'] == usage['finished']
+    assert len(entries) == 1
+    assert entries[0]['data']['jobid'] == 7
+    assert entries[0]['data']['returncode'] == 3
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self'), reason='requires /proc')
+def test_fresh_supervisor():
+    with environ.context():
+        pid = detached_call(['sleep', '1'])
+    with open('/proc/{0}/stat'.format(pid)) as f:
+        ppid = int(f.read().rpartition(')')[2].split()[1])
+    # the supervisor is forked by the supervisor server, rather than this process
+    with open('/proc/{0}/cmdline'.format(ppid), 'rb') as f:
+        cmdline = f.read().split(b'\0')
+    assert b'fixie.supervisor' in cmdline
+    assert ppid != os.getpid()
+
+
+def test_cgroup_stats(tmpdir):
+    tmpdir.join('cpu.stat').write('usage_usec 2500000\nuser_usec 2000000\n'
+                                  'system_usec 500000\n')
+    tmpdir.join('memory.peak').write('1048576\n')
+    tmpdir.join('io.stat').write('8:0 rbytes=4096 wbytes=8192 rios=1 wios=2\n'
+                                 '8:16 rbytes=4096 wbytes=0 rios=1 wios=0\n')
+    assert cgroup_stats(str(tmpdir)) == {'cpu_time': 2.5, 'memory_peak': 1048576,
+                                         'read_bytes': 8192, 'write_bytes': 8192}
+    assert cgroup_stats(str(tmpdir.join('missing'))) == {}
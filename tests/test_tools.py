@@ -8,11 +8,14 @@ import tornado.web
 from tornado.httpclient import HTTPError
 
 import fixie.jsonutils as json
+from fixie import environ
 from fixie.environ import ENV
 from fixie.request_handler import RequestHandler
+from fixie.jobidset import JobidSet
 from fixie.tools import (fetch, verify_user_remote, verify_user_local, flock,
-    next_jobid, detached_call, waitpid, register_job_alias, jobids_from_alias,
-    jobids_with_name, default_path)
+    next_jobid, next_jobids, detached_call, waitpid, register_job_alias,
+    register_job_aliases, remove_job_aliases, jobids_from_alias, jobids_with_name, default_path,
+    jobids_of_user)
 try:
     from fixie_creds.cache import CACHE
     HAVE_CREDS = True
@@ -125,6 +128,12 @@ def test_next_jobid(jobfile):
     assert 3 == n
 
 
+def test_next_jobids(jobfile):
+    assert 0 == next_jobid()
+    assert range(1, 11) == next_jobids(10)
+    assert 11 == next_jobid()
+
+
 def test_job_aliases(jobaliases):
     register_job_alias(1, 'me', name='some-sim', project='myproj')
     register_job_alias(42, 'me', name='some-sim', project='myproj')
@@ -138,6 +147,8 @@ def test_job_aliases(jobaliases):
     assert jids == {1, 42, 43}
     jids = jobids_with_name('bad-name')
     assert jids == set()
+    assert jobids_of_user('you') == {43}
+    assert jobids_of_user('nobody') == set()
 
 
 def test_detached_call():
@@ -151,6 +162,11 @@ def test_detached_call():
     assert 'FIXIE_DETACHED_CALL=test' in s
 
 
+def test_detached_call_error():
+    with pytest.raises(RuntimeError):
+        detached_call(['fixie-no-such-executable'])
+
+
 @pytest.mark.parametrize('path, name, project, jobid, exp', [
     ('x', '', '', -1, '/x'),
     ('/y', '', '', -1, '/y'),
@@ -163,3 +179,41 @@ def test_detached_call():
 def test_default_path(path, name, project, jobid, exp):
     obs = default_path(path, name=name, project=project, jobid=jobid)
     assert exp == obs
+
+
+def test_next_jobid_makes_dirs(tmpdir):
+    f = str(tmpdir.join('jobs', 'id'))
+    with environ.context(), ENV.swap(FIXIE_JOBID_FILE=f):
+        assert 0 == next_jobid()
+    assert os.path.isfile(f)
+
+
+def test_remove_job_aliases(jobaliases):
+    register_job_alias(1, 'me', name='some-sim', project='myproj')
+    register_job_alias(2, 'me', name='some-sim', project='myproj')
+    register_job_alias(3, 'you', name='other-sim')
+    assert remove_job_aliases({1, 3})
+    assert jobids_from_alias('me', name='some-sim', project='myproj') == {2}
+    with open(jobaliases) as f:
+        cache = json.load(f)
+    assert 'you' not in cache
+
+
+def test_register_job_aliases(jobaliases):
+    assert register_job_aliases([(1, 'me', 'some-sim', 'myproj'),
+                                 (2, 'me', 'some-sim', 'myproj'),
+                                 (3, 'you', 'other-sim', '')])
+    assert jobids_from_alias('me', name='some-sim', project='myproj') == {1, 2}
+    assert jobids_from_alias('you', name='other-sim') == {3}
+
+
+def test_job_aliases_legacy_sets(jobaliases):
+    # alias files written before jobid sets existed store plain sets
+    with open(jobaliases, 'w') as f:
+        json.dump({'me': {'': {'some-sim': {1, 2}}}}, f)
+    assert isinstance(jobids_from_alias('me', name='some-sim'), JobidSet)
+    register_job_aliases([(jobid, 'me', 'some-sim', '') for jobid in range(3, 1000)])
+    assert jobids_from_alias('me', name='some-sim') == set(range(1, 1000))
+    with open(jobaliases) as f:
+        s = f.read()
+    assert s == '{"me":{"":{"some-sim":{"__jobidset__":true,"ranges":[[1,1000]]}}}}'
@@ -0,0 +1,73 @@
+"""Tests request tracing."""
+import pytest
+import tornado.web
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.request_handler import RequestHandler
+from fixie.tools import fetch, flock
+from fixie.tracing import (span, current, load_traces, critical_path,
+    format_trace, TRACE_HEADER)
+
+
+class InnerRequest(RequestHandler):
+
+    schema = {'name': {'type': 'string'}}
+
+    def post(self):
+        with span('work'):
+            self.write({'nomen': 'My name is ' + self.request.arguments['name']})
+
+
+class OuterRequest(RequestHandler):
+
+    schema = {'url': {'type': 'string'}}
+
+    async def post(self):
+        rtn = await fetch(self.request.arguments['url'], {'name': 'Inigo'})
+        self.write(rtn)
+
+
+APP = tornado.web.Application([
+    (r"/inner", InnerRequest),
+    (r"/outer", OuterRequest),
+])
+
+
+@pytest.fixture
+def app(tmpdir):
+    with environ.context(), ENV.swap(FIXIE_TRACE=True,
+                                     FIXIE_TRACE_FILE=str(tmpdir.join('trace.json'))):
+        yield APP
+
+
+def test_span_nesting(tmpdir):
+    with environ.context(), ENV.swap(FIXIE_TRACE=True,
+                                     FIXIE_TRACE_FILE=str(tmpdir.join('trace.json'))):
+        with span('outer') as outer:
+            with flock(str(tmpdir.join('x')), timeout=1.0):
+                assert current()[0] == outer.trace
+        assert current() is None
+        traces = load_traces([ENV['FIXIE_TRACE_FILE']])
+    records, = traces.values()
+    assert [r['name'] for r in critical_path(records)] == ['outer', 'lock']
+
+
+def test_span_disabled():
+    with span('nothing') as s:
+        assert s is None
+
+
+@pytest.mark.gen_test
+def test_trace_propagation(http_client, base_url):
+    body = '{"url": "' + base_url + '/inner"}'
+    response = yield http_client.fetch(base_url + '/outer', method='POST', body=body,
+                                       headers={TRACE_HEADER: 'abc'})
+    assert response.code == 200
+    traces = load_traces([ENV['FIXIE_TRACE_FILE']])
+    assert list(traces.keys()) == ['abc']
+    records = traces['abc']
+    names = [r['name'] for r in critical_path(records)]
+    assert names == ['request', 'handler', 'fetch', 'request', 'handler', 'work']
+    assert 'InnerRequest' in str(records)
+    assert '*' in format_trace(records)
@@ -0,0 +1,48 @@
+"""Tests the Unix domain socket transport."""
+from urllib.parse import quote
+
+import pytest
+import tornado.web
+import tornado.httpserver
+from tornado.netutil import bind_unix_socket
+
+from fixie import unix
+from fixie.request_handler import RequestHandler
+from fixie.tools import fetch
+
+
+class NameObjectRequest(RequestHandler):
+
+    schema = {'name': {'type': 'string'}}
+
+    def post(self):
+        self.write({'nomen': 'My name is ' + self.request.arguments['name']})
+
+
+@pytest.fixture
+def unix_socket(io_loop, tmpdir):
+    path = str(tmpdir.join('fixie.sock'))
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([
+        (r'/name', NameObjectRequest)]))
+    server.add_socket(bind_unix_socket(path))
+    yield path
+    server.stop()
+
+
+@pytest.mark.gen_test
+def test_fetch(unix_socket):
+    for base in ['unix://' + unix_socket, 'unix://' + quote(unix_socket, safe='')]:
+        response = yield fetch(base + '/name', {'name': 'Inigo Montoya'})
+        assert response == {'nomen': 'My name is Inigo Montoya'}
+
+
+def test_split_url(tmpdir):
+    path = str(tmpdir.join('a.sock'))
+    bind_unix_socket(path).close()
+    assert unix.split_url('unix://' + path + '/x/y?z=1') == (path, '/x/y?z=1')
+    assert unix.split_url('unix://' + path) == (path, '/')
+    assert unix.split_url('unix://' + quote(path, safe='') + '/x') == (path, '/x')
+    with pytest.raises(ValueError):
+        unix.split_url('unix://' + str(tmpdir.join('nope')) + '/x')
+    with pytest.raises(ValueError):
+        unix.split_url('http://localhost/x')
@@ -0,0 +1,47 @@
+"""Tests the IOLoop watchdog."""
+import time
+
+import tornado.ioloop
+
+from fixie import environ
+from fixie.environ import ENV
+from fixie.logger import LOGGER
+from fixie.metrics import METRICS
+from fixie.watchdog import Watchdog
+
+
+def blocking_callback():
+    time.sleep(0.3)
+
+
+def test_stall_is_reported(tmpdir):
+    with environ.context(), ENV.swap(FIXIE_LOGFILE=str(tmpdir.join('log.json')),
+                                     FIXIE_STALL_THRESHOLD=0.1):
+        loop = tornado.ioloop.IOLoop()
+        loop.make_current()
+        dog = Watchdog()
+        dog.start()
+        loop.call_later(0.1, blocking_callback)
+        loop.call_later(0.6, loop.stop)
+        loop.start()
+        dog.stop()
+        loop.close()
+        entries = [e for e in LOGGER.load() if e['category'] == 'stall']
+    assert dog.stalls == 1
+    assert len(entries) == 1
+    assert entries[0]['data']['duration'] >= 0.2
+    assert 'blocking_callback' in entries[0]['data']['stack']
+    assert METRICS.counters[('fixie_ioloop_stalls_total', ())] >= 1
+
+
+def test_no_stall(tmpdir):
+    with environ.context(), ENV.swap(FIXIE_LOGFILE=str(tmpdir.join('log.json'))):
+        loop = tornado.ioloop.IOLoop()
+        loop.make_current()
+        dog = Watchdog(threshold=0.2)
+        dog.start()
+        loop.call_later(0.3, loop.stop)
+        loop.start()
+        dog.stop()
+        loop.close()
+    assert dog.stalls == 0